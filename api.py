@@ -0,0 +1,569 @@
+"""Headless HTTP/JSON API over the chat pipeline
+
+Same pipeline as the Streamlit app (core.py), without the UI. Run with
+several worker processes:
+    uvicorn api:app --workers 4 --port 8000
+    python api.py --workers 4 --port 8000
+
+Sessions are cached per worker. Messages live in the shared conversation
+store (CONVERSATION_DB) and uploaded PDFs in API_DOCUMENT_DIR, so any
+worker can serve any session; with CONVERSATION_DB=off run one worker.
+
+Endpoints:
+    POST   /v1/sessions                         start a session
+    GET    /v1/sessions                         recently updated sessions
+    GET    /v1/sessions/{id}?before=&limit=     a page of messages
+    DELETE /v1/sessions/{id}                    clear the conversation
+    PUT    /v1/sessions/{id}/document           attach a PDF (raw request body)
+    DELETE /v1/sessions/{id}/document           detach it
+    POST   /v1/sessions/{id}/messages           ask; streams SSE unless "stream": false
+                                                (events: queued, chunk, done or error)
+    GET    /v1/sessions/{id}/messages/{n}/excel tables of message n as .xlsx
+    GET    /v1/sessions/{id}/export?format=     markdown, json or jsonl
+    GET    /v1/memory                           this worker's session memory
+    POST   /v1/tables                           markdown tables in {"text"} as JSON
+    POST   /v1/excel                            markdown tables in {"text"} as .xlsx
+"""
+import argparse
+import base64
+import binascii
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from io import BytesIO
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from chat_export import ChatExporter
+from core import (ChatPipeline, ChatSettings, HISTORY_PAGE_SIZE, extract_tables, get_ist_time,
+                  format_gemini_error, iter_timed, load_document, open_conversation_store, open_rate_limiter,
+                  open_response_cache, process_image, create_model as build_model, uses_fake_backend,
+                  open_context_cache, open_session_memory, open_single_flight, SYSTEM_INSTRUCTION)
+from rate_limit import QuotaExceeded
+from workspace import WorkspaceFull
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+# Sessions served by the API hold one document, always under this workspace key
+DOCUMENT_KEY = "document"
+MAX_PAGE_SIZE = 500
+
+
+class APIError(Exception):
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+def create_model():
+    """Gemini model configured from GOOGLE_API_KEY (or the fake backend)"""
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key and not uses_fake_backend():
+        raise RuntimeError("GOOGLE_API_KEY not found! Add it to .env file or the environment")
+    return build_model(api_key)
+
+
+def now_stamp():
+    return get_ist_time().strftime('%Y%m%d_%H%M%S')
+
+
+def document_dir():
+    return os.getenv("API_DOCUMENT_DIR", os.path.join(".data", "documents"))
+
+
+class SessionRegistry:
+    """Per-worker LRU of live sessions, kept in step with the shared store
+
+    A session served by another worker since we last saw it is reloaded
+    from the store, and its PDF from the document directory, before use.
+    Sessions are measured on every use (see session_memory.py); with a
+    store, the least recently used are dropped once the worker is over its
+    memory cap and reload from the store on their next request.
+    """
+
+    def __init__(self, pipeline, max_sessions=256, memory=None):
+        self.pipeline = pipeline
+        self.max_sessions = max_sessions
+        self.memory = memory if memory is not None else open_session_memory()
+        self._sessions = OrderedDict()  # id -> (session, document mtime)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self):
+        session = self.pipeline.new_session()
+        if self.pipeline.store is not None:
+            self.pipeline.store.create_session(session.session_id)
+        self._remember(session, None)
+        return session
+
+    def get(self, session_id):
+        """Live session for session_id; raises APIError(404) if unknown"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions.move_to_end(session_id)
+        store = self.pipeline.store
+        if entry is None:
+            if store is None or not store.has_session(session_id):
+                raise APIError(404, f"Unknown session {session_id}")
+            session, mtime = self.pipeline.new_session(session_id), None
+        else:
+            session, mtime = entry
+            if store is not None and not session.lock.locked() and \
+                    store.message_count(session_id) != session.message_count:
+                session = self.pipeline.new_session(session_id)
+                mtime = None
+        mtime = self._sync_document(session, mtime)
+        self._remember(session, mtime)
+        return session
+
+    def clear(self, session):
+        """Forget the conversation but keep the session id usable everywhere"""
+        self.pipeline.clear_session(session)
+        if self.pipeline.store is not None:
+            self.pipeline.store.create_session(session.session_id)
+
+    def _remember(self, session, mtime):
+        with self._lock:
+            self._sessions[session.session_id] = (session, mtime)
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self.memory.track(session, shrink=self.pipeline.shrink_session,
+                          evict=self._evict if self.pipeline.store is not None else None)
+
+    def _evict(self, session):
+        """Forget an idle session to free memory; it reloads from the store"""
+        if session.lock.locked():
+            return False
+        with self._lock:
+            entry = self._sessions.get(session.session_id)
+            if entry is None or entry[0] is not session:
+                return True
+            del self._sessions[session.session_id]
+        return True
+
+    def _sync_document(self, session, mtime):
+        path = self.document_path(session.session_id)
+        try:
+            current = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            session.documents.clear()
+            return None
+        if current != mtime:
+            document = load_document(path, name=os.path.basename(path))
+            if document is None:
+                session.documents.clear()
+            else:
+                session.documents.add(document, key=DOCUMENT_KEY)
+        return current
+
+    def document_path(self, session_id):
+        return os.path.join(document_dir(), f"{session_id}.pdf")
+
+    def set_document(self, session, data, name):
+        """Store an uploaded PDF for every worker and index it here"""
+        os.makedirs(document_dir(), exist_ok=True)
+        path = self.document_path(session.session_id)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as out:
+            out.write(data)
+        document = None
+        try:
+            # Mapped where it was written, so the upload is not copied to a second file
+            document = load_document(tmp, name=name)
+            if document is None:
+                raise APIError(422, "No text could be extracted from this PDF")
+            session.documents.add(document, key=DOCUMENT_KEY)
+        except BaseException:
+            if document is not None:
+                document.close()
+            os.unlink(tmp)
+            raise
+        document.handle.move(path)
+        self._remember(session, os.stat(path).st_mtime_ns)
+        return document
+
+    def remove_document(self, session):
+        try:
+            os.unlink(self.document_path(session.session_id))
+        except FileNotFoundError:
+            pass
+        session.documents.clear()
+        self._remember(session, None)
+
+
+def parse_settings(data):
+    """ChatSettings from a request's "settings" object"""
+    try:
+        return ChatSettings.from_dict(data)
+    except ValueError as e:
+        raise APIError(400, str(e))
+
+
+def int_param(request, name, default, low, high=None):
+    """Integer query parameter clamped to [low, high]; APIError(400) if it is not a number"""
+    raw = request.query_params.get(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise APIError(400, f"{name} must be an integer")
+    value = max(low, value)
+    return min(value, high) if high is not None else value
+
+
+def decode_image(data):
+    """PIL image from a base64 string, or None"""
+    if not data:
+        return None
+    try:
+        img, _ = process_image(BytesIO(base64.b64decode(data, validate=True)))
+        return img
+    except (binascii.Error, ValueError, OSError) as e:
+        raise APIError(400, f"Invalid image: {e}")
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def message_summary(session, msg):
+    return {"index": session.message_count - 1, "message": msg, "token_totals": session.token_totals}
+
+
+def document_info(document):
+    if document is None:
+        return None
+    return {"name": document.name, "pages": document.pages, "words": document.word_count,
+            "errors": [{"page": page, "error": error} for page, error in document.errors]}
+
+
+async def read_json(request):
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise APIError(400, "Request body must be JSON")
+    if not isinstance(data, dict):
+        raise APIError(400, "Request body must be a JSON object")
+    return data
+
+
+def registry_for(request):
+    return request.app.state.registry
+
+
+async def get_session(request):
+    return await run_in_threadpool(registry_for(request).get, request.path_params["session_id"])
+
+
+async def health(request):
+    registry = registry_for(request)
+    flights = registry.pipeline.single_flight
+    return JSONResponse({"status": "ok", "pid": os.getpid(), "sessions": len(registry),
+                         "single_flight": flights.stats() if flights is not None else None})
+
+
+async def memory_stats(request):
+    registry = registry_for(request)
+    return JSONResponse({"pid": os.getpid(), **await run_in_threadpool(registry.memory.stats)})
+
+
+async def create_session(request):
+    session = await run_in_threadpool(registry_for(request).create)
+    return JSONResponse({"session_id": session.session_id}, status_code=201)
+
+
+async def list_sessions(request):
+    store = registry_for(request).pipeline.store
+    sessions = await run_in_threadpool(store.list_sessions, 50) if store is not None else []
+    return JSONResponse({"sessions": sessions})
+
+
+async def read_session(request):
+    session = await get_session(request)
+    store = registry_for(request).pipeline.store
+    limit = int_param(request, "limit", HISTORY_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    before = int_param(request, "before", None, 0)
+    if store is not None:
+        messages, first = await run_in_threadpool(store.load_page, session.session_id, before, limit)
+    else:
+        end = session.message_count if before is None else min(before, session.message_count)
+        first = max(session.history_offset, end - limit)
+        messages = session.messages[first - session.history_offset:end - session.history_offset]
+    return JSONResponse({
+        "session_id": session.session_id,
+        "message_count": session.message_count,
+        "first_index": first,
+        "messages": messages,
+        "document": document_info(session.documents.only),
+        "token_totals": session.token_totals,
+    })
+
+
+async def clear_session(request):
+    session = await get_session(request)
+    await run_in_threadpool(registry_for(request).clear, session)
+    return Response(status_code=204)
+
+
+async def put_document(request):
+    session = await get_session(request)
+    data = await request.body()
+    if not data:
+        raise APIError(400, "Send the PDF as the request body")
+    if len(data) > MAX_DOCUMENT_BYTES:
+        raise APIError(413, "PDF is too large")
+    name = request.query_params.get("name", "document.pdf")
+    try:
+        document = await run_in_threadpool(registry_for(request).set_document, session, data, name)
+    except APIError:
+        raise
+    except WorkspaceFull as e:
+        raise APIError(413, str(e))
+    except Exception as e:
+        raise APIError(422, f"Error reading PDF: {e}")
+    return JSONResponse(document_info(document))
+
+
+async def delete_document(request):
+    session = await get_session(request)
+    await run_in_threadpool(registry_for(request).remove_document, session)
+    return Response(status_code=204)
+
+
+async def post_message(request):
+    session = await get_session(request)
+    data = await read_json(request)
+    question = data.get("message")
+    if not isinstance(question, str) or not question.strip():
+        raise APIError(400, '"message" must be a non-empty string')
+    settings = parse_settings(data.get("settings"))
+    image = await run_in_threadpool(decode_image, data.get("image"))
+    pipeline = registry_for(request).pipeline
+
+    busy = "This session is already answering a message"
+    if session.lock.locked():
+        raise APIError(409, busy)
+
+    if data.get("stream", True):
+        def events():
+            # Taken here rather than before the response, so a body that is
+            # never iterated (client gone before streaming) never holds it
+            if not session.lock.acquire(blocking=False):
+                yield sse("error", {"error": busy, "status": 409})
+                return
+            # The pipeline runs on its own thread so queue-position updates
+            # reach the client while the request waits for the rate limiter
+            updates = queue.Queue()
+            cancelled = threading.Event()
+            usage, timings, parts = {}, {}, []
+
+            def queued(position, eta):
+                updates.put(("queued", {"position": position, "eta_seconds": round(eta, 1)}))
+
+            def produce():
+                try:
+                    chunks = pipeline.stream(session, question, settings, image=image, usage=usage,
+                                             on_wait=queued)
+                    for chunk in iter_timed(chunks, timings):
+                        if cancelled.is_set():
+                            chunks.close()
+                            return
+                        updates.put(("chunk", chunk))
+                    updates.put(("end", None))
+                except Exception as e:
+                    updates.put(("raise", e))
+
+            threading.Thread(target=produce, name="api-stream", daemon=True).start()
+            try:
+                while True:
+                    kind, value = updates.get()
+                    if kind == "queued":
+                        yield sse("queued", value)
+                    elif kind == "chunk":
+                        parts.append(value)
+                        yield sse("chunk", {"text": value})
+                    elif kind == "raise":
+                        raise value
+                    else:
+                        break
+                msg = pipeline.record_turn(session, question, "".join(parts), usage, image=image,
+                                           ttft_ms=timings["ttft_ms"], latency_ms=timings["latency_ms"])
+                yield sse("done", message_summary(session, msg))
+            except QuotaExceeded as e:
+                yield sse("error", {"error": format_gemini_error(e), "status": 429,
+                                    "retry_after": e.retry_after})
+            finally:
+                cancelled.set()
+                session.lock.release()
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    def answer():
+        if not session.lock.acquire(blocking=False):
+            raise APIError(409, busy)
+        try:
+            usage = {}
+            start = time.perf_counter()
+            response = pipeline.generate(session, question, settings, image=image, usage=usage)
+            msg = pipeline.record_turn(session, question, response, usage, image=image,
+                                       latency_ms=(time.perf_counter() - start) * 1000)
+            return message_summary(session, msg)
+        except QuotaExceeded as e:
+            raise APIError(429, format_gemini_error(e), retry_after=e.retry_after)
+        finally:
+            session.lock.release()
+
+    return JSONResponse(await run_in_threadpool(answer))
+
+
+def find_message(registry, session, index):
+    if session.history_offset <= index < session.message_count:
+        return session.messages[index - session.history_offset]
+    store = registry.pipeline.store
+    if store is not None and 0 <= index < session.message_count:
+        messages, _ = store.load_page(session.session_id, before=index + 1, limit=1)
+        if messages:
+            return messages[0]
+    raise APIError(404, f"No message {index}")
+
+
+def workbook_response(text, filename):
+    from excel_export import iter_workbook_chunks
+
+    tables = extract_tables(text)
+    if not tables:
+        raise APIError(404, "No markdown tables found")
+    return StreamingResponse(iter_workbook_chunks(tables), media_type=XLSX_MIME,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+async def message_excel(request):
+    session = await get_session(request)
+    index = request.path_params["index"]
+    msg = await run_in_threadpool(find_message, registry_for(request), session, index)
+    return workbook_response(msg["bot"], f"data_{index}_{now_stamp()}.xlsx")
+
+
+async def export_session(request):
+    session = await get_session(request)
+    fmt = request.query_params.get("format", "markdown")
+    store = registry_for(request).pipeline.store
+
+    formats = {"markdown": ("text/markdown", "md"), "md": ("text/markdown", "md"),
+               "json": ("application/json", "json"), "jsonl": ("application/jsonl", "jsonl")}
+    if fmt not in formats:
+        raise APIError(400, "format must be markdown, json or jsonl")
+    mime, ext = formats[fmt]
+    exporter = ChatExporter(session.session_id)
+    older = None
+    if store is not None:
+        older = lambda start, stop: store.iter_messages(session.session_id, start=start, stop=stop)
+    await run_in_threadpool(exporter.sync, session.messages, session.history_offset)
+    now = get_ist_time()
+    # Older messages are read from the store as the response is written
+    if ext == "md":
+        body = exporter.iter_markdown(now, older)
+    elif ext == "json":
+        body = exporter.iter_json(session.started_at, now, older)
+    else:
+        body = exporter.iter_jsonl(older)
+    filename = f"chat_{now_stamp()}.{ext}"
+    return StreamingResponse(body, media_type=mime,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+async def tables_from_text(request):
+    data = await read_json(request)
+    text = data.get("text")
+    if not isinstance(text, str):
+        raise APIError(400, '"text" must be a string')
+    tables = await run_in_threadpool(extract_tables, text)
+    return JSONResponse({"tables": [{"headers": t.headers, "rows": t.rows, "alignments": t.alignments}
+                                    for t in tables]})
+
+
+async def excel_from_text(request):
+    data = await read_json(request)
+    text = data.get("text")
+    if not isinstance(text, str):
+        raise APIError(400, '"text" must be a string')
+    return workbook_response(text, f"data_{now_stamp()}.xlsx")
+
+
+async def api_error(request, exc):
+    headers = {"Retry-After": str(max(1, round(exc.retry_after)))} if exc.retry_after else None
+    return JSONResponse({"error": exc.message}, status_code=exc.status, headers=headers)
+
+
+def create_app(pipeline=None, max_sessions=256):
+    """The ASGI app; builds a Gemini-backed pipeline on startup if none is given"""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        if not hasattr(app.state, "registry"):
+            app.state.registry = SessionRegistry(
+                ChatPipeline(create_model(), response_cache=open_response_cache(),
+                             store=open_conversation_store(), limiter=open_rate_limiter(),
+                             system_instruction=SYSTEM_INSTRUCTION, context_cache=open_context_cache(),
+                             single_flight=open_single_flight()),
+                max_sessions=max_sessions)
+        yield
+        pipeline = app.state.registry.pipeline
+        if pipeline.store is not None:
+            pipeline.store.flush()
+        if pipeline.context_cache is not None:
+            pipeline.context_cache.clear()  # delete this worker's server-side caches
+
+    app = Starlette(routes=[
+        Route("/health", health),
+        Route("/v1/sessions", create_session, methods=["POST"]),
+        Route("/v1/sessions", list_sessions, methods=["GET"]),
+        Route("/v1/sessions/{session_id}", read_session, methods=["GET"]),
+        Route("/v1/sessions/{session_id}", clear_session, methods=["DELETE"]),
+        Route("/v1/sessions/{session_id}/document", put_document, methods=["PUT"]),
+        Route("/v1/sessions/{session_id}/document", delete_document, methods=["DELETE"]),
+        Route("/v1/sessions/{session_id}/messages", post_message, methods=["POST"]),
+        Route("/v1/sessions/{session_id}/messages/{index:int}/excel", message_excel),
+        Route("/v1/sessions/{session_id}/export", export_session),
+        Route("/v1/tables", tables_from_text, methods=["POST"]),
+        Route("/v1/excel", excel_from_text, methods=["POST"]),
+        Route("/v1/memory", memory_stats),
+    ], exception_handlers={APIError: api_error}, lifespan=lifespan)
+    if pipeline is not None:
+        app.state.registry = SessionRegistry(pipeline, max_sessions=max_sessions)
+    return app
+
+
+app = create_app()
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="GeminiFlow HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("API_WORKERS", "1")))
+    args = parser.parse_args()
+    uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
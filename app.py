@@ -1,47 +1,46 @@
 from dotenv import load_dotenv
 import streamlit as st
 import os
-import google.generativeai as genai
 import time
-from PIL import Image
-import PyPDF2
-from datetime import datetime, timezone, timedelta
-import json
-import re
-import pandas as pd
-from io import BytesIO
-
-# Indian Standard Time (IST) timezone
-IST = timezone(timedelta(hours=5, minutes=30))
-
-def get_ist_time():
-    """Get current time in Indian Standard Time"""
-    return datetime.now(IST)
-
-# Load environment variables
-load_dotenv()
-
-# Get API key (handle secrets.toml not existing)
-api_key = None
-try:
-    if hasattr(st, 'secrets') and 'GOOGLE_API_KEY' in st.secrets:
-        api_key = st.secrets["GOOGLE_API_KEY"]
-except Exception:
-    pass
-
-if not api_key:
-    api_key = os.getenv("GOOGLE_API_KEY")
-
-if not api_key:
+from datetime import datetime
+from functools import partial
+from core import (ChatPipeline, ChatSettings, IST, HISTORY_PAGE_SIZE, get_ist_time,
+                  load_documents, process_image as open_image, extract_tables,
+                  create_excel_from_response as build_excel, format_gemini_error, iter_timed,
+                  open_conversation_store, open_rate_limiter, open_response_cache, create_model,
+                  uses_fake_backend, open_context_cache, open_session_memory, open_single_flight,
+                  SYSTEM_INSTRUCTION)
+from rate_limit import QuotaExceeded
+from workspace import WorkspaceFull
+from artifacts import ArtifactCache
+from chat_export import ChatExporter
+from session_memory import SpilledUpload
+import theme
+import tracing
+
+@st.cache_resource
+def get_api_key():
+    """API key from Streamlit secrets, .env or the environment (looked up once)"""
+    load_dotenv()
+    try:
+        if hasattr(st, 'secrets') and 'GOOGLE_API_KEY' in st.secrets:
+            return st.secrets["GOOGLE_API_KEY"]
+    except Exception:
+        pass
+    return os.getenv("GOOGLE_API_KEY")
+
+@st.cache_resource
+def get_model(api_key):
+    """Gemini client, built once per process on the first question and shared by all sessions"""
+    return create_model(api_key)
+
+api_key = get_api_key()
+if not api_key and not uses_fake_backend():
+    get_api_key.clear()  # look again on the next rerun
     st.error("⚠️ GOOGLE_API_KEY not found! Add it to .env file or Streamlit secrets")
     st.info("Get your key from: https://makersuite.google.com/app/apikey")
     st.stop()
 
-genai.configure(api_key=api_key)
-
-# Initialize Gemini model
-model = genai.GenerativeModel("gemini-2.0-flash-exp")
-
 # Page config
 st.set_page_config(
     page_title="GeminiFlow - AI Assistant",
@@ -50,692 +49,302 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Modern CSS with Glassmorphism & Advanced Animations
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap');
-    
-    * {
-        font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
-    }
-    
-    /* Animated Background */
-    .main {
-        background: linear-gradient(135deg, #0f0c29 0%, #302b63 50%, #24243e 100%);
-        background-size: 400% 400%;
-        animation: gradientShift 15s ease infinite;
-        position: relative;
-        overflow: hidden;
-    }
-    
-    @keyframes gradientShift {
-        0% { background-position: 0% 50%; }
-        50% { background-position: 100% 50%; }
-        100% { background-position: 0% 50%; }
-    }
-    
-    /* Floating orbs background effect */
-    .main::before {
-        content: '';
-        position: fixed;
-        top: -50%;
-        left: -50%;
-        width: 200%;
-        height: 200%;
-        background: 
-            radial-gradient(circle at 20% 50%, rgba(120, 119, 198, 0.3) 0%, transparent 50%),
-            radial-gradient(circle at 80% 80%, rgba(99, 102, 241, 0.3) 0%, transparent 50%),
-            radial-gradient(circle at 40% 20%, rgba(168, 85, 247, 0.2) 0%, transparent 50%);
-        animation: floatOrbs 20s ease-in-out infinite;
-        pointer-events: none;
-        z-index: 0;
-    }
-    
-    @keyframes floatOrbs {
-        0%, 100% { transform: translate(0, 0) rotate(0deg); }
-        33% { transform: translate(30px, -30px) rotate(120deg); }
-        66% { transform: translate(-20px, 20px) rotate(240deg); }
-    }
-    
-    /* Glassmorphism Chat Messages */
-    .stChatMessage {
-        background: rgba(255, 255, 255, 0.05);
-        backdrop-filter: blur(20px) saturate(180%);
-        -webkit-backdrop-filter: blur(20px) saturate(180%);
-        border-radius: 20px;
-        padding: 24px;
-        margin: 12px 0;
-        border: 1px solid rgba(255, 255, 255, 0.18);
-        box-shadow: 0 8px 32px 0 rgba(31, 38, 135, 0.37);
-        transition: all 0.4s cubic-bezier(0.4, 0, 0.2, 1);
-        animation: fadeInUp 0.5s ease-out;
-    }
-    
-    .stChatMessage:hover {
-        transform: translateY(-4px);
-        box-shadow: 0 12px 40px 0 rgba(99, 102, 241, 0.5);
-        border-color: rgba(168, 85, 247, 0.4);
-    }
-    
-    @keyframes fadeInUp {
-        from {
-            opacity: 0;
-            transform: translateY(30px);
-        }
-        to {
-            opacity: 1;
-            transform: translateY(0);
-        }
-    }
-    
-    [data-testid="stChatMessageContent"] {
-        color: #f0f0f0;
-        font-size: 15px;
-        line-height: 1.7;
-        font-weight: 400;
-    }
-    
-    /* Stunning Sidebar */
-    [data-testid="stSidebar"] {
-        background: linear-gradient(180deg, rgba(17, 24, 39, 0.95) 0%, rgba(31, 41, 55, 0.95) 100%);
-        backdrop-filter: blur(20px);
-        -webkit-backdrop-filter: blur(20px);
-        border-right: 1px solid rgba(139, 92, 246, 0.3);
-        box-shadow: 4px 0 24px rgba(0, 0, 0, 0.3);
-    }
-    
-    [data-testid="stSidebar"]::before {
-        content: '';
-        position: absolute;
-        top: 0;
-        left: 0;
-        right: 0;
-        height: 200px;
-        background: linear-gradient(180deg, rgba(139, 92, 246, 0.2) 0%, transparent 100%);
-        pointer-events: none;
-    }
-    
-    /* Animated Title */
-    h1 {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 25%, #f093fb 50%, #4facfe 75%, #00f2fe 100%);
-        background-size: 200% auto;
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-        text-align: center;
-        font-size: 3.5rem !important;
-        font-weight: 800 !important;
-        margin-bottom: 0.5rem;
-        animation: gradientText 3s ease infinite, glow 2s ease-in-out infinite;
-        letter-spacing: -1px;
-        text-shadow: 0 0 40px rgba(139, 92, 246, 0.5);
-    }
-    
-    @keyframes gradientText {
-        0%, 100% { background-position: 0% center; }
-        50% { background-position: 100% center; }
-    }
-    
-    @keyframes glow {
-        0%, 100% { filter: drop-shadow(0 0 20px rgba(139, 92, 246, 0.7)); }
-        50% { filter: drop-shadow(0 0 40px rgba(168, 85, 247, 0.9)); }
-    }
-    
-    h2 {
-        color: #c4b5fd;
-        font-weight: 700;
-        font-size: 1.5rem;
-        margin-top: 1.5rem;
-    }
-    
-    h3 {
-        background: linear-gradient(135deg, #a78bfa 0%, #c4b5fd 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-        font-weight: 700;
-        margin-top: 1.5rem;
-    }
-    
-    /* Premium Buttons */
-    .stButton > button {
-        width: 100%;
-        border-radius: 12px;
-        padding: 12px 24px;
-        font-weight: 600;
-        font-size: 14px;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        border: none;
-        box-shadow: 0 4px 15px rgba(102, 126, 234, 0.4);
-        transition: all 0.3s cubic-bezier(0.4, 0, 0.2, 1);
-        position: relative;
-        overflow: hidden;
-    }
-    
-    .stButton > button::before {
-        content: '';
-        position: absolute;
-        top: 0;
-        left: -100%;
-        width: 100%;
-        height: 100%;
-        background: linear-gradient(90deg, transparent, rgba(255, 255, 255, 0.3), transparent);
-        transition: left 0.5s;
-    }
-    
-    .stButton > button:hover::before {
-        left: 100%;
-    }
-    
-    .stButton > button:hover {
-        transform: translateY(-3px) scale(1.02);
-        box-shadow: 0 8px 25px rgba(102, 126, 234, 0.6);
-        background: linear-gradient(135deg, #764ba2 0%, #667eea 100%);
-    }
-    
-    .stButton > button:active {
-        transform: translateY(-1px);
-    }
-    
-    /* Download Button Styling */
-    .stDownloadButton > button {
-        background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-        box-shadow: 0 4px 15px rgba(245, 87, 108, 0.4);
-    }
-    
-    .stDownloadButton > button:hover {
-        background: linear-gradient(135deg, #f5576c 0%, #f093fb 100%);
-        box-shadow: 0 8px 25px rgba(245, 87, 108, 0.6);
-    }
-    
-    /* Premium File Uploader */
-    [data-testid="stFileUploader"] {
-        background: rgba(139, 92, 246, 0.08);
-        border: 2px dashed rgba(139, 92, 246, 0.5);
-        border-radius: 16px;
-        padding: 20px;
-        transition: all 0.3s ease;
-    }
-    
-    [data-testid="stFileUploader"]:hover {
-        background: rgba(139, 92, 246, 0.15);
-        border-color: rgba(168, 85, 247, 0.8);
-        box-shadow: 0 8px 30px rgba(139, 92, 246, 0.3);
-    }
-    
-    /* Chat Input with Glow Effect */
-    .stChatInputContainer {
-        border-radius: 16px;
-        border: 2px solid rgba(139, 92, 246, 0.5);
-        background: rgba(38, 39, 48, 0.7);
-        backdrop-filter: blur(10px);
-        box-shadow: 0 8px 32px rgba(139, 92, 246, 0.2);
-        transition: all 0.3s ease;
-    }
-    
-    .stChatInputContainer:focus-within {
-        border-color: rgba(168, 85, 247, 1);
-        box-shadow: 0 8px 40px rgba(139, 92, 246, 0.5);
-        transform: translateY(-2px);
-    }
-    
-    /* Metrics with Gradient */
-    [data-testid="stMetricValue"] {
-        font-size: 26px;
-        font-weight: 800;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-    }
-    
-    [data-testid="stMetricLabel"] {
-        color: rgba(255, 255, 255, 0.7);
-        font-weight: 600;
-        font-size: 13px;
-        text-transform: uppercase;
-        letter-spacing: 1px;
-    }
-    
-    /* Expander with Glass Effect */
-    .streamlit-expanderHeader {
-        background: rgba(139, 92, 246, 0.15);
-        backdrop-filter: blur(10px);
-        border-radius: 12px;
-        font-weight: 600;
-        border: 1px solid rgba(139, 92, 246, 0.3);
-        transition: all 0.3s ease;
-        padding: 12px 16px;
-    }
-    
-    .streamlit-expanderHeader:hover {
-        background: rgba(139, 92, 246, 0.25);
-        border-color: rgba(168, 85, 247, 0.6);
-        box-shadow: 0 4px 20px rgba(139, 92, 246, 0.3);
-    }
-    
-    /* Divider */
-    hr {
-        border: none;
-        height: 2px;
-        background: linear-gradient(90deg, transparent, rgba(139, 92, 246, 0.5), transparent);
-        margin: 24px 0;
-    }
-    
-    /* Code blocks */
-    code {
-        background: rgba(139, 92, 246, 0.1);
-        border: 1px solid rgba(139, 92, 246, 0.3);
-        border-radius: 6px;
-        padding: 2px 6px;
-        color: #c4b5fd;
-    }
-    
-    /* Scrollbar */
-    ::-webkit-scrollbar {
-        width: 10px;
-        height: 10px;
-    }
-    
-    ::-webkit-scrollbar-track {
-        background: rgba(0, 0, 0, 0.2);
-    }
-    
-    ::-webkit-scrollbar-thumb {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        border-radius: 10px;
-    }
-    
-    ::-webkit-scrollbar-thumb:hover {
-        background: linear-gradient(135deg, #764ba2 0%, #667eea 100%);
-    }
-    
-    /* Caption styling */
-    .caption {
-        color: rgba(255, 255, 255, 0.5);
-        font-size: 12px;
-        font-weight: 500;
-    }
-    
-    /* Info boxes */
-    [data-testid="stMarkdownContainer"] p {
-        color: rgba(255, 255, 255, 0.85);
-    }
-    
-    /* Success/Warning/Error boxes */
-    .stAlert {
-        border-radius: 12px;
-        backdrop-filter: blur(10px);
-        border: 1px solid rgba(255, 255, 255, 0.1);
-    }
-    
-    /* Spinner */
-    .stSpinner > div {
-        border-top-color: #667eea !important;
-    }
-    
-    /* Image containers */
-    [data-testid="stImage"] {
-        border-radius: 12px;
-        overflow: hidden;
-        box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
-        transition: transform 0.3s ease;
-    }
-    
-    [data-testid="stImage"]:hover {
-        transform: scale(1.02);
-    }
-    
-    /* Progress bar */
-    .stProgress > div > div {
-        background: linear-gradient(90deg, #667eea 0%, #764ba2 100%);
-    }
-    
-    /* Bounce animation for welcome emoji */
-    @keyframes bounce {
-        0%, 100% { transform: translateY(0); }
-        50% { transform: translateY(-20px); }
-    }
-    
-    /* Fade in animation */
-    @keyframes fadeIn {
-        from { opacity: 0; }
-        to { opacity: 1; }
-    }
-    
-    /* Pulse animation for notifications */
-    @keyframes pulse {
-        0%, 100% { opacity: 1; }
-        50% { opacity: 0.7; }
-    }
-    
-    /* Shake animation for errors */
-    @keyframes shake {
-        0%, 100% { transform: translateX(0); }
-        10%, 30%, 50%, 70%, 90% { transform: translateX(-5px); }
-        20%, 40%, 60%, 80% { transform: translateX(5px); }
-    }
-    
-    /* Slide in from left */
-    @keyframes slideInLeft {
-        from {
-            transform: translateX(-100%);
-            opacity: 0;
-        }
-        to {
-            transform: translateX(0);
-            opacity: 1;
-        }
-    }
-    
-    /* Slide in from right */
-    @keyframes slideInRight {
-        from {
-            transform: translateX(100%);
-            opacity: 0;
-        }
-        to {
-            transform: translateX(0);
-            opacity: 1;
-        }
-    }
-    
-    /* User messages slide from right */
-    [data-testid="stChatMessage"]:has([data-testid="chatAvatarIcon-user"]) {
-        animation: slideInRight 0.4s ease-out;
-    }
-    
-    /* Assistant messages slide from left */
-    [data-testid="stChatMessage"]:has([data-testid="chatAvatarIcon-assistant"]) {
-        animation: slideInLeft 0.4s ease-out;
-    }
-    
-    /* Hover effect for sidebar items */
-    [data-testid="stSidebar"] [data-testid="stMarkdownContainer"] {
-        transition: transform 0.2s ease;
-    }
-    
-    /* Link styling */
-    a {
-        color: #8b5cf6;
-        text-decoration: none;
-        transition: color 0.3s ease;
-    }
-    
-    a:hover {
-        color: #a78bfa;
-        text-decoration: underline;
-    }
-    
-    /* Textarea focus effect */
-    textarea:focus {
-        outline: none !important;
-        box-shadow: 0 0 0 2px rgba(139, 92, 246, 0.5) !important;
-    }
-    
-    /* Success message animation */
-    .stSuccess {
-        animation: slideInRight 0.5s ease-out;
-    }
-    
-    /* Warning message animation */
-    .stWarning {
-        animation: pulse 2s ease-in-out infinite;
-    }
-    
-    /* Error message animation */
-    .stError {
-        animation: shake 0.5s ease-in-out;
-    }
-</style>
-""", unsafe_allow_html=True)
+# Theme: a <link> to the hashed static stylesheet (see theme.py)
+st.markdown(theme.stylesheet_html(), unsafe_allow_html=True)
 
 # Helper functions
-def extract_pdf_text(pdf_file):
-    """Extract text from PDF"""
-    try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        pages = len(pdf_reader.pages)
-        
-        if pages > 10:
+def extract_pdf_texts(pdf_files):
+    """Extract several PDFs concurrently, showing progress for long batches
+    
+    Returns a core.Document, or None if nothing could be read, per file.
+    """
+    progress_bar = status_text = None
+    
+    def on_progress(done, total):
+        nonlocal progress_bar, status_text
+        if total <= 10:
+            return
+        if progress_bar is None:
             progress_bar = st.progress(0)
             status_text = st.empty()
-        
-        for i, page in enumerate(pdf_reader.pages):
-            try:
-                text += page.extract_text() + "\n"
-                if pages > 10:
-                    progress = (i + 1) / pages
-                    progress_bar.progress(progress)
-                    status_text.text(f"Processing page {i+1}/{pages}")
-            except Exception as e:
-                st.warning(f"⚠️ Could not read page {i+1}: {str(e)}")
-        
-        if pages > 10:
-            progress_bar.empty()
-            status_text.empty()
-        
-        return text.strip(), pages
+        progress_bar.progress(done / total)
+        status_text.text(f"Processing page {done}/{total}")
+    
+    names = [getattr(f, "name", "document.pdf") for f in pdf_files]
+    try:
+        results = load_documents(pdf_files, names, progress=on_progress)
     except Exception as e:
         st.error(f"Error reading PDF: {str(e)}")
-        return None, 0
+        return [None] * len(pdf_files)
+    finally:
+        if progress_bar is not None:
+            progress_bar.empty()
+            status_text.empty()
+
+    documents = []
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            st.error(f"Error reading {name}: {str(result)}")
+            result = None
+        elif result is None:
+            st.warning(f"⚠️ No text could be extracted from {name}")
+        else:
+            for page, error in result.errors:
+                st.warning(f"⚠️ Could not read page {page} of {name}: {error}")
+        documents.append(result)
+    return documents
 
 def process_image(image_file):
     """Process uploaded image"""
     try:
-        img = Image.open(image_file)
-        max_size = 4096
-        if img.width > max_size or img.height > max_size:
-            st.warning(f"⚠️ Image resized from {img.width}x{img.height}")
-            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        img, resized_from = open_image(image_file)
+        if resized_from:
+            st.warning(f"⚠️ Image resized from {resized_from[0]}x{resized_from[1]}")
         return img
     except Exception as e:
         st.error(f"Error processing image: {str(e)}")
         return None
 
-def get_file_size(file):
-    """Get human-readable file size"""
-    file.seek(0, 2)
-    size = file.tell()
-    file.seek(0)
+def format_bytes(size):
+    """Human-readable size"""
     for unit in ['B', 'KB', 'MB', 'GB']:
         if size < 1024.0:
             return f"{size:.1f} {unit}"
         size /= 1024.0
     return f"{size:.1f} TB"
 
-def export_chat_json():
+def get_chat_exporter():
+    """Session exporter, caught up with the loaded page of the conversation"""
+    exporter = st.session_state.chat_exporter
+    exporter.sync(chat.messages, chat.history_offset)
+    return exporter
+
+def older_messages(session_id):
+    """Reader for stored messages before the loaded page, or None without a store"""
+    store = get_conversation_store()
+    if store is None:
+        return None
+    return lambda start, stop: store.iter_messages(session_id, start=start, stop=stop)
+
+def export_chat_json(exporter, session_start):
     """Export chat as JSON"""
-    export_data = {
-        "session_start": st.session_state.session_start.isoformat(),
-        "export_time": get_ist_time().isoformat(),
-        "message_count": len(st.session_state.messages),
-        "messages": st.session_state.messages
-    }
-    return json.dumps(export_data, indent=2)
+    return exporter.json(session_start, get_ist_time(), older_messages(exporter.session_id))
 
-def export_chat_markdown():
+def export_chat_markdown(exporter):
     """Export chat as markdown"""
-    markdown = f"# Gemini AI Chat Session\n\n"
-    markdown += f"**Date:** {get_ist_time().strftime('%Y-%m-%d %H:%M:%S')} IST\n"
-    markdown += f"**Messages:** {len(st.session_state.messages)}\n\n---\n\n"
-    for i, msg in enumerate(st.session_state.messages, 1):
-        markdown += f"## Message {i}\n\n**👤 User:**\n{msg['user']}\n\n"
-        markdown += f"**✨ Assistant:**\n{msg['bot']}\n\n"
-        if msg.get('has_image'):
-            markdown += "*[Image was attached]*\n\n"
-        if msg.get('has_pdf'):
-            markdown += "*[PDF document was attached]*\n\n"
-        markdown += "---\n\n"
-    return markdown
-
-def extract_table_from_text(text):
-    """Extract markdown table and convert to DataFrame"""
-    lines = text.split('\n')
-    table_lines = []
-    in_table = False
-    
-    for line in lines:
-        if '|' in line:
-            in_table = True
-            cleaned = line.strip()
-            if cleaned and not re.match(r'^\|[\s\-:]+\|', cleaned):
-                table_lines.append(cleaned)
-        elif in_table and line.strip() == '':
-            break
-    
-    if not table_lines:
-        return None
-    
-    try:
-        headers = [h.strip() for h in table_lines[0].split('|')[1:-1]]
-        data = []
-        for line in table_lines[1:]:
-            if line.strip():
-                row = [cell.strip() for cell in line.split('|')[1:-1]]
-                data.append(row)
-        
-        if data:
-            df = pd.DataFrame(data, columns=headers)
-            return df
-    except:
-        return None
-    return None
+    return exporter.markdown(get_ist_time(), older_messages(exporter.session_id))
+
+def export_chat_jsonl(exporter):
+    """Export chat as JSON Lines, one message per line"""
+    return exporter.jsonl(older_messages(exporter.session_id))
 
 def create_excel_from_response(response_text):
-    """Create Excel file from response table"""
-    df = extract_table_from_text(response_text)
-    if df is None:
-        return None
-    
-    output = BytesIO()
+    """Create Excel file from response tables, one sheet per table"""
     try:
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Data', index=False)
-            worksheet = writer.sheets['Data']
-            for idx, col in enumerate(df.columns):
-                max_length = max(df[col].astype(str).apply(len).max(), len(str(col))) + 2
-                worksheet.column_dimensions[chr(65 + idx)].width = max_length
-        output.seek(0)
-        return output.getvalue()
+        return build_excel(response_text)
     except Exception as e:
         st.error(f"Error creating Excel: {str(e)}")
         return None
 
-def get_gemini_response(question, history, image=None, pdf_text=None):
-    """Generate response from Gemini"""
-    try:
-        context = ""
-        
-        if history:
-            context += "=== Previous Conversation ===\n"
-            for msg in history[-5:]:
-                context += f"\nUser: {msg['user']}\n"
-                context += f"Assistant: {msg['bot'][:200]}...\n" if len(msg['bot']) > 200 else f"Assistant: {msg['bot']}\n"
-        
-        if pdf_text:
-            max_pdf_chars = 8000
-            truncated = pdf_text[:max_pdf_chars]
-            context += f"\n\n=== Document Content ===\n{truncated}"
-            if len(pdf_text) > max_pdf_chars:
-                context += f"\n\n[Note: Document truncated. Total length: {len(pdf_text)} characters]"
-        
-        formatting_instructions = """
-IMPORTANT FORMATTING INSTRUCTIONS:
-When providing responses with numerical data, tables, calculations, or Excel-related content:
-1. ALWAYS use proper markdown tables with | separators and alignment
-2. Format all calculations clearly showing: Formula → Calculation → Result
-3. For Excel formulas, present them in code blocks or clearly formatted
-4. Make tables directly copyable to Excel with proper column alignment
-5. Use clear headers and organize data in rows and columns
-6. Show step-by-step calculations for math problems
-7. Present financial/numerical data in professional table format
-8. Include units and proper number formatting
-
-Example table format:
-| Item | Formula | Calculation | Result |
-|------|---------|-------------|--------|
-| Sales Growth 5% | Base × 1.05 | 628 × 1.05 | 659.40 |
-"""
-        
-        if context:
-            full_prompt = f"{formatting_instructions}\n\n{context}\n\n=== Current Question ===\nUser: {question}\nAssistant:"
-        else:
-            full_prompt = f"{formatting_instructions}\n\nUser: {question}\nAssistant:"
-        
-        generation_config = {
-            "temperature": st.session_state.temperature,
-            "max_output_tokens": st.session_state.max_tokens,
-        }
+@st.cache_resource
+def get_artifact_cache():
+    """Process-wide cache of per-message artifacts"""
+    return ArtifactCache()
+
+def message_has_table(text):
+    """Whether a response holds a parseable table (parsed once per content)"""
+    return get_artifact_cache().get_or_build("has_table", text, lambda t: bool(extract_tables(t)))
+
+def get_message_excel(text):
+    """Excel bytes for a response, built on first download and then reused"""
+    return get_artifact_cache().get_or_build("xlsx", text, create_excel_from_response) or b""
+
+@st.cache_resource
+def get_response_cache():
+    """Process-wide response cache shared by all sessions
+    
+    Set RESPONSE_CACHE_DB to a file path to keep responses across restarts.
+    """
+    return open_response_cache()
+
+@st.cache_resource
+def get_conversation_store():
+    """Process-wide conversation store (CONVERSATION_DB=off disables it)"""
+    return open_conversation_store()
+
+@st.cache_resource
+def get_pipeline():
+    """Chat pipeline shared by every session in this process"""
+    return ChatPipeline(model_factory=partial(get_model, api_key), response_cache=get_response_cache(),
+                        store=get_conversation_store(), limiter=open_rate_limiter(),
+                        system_instruction=SYSTEM_INSTRUCTION, context_cache=open_context_cache(),
+                        single_flight=open_single_flight())
+
+@st.cache_resource
+def get_session_memory():
+    """Process-wide ledger of what each browser session holds (see session_memory.py)"""
+    return open_session_memory()
+
+def track_memory():
+    """Measure this session, shrinking it (or idle ones) when over the caps"""
+    image = st.session_state.uploaded_image
+    return get_session_memory().track(chat, extra={"exports": st.session_state.chat_exporter.nbytes,
+                                                   "image": image.size if image else 0},
+                                      shrink=get_pipeline().shrink_session)
+
+def render_stream(chunks, placeholder):
+    """Write streamed chunks into a placeholder, returning text and timings
+    
+    Returns (text, ttft_ms, latency_ms) where ttft_ms is the time to the
+    first non-empty chunk.
+    """
+    timings = {}
+    parts = []
+    rendering = 0.0  # time spent drawing, reported as the render.response span
+    for chunk in iter_timed(chunks, timings):
+        parts.append(chunk)
+        start = time.perf_counter()
+        placeholder.markdown("".join(parts) + "▌")
+        rendering += time.perf_counter() - start
+    text = "".join(parts)
+    start = time.perf_counter()
+    placeholder.markdown(text)
+    rendering += time.perf_counter() - start
+    tracing.record("render.response", rendering * 1000, chunks=len(parts), chars=len(text))
+    return text, timings["ttft_ms"], timings["latency_ms"]
+
+def format_latency(msg):
+    """Short latency caption for a message, if timings were recorded"""
+    if msg.get("latency_ms") is None:
+        return ""
+    if msg.get("ttft_ms") is not None:
+        return f" • ⚡ {msg['ttft_ms'] / 1000:.2f}s first token, {msg['latency_ms'] / 1000:.2f}s total"
+    return f" • ⚡ {msg['latency_ms'] / 1000:.2f}s"
+
+# Turns rendered in full on each rerun; older ones collapse to previews
+RENDER_WINDOW = 10
+COLLAPSED_PREVIEWS = 30
+
+def get_render_meta(idx, msg):
+    """Display metadata for message idx, computed once and kept in session state"""
+    meta = st.session_state.render_meta.get(idx)
+    if meta is not None:
+        return meta
+    bot = msg["bot"]
+    tags = []
+    if msg.get("has_image"):
+        tags.append("🖼️")
+    if msg.get("has_pdf"):
+        tags.append("📄")
+    caption = ""
+    time_label = ""
+    if "timestamp" in msg:
+        try:
+            ts = datetime.fromisoformat(msg["timestamp"])
+            time_label = ts.strftime('%I:%M %p')
+            caption = (f"🕒 {time_label}{format_latency(msg)}"
+                       + (" • ⚠️ reduced context (session budget)" if msg.get("degraded") else ""))
+        except ValueError:
+            pass
+    table_sniff = '|' in bot and '-|-' in bot
+    question = " ".join(msg["user"].split())
+    if len(question) > 80:
+        question = question[:80] + "…"
+    meta = {
+        "tags": " ".join(tags),
+        "caption": caption,
+        "table_sniff": table_sniff,
+        "has_table": table_sniff and message_has_table(bot),
+        "has_code": '```' in bot,
+        "preview": f"- **#{idx + 1}** {time_label} 👤 {question}",
+    }
+    st.session_state.render_meta[idx] = meta
+    return meta
+
+def render_message(idx, msg):
+    """Render one past turn in full"""
+    meta = get_render_meta(idx, msg)
+    with st.chat_message("user", avatar="👤"):
+        st.markdown(msg["user"])
+        if meta["tags"]:
+            st.caption(meta["tags"])
+    
+    with st.chat_message("assistant", avatar="✨"):
+        st.markdown(msg["bot"])
         
-        if image:
-            response = model.generate_content([full_prompt, image], generation_config=generation_config)
-        else:
-            response = model.generate_content(full_prompt, generation_config=generation_config)
+        if meta["table_sniff"]:
+            col_a, col_b = st.columns([1, 4])
+            with col_a:
+                if meta["has_table"]:
+                    st.download_button("📥 Excel", data=partial(get_message_excel, msg["bot"]),
+                                     file_name=f"data_{idx}_{get_ist_time().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                     key=f"excel_{idx}")
+            with col_b:
+                with st.expander("📋 Copy Raw"):
+                    st.code(msg["bot"], language="markdown")
+        elif meta["has_code"]:
+            with st.expander("📋 Copy Raw"):
+                st.code(msg["bot"], language="markdown")
         
-        return response.text
-    
-    except Exception as e:
-        error = str(e)
-        if "quota" in error.lower() or "resource_exhausted" in error.lower():
-            return "⚠️ **API Quota Exceeded**\n\nPlease wait and try again."
-        elif "safety" in error.lower():
-            return "⚠️ **Content Filtered**\n\nTry rephrasing your question."
-        elif "invalid_argument" in error.lower():
-            return "⚠️ **Invalid Request**\n\nCheck file size/format."
-        else:
-            return f"❌ **Error:** {error}"
+        if meta["caption"]:
+            st.caption(meta["caption"])
 
 # Initialize session state
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+if "chat" not in st.session_state:
+    # Resume ?session=<id> from the store (latest page only) or start fresh
+    st.session_state.chat = get_pipeline().new_session(st.query_params.get("session"))
+    st.query_params["session"] = st.session_state.chat.session_id
+if "settings" not in st.session_state:
+    st.session_state.settings = ChatSettings()
+if "render_window" not in st.session_state:
+    st.session_state.render_window = RENDER_WINDOW
+if "render_meta" not in st.session_state:
+    st.session_state.render_meta = {}
+if "chat_exporter" not in st.session_state:
+    st.session_state.chat_exporter = ChatExporter(st.session_state.chat.session_id)
 if "uploaded_image" not in st.session_state:
     st.session_state.uploaded_image = None
-if "uploaded_pdf" not in st.session_state:
-    st.session_state.uploaded_pdf = None
-if "pdf_text" not in st.session_state:
-    st.session_state.pdf_text = None
-if "session_start" not in st.session_state:
-    st.session_state.session_start = get_ist_time()
-if "temperature" not in st.session_state:
-    st.session_state.temperature = 0.7
-if "max_tokens" not in st.session_state:
-    st.session_state.max_tokens = 2048
+if "image_uploader_key" not in st.session_state:
+    st.session_state.image_uploader_key = 0
+if "pdf_uploader_key" not in st.session_state:
+    st.session_state.pdf_uploader_key = 0
+if "removed_pdfs" not in st.session_state:
+    st.session_state.removed_pdfs = set()
+if "stream_responses" not in st.session_state:
+    st.session_state.stream_responses = True
+
+chat = st.session_state.chat
+settings = st.session_state.settings
+memory_usage = track_memory()
 
 # Header with Modern Design
-st.markdown("""
-<div style='text-align: center; margin-bottom: 2rem; animation: fadeIn 1s ease-in;'>
-    <h1 style='margin-bottom: 0.5rem;'>🌟 GeminiFlow</h1>
-    <p style='color: rgba(255,255,255,0.7); font-size: 18px; font-weight: 500; letter-spacing: 2px;'>
-        <span style='color: #667eea;'>●</span> Excel Export 
-        <span style='color: #764ba2;'>●</span> Image Analysis 
-        <span style='color: #f093fb;'>●</span> PDF Processing
-    </p>
-    <p style='color: rgba(255,255,255,0.5); font-size: 14px; margin-top: 8px; font-style: italic;'>
-        Experience AI-powered assistance like never before
-    </p>
-</div>
-""", unsafe_allow_html=True)
+st.markdown(theme.HEADER_HTML, unsafe_allow_html=True)
 
 # Sidebar
 with st.sidebar:
-    st.markdown("""
-    <div style='text-align: center; padding: 20px 0; margin-bottom: 20px;'>
-        <h2 style='font-size: 24px; font-weight: 700; margin: 0;'>🎛️ Control Hub</h2>
-        <p style='color: rgba(255,255,255,0.5); font-size: 12px; margin-top: 5px;'>Customize your experience</p>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(theme.SIDEBAR_HEADER_HTML, unsafe_allow_html=True)
     
     with st.expander("📊 Session Stats", expanded=True):
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("💬 Messages", len(st.session_state.messages))
+            st.metric("💬 Messages", chat.message_count)
         with col2:
-            duration = get_ist_time() - st.session_state.session_start
+            duration = get_ist_time() - chat.started_at
             mins = duration.seconds // 60
             st.metric("⏱️ Duration", f"{mins}m")
+        totals = chat.token_totals
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("📥 Prompt Tokens", f"{totals.get('prompt_tokens', 0):,}")
+        with col2:
+            st.metric("📤 Output Tokens", f"{totals.get('output_tokens', 0):,}")
+        if settings.session_token_budget:
+            used = totals.get("total_tokens", 0)
+            st.progress(min(1.0, used / settings.session_token_budget),
+                        text=f"{used:,} / {settings.session_token_budget:,} session tokens")
+        if totals.get("components"):
+            st.caption(" • ".join(f"{name} {count:,}" for name, count in totals["components"].items() if count))
     
     st.divider()
     
@@ -755,81 +364,177 @@ with st.sidebar:
     st.divider()
     
     with st.expander("⚙️ Model Settings"):
-        st.session_state.temperature = st.slider("Temperature", 0.0, 1.0, 0.7, 0.1)
-        st.session_state.max_tokens = st.slider("Max Tokens", 256, 8192, 2048, 256)
+        settings.temperature = st.slider("Temperature", 0.0, 1.0, 0.7, 0.1)
+        settings.max_tokens = st.slider("Max Tokens", 256, 8192, 2048, 256)
+        st.session_state.stream_responses = st.toggle("Stream Responses", value=True,
+                                                      help="Show tokens as Gemini generates them")
+        settings.context_tokens = st.slider("Context Budget (tokens)", 2000, 32000, 8000, 1000,
+                                                    help="Prompt size limit for history, summary and documents")
+        settings.session_token_budget = st.number_input(
+            "Session Token Budget", min_value=0, value=0, step=10000,
+            help="0 = unlimited. Near the limit, prompts drop history and documents instead of failing")
+        settings.doc_budget = st.slider("Document Context (chars)", 2000, 32000, 8000, 1000,
+                                                help="How much of an uploaded PDF is sent with each question")
+        settings.use_cache = st.toggle("Use Response Cache", value=True,
+                                               help="Reuse answers to identical prompts, files and settings")
+        show_performance = st.toggle("Performance Panel", value=os.getenv("PERF_PANEL") == "1",
+                                     help="Show p50/p95 timings per stage for this server process")
+        cache_stats = get_response_cache().stats()
+        st.caption(f"💾 Cache: {cache_stats['hits']} hits • {cache_stats['misses']} misses • "
+                   f"{cache_stats['entries']} entries")
+        limits = get_pipeline().limiter.stats()
+        st.caption(f"🚦 Rate limit: {limits['rpm'] or '∞'} req/min • {limits['queued']} queued • "
+                   f"{limits['retries']} retries")
+        if get_pipeline().single_flight is not None:
+            flights = get_pipeline().single_flight.stats()
+            st.caption(f"🔗 Shared calls: {flights['coalesced']} of {flights['requests']} requests "
+                       f"({flights['coalescing_ratio']:.0%}) • {flights['in_flight']} in flight")
+    
+    if show_performance:
+        with st.expander("📈 Performance", expanded=True):
+            stages = tracing.stats.summary()
+            if stages:
+                st.markdown("| Stage | Runs | p50 ms | p95 ms |\n|:--|--:|--:|--:|\n" + "\n".join(
+                    f"| {name} | {s['count']} | {s['p50_ms']:,.1f} | {s['p95_ms']:,.1f} |"
+                    for name, s in stages.items()))
+                st.caption(f"This server process, last {tracing.SAMPLES_PER_STAGE} runs per stage")
+            else:
+                st.caption("No timings yet: ask a question or upload a file")
+            ledger = get_session_memory().stats()
+            st.caption(f"🧠 This session {format_bytes(sum(memory_usage.values()))} • "
+                       f"{ledger['sessions']} sessions {format_bytes(ledger['total_bytes'])} • "
+                       f"{ledger['shrunk'] + ledger['idle_shrunk']} shrunk")
     
     st.divider()
     
     st.markdown("### 📁 File Upload Zone")
-    st.markdown("<p style='color: rgba(255,255,255,0.5); font-size: 12px; margin-bottom: 10px;'>Drag & drop or click to browse</p>", unsafe_allow_html=True)
+    st.markdown(theme.UPLOAD_HINT_HTML, unsafe_allow_html=True)
     
-    uploaded_image = st.file_uploader("🖼️ Upload Image", type=['png', 'jpg', 'jpeg', 'webp', 'gif'])
+    uploaded_image = st.file_uploader("🖼️ Upload Image", type=['png', 'jpg', 'jpeg', 'webp', 'gif'],
+                                      key=f"image_uploader_{st.session_state.image_uploader_key}")
     if uploaded_image:
-        st.session_state.uploaded_image = uploaded_image
-        st.success(f"✅ {uploaded_image.name}")
-        st.caption(f"📦 {get_file_size(uploaded_image)}")
-        img = process_image(uploaded_image)
+        # Keep the image on disk and reset the uploader so Streamlit frees its copy
+        if st.session_state.uploaded_image:
+            st.session_state.uploaded_image.close()
+        st.session_state.uploaded_image = SpilledUpload(uploaded_image)
+        st.session_state.image_uploader_key += 1
+        st.rerun()
+    if st.session_state.uploaded_image:
+        spilled = st.session_state.uploaded_image
+        st.success(f"✅ {spilled.name}")
+        st.caption(f"📦 {format_bytes(spilled.size)}")
+        img = process_image(spilled.path)
         if img:
             st.image(img, use_container_width=True)
             st.caption(f"📐 {img.width}x{img.height}")
         if st.button("🗑️ Remove Image"):
+            spilled.close()
             st.session_state.uploaded_image = None
             st.rerun()
     
-    uploaded_pdf = st.file_uploader("📄 Upload PDF", type=['pdf'])
-    if uploaded_pdf:
-        st.session_state.uploaded_pdf = uploaded_pdf
-        st.success(f"✅ {uploaded_pdf.name}")
-        st.caption(f"📦 {get_file_size(uploaded_pdf)}")
-        if st.session_state.pdf_text is None:
-            with st.spinner("Reading PDF..."):
-                text, pages = extract_pdf_text(uploaded_pdf)
-                if text:
-                    st.session_state.pdf_text = text
-                    word_count = len(text.split())
-                    st.info(f"📑 {pages} pages • {word_count:,} words")
-        else:
-            word_count = len(st.session_state.pdf_text.split())
-            st.info(f"📑 {word_count:,} words extracted")
-        if st.button("🗑️ Remove PDF"):
-            st.session_state.uploaded_pdf = None
-            st.session_state.pdf_text = None
+    uploaded_pdfs = st.file_uploader("📄 Upload PDFs", type=['pdf'], accept_multiple_files=True,
+                                     key=f"pdf_uploader_{st.session_state.pdf_uploader_key}")
+    new_pdfs = [f for f in uploaded_pdfs or []
+                if f.file_id not in chat.documents and f.file_id not in st.session_state.removed_pdfs]
+    if new_pdfs:
+        with st.spinner(f"Reading {len(new_pdfs)} PDF{'s' if len(new_pdfs) > 1 else ''}..."):
+            for pdf, document in zip(new_pdfs, extract_pdf_texts(new_pdfs)):
+                if document is None:
+                    st.session_state.removed_pdfs.add(pdf.file_id)  # don't retry it every rerun
+                    continue
+                try:
+                    chat.documents.add(document, key=pdf.file_id)
+                except WorkspaceFull as e:
+                    document.close()
+                    st.session_state.removed_pdfs.add(pdf.file_id)
+                    st.warning(f"⚠️ {e}")
+                    continue
+                track_memory()
+                if get_session_memory().over_cap(chat.session_id):
+                    chat.documents.remove(pdf.file_id)
+                    st.session_state.removed_pdfs.add(pdf.file_id)
+                    st.warning(f"⚠️ {document.name} was not attached: this session is over its memory limit. "
+                               "Remove a document or start a new chat.")
+        # Indexed documents live in their own files; a fresh uploader lets Streamlit free the uploads
+        st.session_state.pdf_uploader_key += 1
+        st.session_state.removed_pdfs = set()
+    if len(chat.documents):
+        docs = chat.documents
+        st.info(f"📑 {len(docs)} document{'s' if len(docs) > 1 else ''} • {docs.pages} pages • "
+                f"{docs.word_count:,} words")
+        for key, document in list(docs.items()):
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                st.caption(f"✅ {document.name} • {document.pages} pages")
+            with col2:
+                if st.button("✖", key=f"remove_pdf_{key}", help=f"Remove {document.name}"):
+                    docs.remove(key)
+                    st.session_state.removed_pdfs.add(key)
+                    st.rerun()
+        if st.button("🗑️ Remove All PDFs"):
+            docs.clear()
+            st.session_state.pdf_uploader_key += 1
+            st.session_state.removed_pdfs = set()
             st.rerun()
     
     st.divider()
     
     st.markdown("### ⚡ Quick Actions")
-    st.markdown("<p style='color: rgba(255,255,255,0.5); font-size: 12px; margin-bottom: 10px;'>Manage your session</p>", unsafe_allow_html=True)
+    st.markdown(theme.ACTIONS_HINT_HTML, unsafe_allow_html=True)
     col1, col2 = st.columns(2)
     with col1:
         if st.button("🧹 Clear", help="Clear chat history"):
-            st.session_state.messages = []
+            get_pipeline().clear_session(chat)
+            st.session_state.chat_exporter = ChatExporter(chat.session_id)
+            st.session_state.render_meta = {}
+            st.session_state.render_window = RENDER_WINDOW
             st.rerun()
     with col2:
         if st.button("🔄 Reset", help="Reset everything"):
-            st.session_state.messages = []
+            st.session_state.chat = get_pipeline().new_session()
+            st.query_params["session"] = st.session_state.chat.session_id
+            st.session_state.chat_exporter = ChatExporter(st.session_state.chat.session_id)
+            st.session_state.render_meta = {}
+            st.session_state.render_window = RENDER_WINDOW
+            if st.session_state.uploaded_image:
+                st.session_state.uploaded_image.close()
             st.session_state.uploaded_image = None
-            st.session_state.uploaded_pdf = None
-            st.session_state.pdf_text = None
-            st.session_state.session_start = get_ist_time()
+            st.session_state.pdf_uploader_key += 1
+            st.session_state.removed_pdfs = set()
             st.rerun()
     
-    if st.session_state.messages:
+    if chat.messages:
         st.markdown("### 📥 Export Options")
-        st.markdown("<p style='color: rgba(255,255,255,0.5); font-size: 12px; margin-bottom: 10px;'>Download your conversation</p>", unsafe_allow_html=True)
-        has_tables = any('|' in msg['bot'] and '-|-' in msg['bot'] for msg in st.session_state.messages)
+        st.markdown(theme.EXPORT_HINT_HTML, unsafe_allow_html=True)
+        has_tables = any('|' in msg['bot'] and '-|-' in msg['bot'] for msg in chat.messages)
         if has_tables:
             st.caption("💡 Excel buttons appear below table responses")
         
-        col1, col2 = st.columns(2)
+        exporter = get_chat_exporter()
+        col1, col2, col3 = st.columns(3)
         with col1:
-            st.download_button("� TXT", data=export_chat_markdown(),
+            st.download_button("� TXT", data=partial(export_chat_markdown, exporter),
                              file_name=f"chat_{get_ist_time().strftime('%Y%m%d_%H%M%S')}.md",
                              mime="text/markdown", use_container_width=True)
         with col2:
-            st.download_button("📊 JSON", data=export_chat_json(),
+            st.download_button("📊 JSON", data=partial(export_chat_json, exporter, chat.started_at),
                              file_name=f"chat_{get_ist_time().strftime('%Y%m%d_%H%M%S')}.json",
                              mime="application/json", use_container_width=True)
+        with col3:
+            st.download_button("🧾 JSONL", data=partial(export_chat_jsonl, exporter),
+                             file_name=f"chat_{get_ist_time().strftime('%Y%m%d_%H%M%S')}.jsonl",
+                             mime="application/jsonl", use_container_width=True)
+    
+    store = get_conversation_store()
+    if store is not None:
+        with st.expander("💾 Saved Sessions"):
+            st.caption(f"This session: `{chat.session_id}` (bookmark the URL to resume)")
+            for saved in store.list_sessions(limit=10):
+                if saved["id"] == chat.session_id:
+                    continue
+                updated = datetime.fromtimestamp(saved["updated_at"], IST).strftime('%d %b %I:%M %p')
+                st.markdown(f"[{saved['title'] or 'Untitled'}](?session={saved['id']}) "
+                            + theme.session_meta_html(saved['message_count'], updated), unsafe_allow_html=True)
     
     st.divider()
     
@@ -849,106 +554,36 @@ with st.sidebar:
 chat_container = st.container()
 
 with chat_container:
-    if not st.session_state.messages:
-        st.markdown("""
-        <div style='text-align: center; padding: 40px 20px; animation: fadeIn 1.5s ease-in;'>
-            <div style='font-size: 80px; margin-bottom: 20px; animation: bounce 2s infinite;'>✨</div>
-            <h2 style='color: #c4b5fd; font-size: 28px; margin-bottom: 15px;'>Welcome to GeminiFlow</h2>
-            <p style='color: rgba(255,255,255,0.6); font-size: 16px; max-width: 600px; margin: 0 auto 30px;'>
-                Your intelligent AI companion powered by Google Gemini 2.0
-            </p>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        with st.chat_message("assistant", avatar="🌟"):
-            st.markdown("""
-            ### 🎯 What I Can Do For You:
-            
-            <div style='display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 15px; margin-top: 20px;'>
-                <div style='background: rgba(102, 126, 234, 0.1); padding: 20px; border-radius: 12px; border-left: 3px solid #667eea;'>
-                    <h4 style='color: #667eea; margin: 0 0 10px 0;'>📊 Excel & Data</h4>
-                    <p style='color: rgba(255,255,255,0.7); font-size: 14px; margin: 0;'>Tables auto-export to Excel with perfect formatting</p>
-                </div>
-                <div style='background: rgba(118, 75, 162, 0.1); padding: 20px; border-radius: 12px; border-left: 3px solid #764ba2;'>
-                    <h4 style='color: #a78bfa; margin: 0 0 10px 0;'>🔢 Math Problems</h4>
-                    <p style='color: rgba(255,255,255,0.7); font-size: 14px; margin: 0;'>Step-by-step solutions with clear explanations</p>
-                </div>
-                <div style='background: rgba(240, 147, 251, 0.1); padding: 20px; border-radius: 12px; border-left: 3px solid #f093fb;'>
-                    <h4 style='color: #f093fb; margin: 0 0 10px 0;'>🖼️ Image Analysis</h4>
-                    <p style='color: rgba(255,255,255,0.7); font-size: 14px; margin: 0;'>Extract data, analyze charts & diagrams</p>
-                </div>
-                <div style='background: rgba(79, 172, 254, 0.1); padding: 20px; border-radius: 12px; border-left: 3px solid #4facfe;'>
-                    <h4 style='color: #4facfe; margin: 0 0 10px 0;'>📄 PDF Processing</h4>
-                    <p style='color: rgba(255,255,255,0.7); font-size: 14px; margin: 0;'>Summarize documents & extract information</p>
-                </div>
-            </div>
-            
-            ---
-            
-            ### 💡 Pro Tips:
-            
-            - 🎯 **Use Quick Prompts** in the sidebar for common tasks
-            - 📊 **Request "markdown table format"** for instant Excel export
-            - 🎨 **Upload files first** then ask questions about them
-            - ⚡ **Be specific** for the best results
-            
-            <div style='text-align: center; margin-top: 30px; padding: 20px; background: rgba(139, 92, 246, 0.1); border-radius: 12px;'>
-                <p style='color: #c4b5fd; font-size: 18px; font-weight: 600; margin: 0;'>
-                    Ready to get started? 🚀
-                </p>
-                <p style='color: rgba(255,255,255,0.5); font-size: 14px; margin-top: 8px;'>
-                    Type your question below or try a quick prompt!
-                </p>
-            </div>
-            
-            ---
-            
-            <div style='text-align: center; margin-top: 20px; padding: 15px;'>
-                <p style='color: #8b5cf6; font-size: 14px; font-weight: 600; margin: 0;'>
-                    ⚡ Powered by Google Gemini 2.0 Flash
-                </p>
-                <p style='color: rgba(255,255,255,0.5); font-size: 13px; margin-top: 5px;'>
-                    Built with ❤️ by <span style='color: #a78bfa; font-weight: 600;'>Brijesh Singh</span>
-                </p>
-            </div>
-            """, unsafe_allow_html=True)
+    if chat.history_offset > 0:
+        if st.button(f"⬆️ Load {min(HISTORY_PAGE_SIZE, chat.history_offset)} older messages "
+                     f"({chat.history_offset} not loaded)", use_container_width=True):
+            with chat.lock:
+                get_pipeline().load_older(chat)
+            st.rerun()
     
-    for i, msg in enumerate(st.session_state.messages):
-        with st.chat_message("user", avatar="👤"):
-            st.markdown(msg["user"])
-            tags = []
-            if msg.get("has_image"):
-                tags.append("🖼️")
-            if msg.get("has_pdf"):
-                tags.append("📄")
-            if tags:
-                st.caption(" ".join(tags))
+    if not chat.messages:
+        st.markdown(theme.WELCOME_HTML, unsafe_allow_html=True)
         
-        with st.chat_message("assistant", avatar="✨"):
-            st.markdown(msg["bot"])
-            
-            if '|' in msg["bot"] and '-|-' in msg["bot"]:
-                col_a, col_b = st.columns([1, 4])
-                with col_a:
-                    excel_data = create_excel_from_response(msg["bot"])
-                    if excel_data:
-                        st.download_button("📥 Excel", data=excel_data,
-                                         file_name=f"data_{i}_{get_ist_time().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                         key=f"excel_{i}")
-                with col_b:
-                    with st.expander("📋 Copy Raw"):
-                        st.code(msg["bot"], language="markdown")
-            elif '```' in msg["bot"]:
-                with st.expander("📋 Copy Raw"):
-                    st.code(msg["bot"], language="markdown")
-            
-            if "timestamp" in msg:
-                try:
-                    ts = datetime.fromisoformat(msg["timestamp"])
-                    st.caption(f"🕒 {ts.strftime('%I:%M %p')}")
-                except:
-                    pass
+        with st.chat_message("assistant", avatar="🌟"):
+            st.markdown(theme.WELCOME_GUIDE, unsafe_allow_html=True)
+    
+    messages = chat.messages
+    window_start = max(0, len(messages) - st.session_state.render_window)
+    if window_start > 0:
+        # Older turns collapse into one cheap block of cached one-line previews
+        with st.container(border=True):
+            previews = [get_render_meta(chat.history_offset + i, messages[i])["preview"]
+                        for i in range(max(0, window_start - COLLAPSED_PREVIEWS), window_start)]
+            hidden = window_start - len(previews)
+            st.markdown((f"*…{hidden} earlier turns*\n\n" if hidden else "") + "\n".join(previews))
+            if st.button(f"⬆️ Show {min(RENDER_WINDOW, window_start)} earlier turns", key="show_earlier",
+                         use_container_width=True):
+                st.session_state.render_window += RENDER_WINDOW
+                st.rerun()
+    
+    with tracing.span("render.history", messages=len(messages) - window_start):
+        for i in range(window_start, len(messages)):
+            render_message(chat.history_offset + i, messages[i])
 
 # Chat input
 if prompt := st.chat_input("💭 Message Gemini..."):
@@ -957,55 +592,66 @@ if prompt := st.chat_input("💭 Message Gemini..."):
         context_tags = []
         if st.session_state.uploaded_image:
             context_tags.append("🖼️")
-        if st.session_state.uploaded_pdf:
-            context_tags.append("📄")
+        if len(chat.documents):
+            context_tags.append("📄" * min(len(chat.documents), 3))
         if context_tags:
             st.caption(" ".join(context_tags))
     
     image_data = None
     if st.session_state.uploaded_image:
-        image_data = process_image(st.session_state.uploaded_image)
+        image_data = process_image(st.session_state.uploaded_image.path)
     
-    with st.chat_message("assistant", avatar="✨"):
-        message_placeholder = st.empty()
+    # Held through record_turn so memory reclaim never shrinks this session mid-turn
+    with chat.lock:
+        with st.chat_message("assistant", avatar="✨"):
+            message_placeholder = st.empty()
+            usage = {}
         
-        with st.spinner("🤔 Thinking..."):
-            response = get_gemini_response(prompt, st.session_state.messages, 
-                                         image=image_data, pdf_text=st.session_state.pdf_text)
+            def show_queue_position(position, eta):
+                ahead = f"{position - 1} request{'s' if position != 2 else ''} ahead • " if position > 1 else ""
+                message_placeholder.info(f"⏳ Waiting for API capacity: {ahead}about {max(1, round(eta))}s")
         
-        full_text = ""
-        words = response.split()
-        for i, word in enumerate(words):
-            full_text += word + " "
-            if i % 3 == 0 or i == len(words) - 1:
-                message_placeholder.markdown(full_text + "▌")
-                time.sleep(0.03)
-        message_placeholder.markdown(response)
+            try:
+                if st.session_state.stream_responses:
+                    chunks = get_pipeline().stream(chat, prompt, settings, image=image_data, usage=usage,
+                                                   on_wait=show_queue_position)
+                    response, ttft_ms, latency_ms = render_stream(chunks, message_placeholder)
+                else:
+                    start = time.perf_counter()
+                    with st.spinner("🤔 Thinking..."):
+                        response = get_pipeline().generate(chat, prompt, settings, image=image_data, usage=usage,
+                                                           on_wait=show_queue_position)
+                    ttft_ms, latency_ms = None, (time.perf_counter() - start) * 1000
+                    with tracing.span("render.response", chars=len(response)):
+                        message_placeholder.markdown(response)
+            except QuotaExceeded as e:
+                # Not an answer: shown once, never added to the conversation
+                message_placeholder.warning(format_gemini_error(e))
+                st.stop()
         
-        if '|' in response and '-|-' in response:
-            col_a, col_b = st.columns([1, 4])
-            with col_a:
-                excel_data = create_excel_from_response(response)
-                if excel_data:
-                    st.download_button("📥 Excel", data=excel_data,
-                                     file_name=f"data_{get_ist_time().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                     key="excel_current")
-            with col_b:
+            if '|' in response and '-|-' in response:
+                col_a, col_b = st.columns([1, 4])
+                with col_a:
+                    if message_has_table(response):
+                        st.download_button("📥 Excel", data=partial(get_message_excel, response),
+                                         file_name=f"data_{get_ist_time().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                         key="excel_current")
+                with col_b:
+                    with st.expander("📋 Copy Raw"):
+                        st.code(response, language="markdown")
+            elif '```' in response:
                 with st.expander("📋 Copy Raw"):
                     st.code(response, language="markdown")
-        elif '```' in response:
-            with st.expander("📋 Copy Raw"):
-                st.code(response, language="markdown")
         
-        st.caption(f"🕒 {get_ist_time().strftime('%I:%M %p')}")
-    
-    st.session_state.messages.append({
-        "user": prompt, "bot": response,
-        "has_image": st.session_state.uploaded_image is not None,
-        "has_pdf": st.session_state.uploaded_pdf is not None,
-        "timestamp": get_ist_time().isoformat()
-    })
+            timings = {"ttft_ms": ttft_ms, "latency_ms": latency_ms}
+            st.caption(f"🕒 {get_ist_time().strftime('%I:%M %p')}{format_latency(timings)}")
+            if usage.get("degraded"):
+                st.caption("⚠️ Session token budget nearly used: answered with reduced context")
+    
+        get_pipeline().record_turn(chat, prompt, response, usage, image=image_data,
+                                   has_image=st.session_state.uploaded_image is not None,
+                                   ttft_ms=ttft_ms, latency_ms=latency_ms)
     st.rerun()
 
 
@@ -0,0 +1,60 @@
+"""Per-message derived artifacts (Excel files, table detection), built once"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def content_key(text):
+    """Stable id for a message body"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _size_of(value):
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return 64
+
+
+class ArtifactCache:
+    """LRU of artifacts keyed by (kind, content hash)
+
+    Artifacts are only built when first asked for, and each distinct message
+    body is built at most once while it stays in the cache. Bounded by entry
+    count and total bytes; safe to share between sessions and the download
+    handler thread.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (kind, digest) -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.hits = 0
+
+    def get_or_build(self, kind, text, build):
+        """Cached build(text) for this kind of artifact"""
+        key = (kind, content_key(text))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        value = build(text)
+        size = _size_of(value)
+        with self._lock:
+            self.builds += 1
+            if key not in self._entries and size <= self.max_bytes:
+                self._entries[key] = (value, size)
+                self._bytes += size
+                while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self._bytes -= evicted
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "builds": self.builds, "hits": self.hits}
@@ -0,0 +1,317 @@
+"""Run a file of prompts through the chat pipeline, outside the browser
+
+Each line of the jobs file is a JSON object:
+    {"id": "q1", "prompt": "...", "pdf": "report.pdf", "image": "chart.png",
+     "settings": {"temperature": 0.2}}
+Only "prompt" is required; "pdfs" takes a list of files, and "id"
+defaults to the line number. Every job is a fresh conversation built and
+answered exactly as in the app (core.ChatPipeline), with the tables in
+its answer saved as a workbook. Run with:
+    python batch.py jobs.jsonl --output results.jsonl [--workbooks DIR] [--concurrency 4]
+
+Jobs run on a bounded thread pool behind the shared rate limiter
+(GEMINI_RPM / GEMINI_TPM). Each result is appended to the output file as
+it finishes, which is also the checkpoint: --resume skips jobs already
+answered there and runs the rest, including failed ones. A throughput and
+latency report is printed at the end (--report also writes it as JSON).
+GEMINI_BACKEND=fake runs everything against the offline stand-in model.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from core import (ChatPipeline, ChatSettings, create_excel_from_response, create_model, load_documents,
+                  open_rate_limiter, open_response_cache, open_single_flight, process_image, uses_fake_backend,
+                  SYSTEM_INSTRUCTION)
+from rate_limit import QuotaExceeded
+from tracing import StageStats, span
+from workspace import WorkspaceFull
+import tracing
+
+# Jobs read ahead of the pool, so a long file is never loaded all at once
+QUEUE_PER_WORKER = 2
+
+
+class JobError(Exception):
+    """A job line that cannot be run as written"""
+
+
+def read_jobs(path):
+    """(line number, job) for each non-blank line; bad lines yield a JobError"""
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield number, JobError(f"line {number}: invalid JSON ({e})")
+                continue
+            if not isinstance(job, dict) or not isinstance(job.get("prompt"), str) or not job["prompt"].strip():
+                yield number, JobError(f'line {number}: a job needs a non-empty "prompt"')
+                continue
+            yield number, job
+
+
+def job_id(number, job):
+    return str(job.get("id", number)) if isinstance(job, dict) else str(number)
+
+
+def finished_ids(path):
+    """Ids of jobs already answered in an earlier run's output"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short when the last run stopped
+            if result.get("status") == "ok":
+                done.add(result["id"])
+    return done
+
+
+def job_settings(defaults, overrides):
+    try:
+        return ChatSettings.from_dict(overrides, base=defaults)
+    except ValueError as e:
+        raise JobError(str(e))
+
+
+def resolve(base_dir, path):
+    return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+
+class BatchRunner:
+    """Answers jobs concurrently with one pipeline and writes results in order of completion
+
+    base_dir resolves relative "pdf" / "image" paths (the jobs file's
+    directory); workbook_dir, when set, receives <id>.xlsx for every answer
+    holding a table.
+    """
+
+    def __init__(self, pipeline, settings=None, concurrency=4, workbook_dir=None, base_dir="."):
+        self.pipeline = pipeline
+        self.settings = settings or ChatSettings()
+        self.concurrency = concurrency
+        self.workbook_dir = workbook_dir
+        self.base_dir = base_dir
+        self.latency = StageStats(samples=None)
+        self.counts = {"ok": 0, "error": 0, "quota": 0, "skipped": 0, "cached": 0, "workbooks": 0}
+        self.tokens = 0
+        self.elapsed = 0.0
+
+    def run_job(self, number, job):
+        """Answer one job; returns its result record"""
+        key = job_id(number, job)
+        result = {"id": key, "line": number}
+        start = time.perf_counter()
+        if isinstance(job, JobError):
+            return {**result, "status": "error", "error": str(job)}
+        session = self.pipeline.new_session()
+        try:
+            with span("batch.job", job=key) as timing:
+                settings = job_settings(self.settings, job.get("settings"))
+                self._attach(session, job)
+                image = process_image(resolve(self.base_dir, job["image"]))[0] if job.get("image") else None
+                usage = {}
+                response = self.pipeline.generate(session, job["prompt"], settings, image=image, usage=usage)
+                latency_ms = (time.perf_counter() - start) * 1000
+                msg = self.pipeline.record_turn(session, job["prompt"], response, usage, image=image,
+                                                latency_ms=latency_ms)
+                result.update(status="error" if "error" in usage else "ok", response=response,
+                              latency_ms=round(latency_ms, 1), tokens=msg["tokens"], cached=usage.get("cached", False))
+                if "error" in usage:
+                    result["error"] = usage["error"]
+                elif self.workbook_dir:
+                    result["workbook"] = self._save_workbook(key, response)
+                timing.set(status=result["status"])
+        except QuotaExceeded as e:
+            result.update(status="quota", error=str(e))
+        except Exception as e:
+            # Any failure (a bad file, a workbook openpyxl rejects) fails this job only
+            result.update(status="error", error=str(e) if isinstance(e, (JobError, WorkspaceFull, OSError))
+                          else f"{type(e).__name__}: {e}")
+        finally:
+            session.documents.clear()
+        return result
+
+    def _attach(self, session, job):
+        paths = job.get("pdfs") or ([job["pdf"]] if job.get("pdf") else [])
+        if isinstance(paths, str) or not all(isinstance(p, str) for p in paths):
+            raise JobError('"pdfs" must be a list of file paths')
+        files = [resolve(self.base_dir, p) for p in paths]
+        documents = load_documents(files, [os.path.basename(p) for p in files])
+        for path, document in zip(files, documents):
+            problem = (f"{path}: {document}" if isinstance(document, Exception) else
+                       f"{path}: no text could be extracted" if document is None else None)
+            if problem:
+                for other_path, other in zip(files, documents):
+                    if other is not None and not isinstance(other, Exception) and other_path not in session.documents:
+                        other.close()
+                raise JobError(problem)
+            session.documents.add(document, key=path)
+
+    def _save_workbook(self, key, response):
+        """Write <id>.xlsx (via a temp file, so resumed runs never see half a workbook)"""
+        name = "".join(c if c.isalnum() or c in "-_." else "_" for c in key)
+        path = os.path.join(self.workbook_dir, f"{name}.xlsx")
+        tmp = f"{path}.tmp"
+        try:
+            if create_excel_from_response(response, tmp) is None:
+                return None
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return path
+
+    def run(self, jobs, out, skip=(), on_result=None):
+        """Run (line number, job) pairs, appending one JSON line per result to out
+
+        Jobs whose id is in skip are not run. At most concurrency jobs run
+        at once, with a few more read ahead.
+        """
+        if self.workbook_dir:
+            os.makedirs(self.workbook_dir, exist_ok=True)
+        start = time.perf_counter()
+        pending = set()
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch")
+        try:
+            for number, job in jobs:
+                if job_id(number, job) in skip:
+                    self.counts["skipped"] += 1
+                    continue
+                if len(pending) >= self.concurrency * QUEUE_PER_WORKER:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._write(done, out, on_result)
+                pending.add(pool.submit(self.run_job, number, job))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                self._write(done, out, on_result)
+        finally:
+            # On an interrupt, jobs not yet started are dropped; --resume runs them
+            pool.shutdown(wait=True, cancel_futures=True)
+        self.elapsed = time.perf_counter() - start
+        return self.report()
+
+    def _write(self, futures, out, on_result):
+        for future in futures:
+            result = future.result()
+            self.counts[result["status"]] += 1
+            if result.get("cached"):
+                self.counts["cached"] += 1
+            if result.get("workbook"):
+                self.counts["workbooks"] += 1
+            if "latency_ms" in result:
+                self.latency.add("job", result["latency_ms"], error=result["status"] != "ok")
+                self.tokens += result["tokens"].get("total_tokens", 0)
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            if on_result is not None:
+                on_result(result)
+
+    def report(self):
+        """Counts, throughput and job latency for this run, plus per-stage timings"""
+        finished = self.counts["ok"] + self.counts["error"] + self.counts["quota"]
+        latency = self.latency.summary().get("job", {})
+        return {
+            **self.counts, "jobs": finished, "elapsed_s": round(self.elapsed, 3),
+            "jobs_per_s": round(finished / self.elapsed, 2) if self.elapsed else None,
+            "tokens": self.tokens, "concurrency": self.concurrency,
+            "latency_ms": {k: v for k, v in latency.items() if k != "count"},
+            "stages": tracing.stats.summary(),
+            "rate_limit": self.pipeline.limiter.stats() if self.pipeline.limiter else None,
+            "single_flight": self.pipeline.single_flight.stats() if self.pipeline.single_flight else None,
+        }
+
+
+def format_report(report):
+    latency = report["latency_ms"]
+    lines = [f"{report['jobs']} jobs in {report['elapsed_s']:.1f}s ({report['jobs_per_s'] or 0:.2f}/s, "
+             f"concurrency {report['concurrency']}): {report['ok']} ok, {report['error']} failed, "
+             f"{report['quota']} over quota, {report['skipped']} skipped from an earlier run"]
+    if latency:
+        lines.append(f"latency p50 {latency['p50_ms']:,.0f} ms  p95 {latency['p95_ms']:,.0f} ms  "
+                     f"max {latency['max_ms']:,.0f} ms  • {report['cached']} from cache  "
+                     f"• {report['workbooks']} workbooks  • {report['tokens']:,} tokens")
+    if report["rate_limit"]:
+        limits = report["rate_limit"]
+        lines.append(f"rate limit: {limits['rpm'] or '∞'} req/min • {limits['retries']} retries")
+    if report["single_flight"]:
+        flights = report["single_flight"]
+        lines.append(f"shared calls: {flights['coalesced']} of {flights['requests']} requests "
+                     f"({flights['coalescing_ratio']:.0%})")
+    return "\n".join(lines)
+
+
+def create_pipeline():
+    """Pipeline for batch runs: shared limiter and response cache, nothing saved to the conversation store"""
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key and not uses_fake_backend():
+        raise SystemExit("GOOGLE_API_KEY not found! Add it to .env file or the environment")
+    return ChatPipeline(create_model(api_key), response_cache=open_response_cache(), limiter=open_rate_limiter(),
+                        system_instruction=SYSTEM_INSTRUCTION, single_flight=open_single_flight())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through GeminiFlow")
+    parser.add_argument("jobs", help="JSONL file, one job per line")
+    parser.add_argument("--output", "-o", required=True, help="results JSONL, appended as jobs finish")
+    parser.add_argument("--workbooks", help="directory for <id>.xlsx of answers holding tables")
+    parser.add_argument("--concurrency", "-j", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "4")))
+    parser.add_argument("--resume", action="store_true", help="skip jobs already answered in --output")
+    parser.add_argument("--report", help="also write the run report here as JSON")
+    parser.add_argument("--temperature", type=float, default=ChatSettings.temperature)
+    parser.add_argument("--max-tokens", type=int, default=ChatSettings.max_tokens)
+    parser.add_argument("--doc-budget", type=int, default=ChatSettings.doc_budget)
+    parser.add_argument("--no-cache", action="store_true", help="don't answer repeated jobs from the response cache")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.output) and not args.resume:
+        parser.error(f"{args.output} exists: pass --resume to continue that run, or remove it")
+    skip = finished_ids(args.output) if args.resume else set()
+    try:
+        settings = ChatSettings.from_dict({"temperature": args.temperature, "max_tokens": args.max_tokens,
+                                           "doc_budget": args.doc_budget, "use_cache": not args.no_cache})
+    except ValueError as e:
+        parser.error(str(e))
+    runner = BatchRunner(create_pipeline(), settings, concurrency=max(1, args.concurrency),
+                         workbook_dir=args.workbooks, base_dir=os.path.dirname(os.path.abspath(args.jobs)))
+
+    def progress(result):
+        done = sum(runner.counts[k] for k in ("ok", "error", "quota"))
+        if result["status"] != "ok":
+            print(f"[{done}] {result['id']}: {result['status']}: {result.get('error', '')[:200]}", file=sys.stderr)
+        elif done % 100 == 0:
+            print(f"[{done}] done", file=sys.stderr)
+
+    with open(args.output, "a+", encoding="utf-8") as out:
+        out.seek(0, os.SEEK_END)
+        if out.tell():
+            out.seek(out.tell() - 1)
+            if out.read(1) != "\n":
+                out.write("\n")  # finish a line cut short when the last run stopped
+        try:
+            report = runner.run(read_jobs(args.jobs), out, skip=skip, on_result=progress)
+        except KeyboardInterrupt:
+            print("Interrupted: finished jobs are saved; run again with --resume", file=sys.stderr)
+            return 130
+    print(format_report(report))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["error"] or report["quota"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""Benchmark the batch runner against the fake Gemini backend
+
+Runs the same generated jobs file (a share of the jobs with a PDF, answers
+holding a table so each one writes a workbook) at several concurrency
+levels and reports throughput and job latency. The fake model answers
+after FAKE_GEMINI_LATENCY seconds, so throughput should grow with
+concurrency until the rate limiter or the CPU is the bottleneck. Run from
+the repository root:
+    python benchmarks/bench_batch.py [jobs] [concurrency ...]
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_BACKEND", "fake")
+os.environ.setdefault("USAGE_LOG_PATH", os.devnull)
+os.environ.setdefault("GEMINI_RPM", "0")
+os.environ.setdefault("FAKE_GEMINI_LATENCY", "0.1")
+
+from batch import BatchRunner, create_pipeline, read_jobs
+from benchmarks.fixtures import make_pdf
+from core import ChatSettings
+
+
+def write_jobs(directory, count, pdf_every=5):
+    with open(os.path.join(directory, "report.pdf"), "wb") as f:
+        f.write(make_pdf(20))
+    path = os.path.join(directory, "jobs.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            job = {"id": f"job-{i}", "prompt": f"Summarize item {i} as a table"}
+            if i % pdf_every == 0:
+                job["pdf"] = "report.pdf"
+            f.write(json.dumps(job) + "\n")
+    return path
+
+
+def run(jobs=60, levels=(1, 4, 16)):
+    directory = tempfile.mkdtemp(prefix="bench-batch-")
+    try:
+        path = write_jobs(directory, jobs)
+        results = []
+        for concurrency in levels:
+            runner = BatchRunner(create_pipeline(), ChatSettings(use_cache=False), concurrency=concurrency,
+                                 workbook_dir=os.path.join(directory, f"wb-{concurrency}"), base_dir=directory)
+            with open(os.path.join(directory, f"out-{concurrency}.jsonl"), "w", encoding="utf-8") as out:
+                report = runner.run(read_jobs(path), out)
+            latency = report["latency_ms"]
+            print(f"concurrency {concurrency:>3}: {report['jobs']} jobs in {report['elapsed_s']:6.2f}s  "
+                  f"{report['jobs_per_s']:7.2f} jobs/s  p50 {latency['p50_ms']:6.0f} ms  "
+                  f"p95 {latency['p95_ms']:6.0f} ms  {report['workbooks']} workbooks")
+            results.append({"concurrency": concurrency, "jobs": report["jobs"], "elapsed_s": report["elapsed_s"],
+                            "jobs_per_s": report["jobs_per_s"], "p50_ms": latency["p50_ms"],
+                            "p95_ms": latency["p95_ms"], "failed": report["error"] + report["quota"]})
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    run(args[0] if args else 60, args[1:] or (1, 4, 16))
@@ -0,0 +1,89 @@
+"""Benchmark a full chat turn in the app against the fake Gemini backend
+
+Runs app.py under AppTest with GEMINI_BACKEND=fake, so no API key or
+network is needed, and times submitting a question with a given history
+already loaded: wall time for the whole script run, and the time to first
+token and total latency the app itself recorded. A last scenario injects
+server errors to check failing turns stay cheap. The fake model's latency
+and stream cadence come from FAKE_GEMINI_* (see fake_model.py). Run from
+the repository root:
+    python benchmarks/bench_chat.py [history lengths ...]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_BACKEND", "fake")
+os.environ.setdefault("CONVERSATION_DB", "off")
+os.environ.setdefault("USAGE_LOG_PATH", os.devnull)
+os.environ.setdefault("GEMINI_RPM", "0")
+os.environ.setdefault("FAKE_GEMINI_LATENCY", "0.05")
+os.environ.setdefault("FAKE_GEMINI_CHUNK_INTERVAL", "0.005")
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from benchmarks.fixtures import make_history
+from core import ChatSession
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def chat_turns(label, history, turns=3, stream=True):
+    """Wall time per question, and the messages the app recorded"""
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.session_state.chat = ChatSession(messages=list(history))
+    at.run()
+    if not stream:
+        next(t for t in at.toggle if t.label == "Stream Responses").set_value(False).run()
+    walls = []
+    for i in range(turns):
+        start = time.perf_counter()
+        at.chat_input[0].set_value(f"Benchmark question {i} ({label})").run()
+        walls.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+    new = at.session_state.chat.messages[len(history):]
+    return walls, new
+
+
+def summarize(label, walls, new):
+    ttft = [m["ttft_ms"] for m in new if m.get("ttft_ms") is not None]
+    latency = [m["latency_ms"] for m in new if m.get("latency_ms") is not None]
+    errors = sum(1 for m in new if "❌ **Error:**" in m["bot"])
+    result = {
+        "scenario": label, "turns": len(walls), "turn_s": round(statistics.mean(walls), 4),
+        "ttft_ms": round(statistics.mean(ttft), 1) if ttft else None,
+        "latency_ms": round(statistics.mean(latency), 1) if latency else None,
+        "error_turns": errors,
+    }
+    first = f"{result['ttft_ms']:7.1f} ms" if ttft else "      n/a"
+    print(f"{label:<22} turn {result['turn_s'] * 1000:8.1f} ms  first token {first}  "
+          f"answer {result['latency_ms'] or 0:7.1f} ms  errors {errors}/{len(walls)}")
+    return result
+
+
+def run(history_lengths, turns=3):
+    results = []
+    for count in history_lengths:
+        history = make_history(count, table_every=3)
+        label = f"history={count}"
+        results.append(summarize(label, *chat_turns(label, history, turns)))
+    results.append(summarize("blocking", *chat_turns("blocking", [], turns, stream=False)))
+
+    os.environ["FAKE_GEMINI_ERROR_RATE"] = "0.5"
+    os.environ["FAKE_GEMINI_ERROR_AFTER"] = "2"
+    st.cache_resource.clear()  # rebuild the shared model with errors switched on
+    try:
+        label = "server errors (50%)"
+        results.append(summarize(label, *chat_turns(label, [], max(turns, 4))))
+    finally:
+        del os.environ["FAKE_GEMINI_ERROR_RATE"], os.environ["FAKE_GEMINI_ERROR_AFTER"]
+        st.cache_resource.clear()
+    return results
+
+
+if __name__ == "__main__":
+    run([int(a) for a in sys.argv[1:]] or [0, 20, 100])
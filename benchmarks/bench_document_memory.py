@@ -0,0 +1,81 @@
+"""Benchmark the memory a session keeps for an attached PDF
+
+Loads a generated PDF two ways and reports the Python heap (tracemalloc)
+still held once it is indexed: the text kept in memory alongside chunks
+that carry their own text (how documents used to be held), and a
+workspace document whose text lives in its memory-mapped file and is read
+back a few pages at a time. Also times picking excerpts cold (pages
+extracted on demand) and warm (pages in the handle's cache). Run from the
+repository root:
+    python benchmarks/bench_document_memory.py [pages ...]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import make_pdf
+from core import load_document
+from pdf_extract import extract_pdf
+from retrieval import build_index, select_chunks
+from workspace import Workspace
+
+QUESTION = "capex guidance and margin outlook by region"
+
+
+def retained(build):
+    """(object, bytes still allocated after build(), peak bytes while building)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return kept, current - before, peak - before
+
+
+def in_memory(data):
+    result = extract_pdf(BytesIO(data))
+    return result.text, build_index(result.text, result.page_offsets)
+
+
+def mapped(data):
+    workspace = Workspace()
+    workspace.add(load_document(BytesIO(data), "bench.pdf"))
+    return workspace
+
+
+def run(page_counts):
+    mapped(make_pdf(4)).clear()  # imports and first-use caches are not part of either
+    results = []
+    for pages in page_counts:
+        data = make_pdf(pages)
+        _, eager_bytes, eager_peak = retained(lambda: in_memory(data))
+        workspace, lazy_bytes, lazy_peak = retained(lambda: mapped(data))
+        start = time.perf_counter()
+        select_chunks(workspace.index, QUESTION, 8000)
+        cold_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        select_chunks(workspace.index, QUESTION, 8000)
+        warm_ms = (time.perf_counter() - start) * 1000
+        stats = workspace.stats()
+        workspace.clear()
+        results.append({
+            "pages": pages, "chars": stats["chars"],
+            "in_memory_retained_bytes": eager_bytes, "mapped_retained_bytes": lazy_bytes,
+            "in_memory_peak_bytes": eager_peak, "mapped_peak_bytes": lazy_peak,
+            "cold_query_ms": round(cold_ms, 2), "warm_query_ms": round(warm_ms, 2),
+        })
+        print(f"{pages:>5} pages  {stats['chars']:>10,} chars  retained: in memory {eager_bytes / 1e6:7.2f} MB  "
+              f"mapped {lazy_bytes / 1e6:7.2f} MB  (peaks {eager_peak / 1e6:.1f} / {lazy_peak / 1e6:.1f} MB)  "
+              f"query cold {cold_ms:6.1f} ms  warm {warm_ms:5.1f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    run([int(a) for a in sys.argv[1:]] or [50, 200, 500])
@@ -0,0 +1,68 @@
+"""Benchmark Excel export: pandas/openpyxl workbook vs write-only export
+
+Reports wall time and peak Python heap (tracemalloc) for each path.
+Run from the repository root:
+    python benchmarks/bench_excel.py [rows ...]
+"""
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from benchmarks.fixtures import make_table_response
+from excel_export import iter_workbook_chunks
+from tables import iter_tables
+
+
+def pandas_export(tables):
+    """The previous create_excel_from_response path"""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        for n, table in enumerate(tables, 1):
+            name = "Data" if len(tables) == 1 else f"Table {n}"
+            df = table.to_dataframe()
+            df.to_excel(writer, sheet_name=name, index=False)
+            worksheet = writer.sheets[name]
+            for idx, col in enumerate(df.columns):
+                max_length = max(df.iloc[:, idx].astype(str).apply(len).max(), len(str(col))) + 2
+                worksheet.column_dimensions[chr(65 + idx)].width = max_length
+    return len(output.getvalue())
+
+
+def streaming_export(tables):
+    return sum(len(chunk) for chunk in iter_workbook_chunks(tables))
+
+
+def measure(fn, tables):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = fn(tables)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def run(row_counts, cols=8):
+    results = []
+    for rows in row_counts:
+        tables = list(iter_tables(make_table_response(rows, cols)))
+        old_s, old_peak, _ = measure(pandas_export, tables)
+        new_s, new_peak, size = measure(streaming_export, tables)
+        results.append({
+            "rows": rows, "cols": cols, "xlsx_bytes": size,
+            "pandas_s": round(old_s, 3), "pandas_peak_mb": round(old_peak / 1e6, 1),
+            "streaming_s": round(new_s, 3), "streaming_peak_mb": round(new_peak / 1e6, 1),
+        })
+        print(f"{rows:>6} rows x {cols}  pandas {old_s:6.2f}s {old_peak / 1e6:7.1f} MB peak  "
+              f"write-only {new_s:6.2f}s {new_peak / 1e6:7.1f} MB peak")
+    return results
+
+
+if __name__ == "__main__":
+    run([int(a) for a in sys.argv[1:]] or [1000, 10000, 50000])
@@ -0,0 +1,63 @@
+"""Benchmark chat export generation against conversation length
+
+Compares serializing the whole conversation to Markdown and JSON on every
+download (the old path) with ChatExporter building Markdown, JSON and
+JSONL, cold and after one new message. Run from the
+repository root:
+    python benchmarks/bench_export.py [message counts ...]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import make_history
+from chat_export import ChatExporter, markdown_fragment
+from core import get_ist_time
+
+
+def full_rebuild(messages, now):
+    """Markdown and JSON built from scratch, as each download used to"""
+    markdown = "# Gemini AI Chat Session\n\n" + "".join(
+        markdown_fragment(n, msg) for n, msg in enumerate(messages, 1))
+    data = json.dumps({"session_start": now.isoformat(), "export_time": now.isoformat(),
+                       "message_count": len(messages), "messages": messages}, indent=2)
+    return len(markdown) + len(data)
+
+
+def exporter_build(exporter, messages, now):
+    exporter.sync(messages)
+    return len(exporter.markdown(now)) + len(exporter.json(now, now)) + len(exporter.jsonl())
+
+
+def timed(fn, *args, repeat=3):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def run(counts):
+    now = get_ist_time()
+    results = []
+    for count in counts:
+        messages = make_history(count, table_every=3)
+        _, full_s = timed(full_rebuild, messages, now)
+        size, cold_s = timed(lambda: exporter_build(ChatExporter("bench"), messages, now))
+        exporter, growing = ChatExporter("bench"), messages[:-1]
+        exporter_build(exporter, growing, now)
+        growing.append(messages[-1])
+        start = time.perf_counter()
+        exporter_build(exporter, growing, now)
+        incremental_s = time.perf_counter() - start
+        results.append({"messages": count, "export_bytes": size, "full_rebuild_s": round(full_s, 4),
+                        "exporter_cold_s": round(cold_s, 4), "exporter_incremental_s": round(incremental_s, 4)})
+        print(f"{count:>5} messages  full rebuild {full_s * 1000:8.1f} ms  exporter cold {cold_s * 1000:8.1f} ms  "
+              f"after one new message {incremental_s * 1000:8.1f} ms  ({size / 1e6:.2f} MB)")
+    return results
+
+
+if __name__ == "__main__":
+    run([int(a) for a in sys.argv[1:]] or [50, 200, 1000])
@@ -0,0 +1,71 @@
+"""Benchmark bytes the app sends to the browser per rerun
+
+Counts the serialized size of every ForwardMsg the script enqueues during
+a run (what Streamlit writes to the websocket, before compression), for
+the empty welcome page and for a chat with history. Pass --inline to
+measure the theme injected inline rather than linked as a static file.
+Run from the repository root:
+    python benchmarks/bench_payload.py [--inline] [messages]
+"""
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-placeholder")
+os.environ.setdefault("CONVERSATION_DB", "off")
+
+from streamlit.runtime.forward_msg_queue import ForwardMsgQueue
+from streamlit.testing.v1 import AppTest
+
+from benchmarks.fixtures import make_history
+from core import ChatSession
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+sent = Counter()
+_enqueue = ForwardMsgQueue.enqueue
+
+
+def counting_enqueue(self, msg):
+    if msg.WhichOneof("type") == "delta":
+        element = msg.delta.new_element
+        kind = element.WhichOneof("type") if msg.delta.WhichOneof("type") == "new_element" else "block"
+        sent[kind] += msg.ByteSize()
+    _enqueue(self, msg)
+
+
+ForwardMsgQueue.enqueue = counting_enqueue
+
+
+def rerun_bytes(messages=None, reruns=3):
+    """Mean delta bytes per rerun, by element type"""
+    at = AppTest.from_file(APP, default_timeout=120)
+    if messages:
+        at.session_state.chat = ChatSession(messages=messages)
+    at.run()
+    sent.clear()
+    for _ in range(reruns):
+        at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return {kind: size // reruns for kind, size in sent.most_common()}
+
+
+def run(count=20):
+    results = {}
+    for label, messages in (("welcome page", None), (f"{count} messages", make_history(count, table_every=3))):
+        by_kind = rerun_bytes(messages)
+        total = sum(by_kind.values())
+        results[label] = {"total_bytes": total, "by_element": by_kind}
+        top = ", ".join(f"{kind} {size:,}" for kind, size in list(by_kind.items())[:4])
+        print(f"{label:<14} {total:>8,} bytes per rerun  ({top})")
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--inline" in args:
+        args.remove("--inline")
+        os.environ["THEME_INLINE"] = "1"
+    run(*[int(a) for a in args[:1]])
@@ -0,0 +1,57 @@
+"""Benchmark PDF extraction: old sequential loop vs pdf_extract engine
+
+Run from the repository root:
+    python benchmarks/bench_pdf_extract.py [pages ...]
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PyPDF2
+
+from benchmarks.fixtures import make_pdf
+from pdf_extract import extract_pdf
+
+
+def extract_sequential(pdf_file):
+    """The original extract_pdf_text loop, minus the Streamlit calls"""
+    reader = PyPDF2.PdfReader(pdf_file)
+    text = ""
+    for page in reader.pages:
+        text += page.extract_text() + "\n"
+    return text.strip(), len(reader.pages)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run(page_counts):
+    # Warm the worker pool so its start-up is not billed to the first size
+    extract_pdf(BytesIO(make_pdf(64)))
+    results = []
+    for pages in page_counts:
+        data = make_pdf(pages)
+        (old_text, _), old_s = timed(extract_sequential, BytesIO(data))
+        new, new_s = timed(extract_pdf, BytesIO(data))
+        assert new.text == old_text, "engine output differs from the sequential loop"
+        results.append({
+            "pages": pages,
+            "mb": round(len(data) / 1e6, 2),
+            "sequential_s": round(old_s, 3),
+            "parallel_s": round(new_s, 3),
+            "speedup": round(old_s / new_s, 2) if new_s else None,
+        })
+        print(f"{pages:>5} pages  {len(data) / 1e6:6.2f} MB  "
+              f"sequential {old_s:7.3f}s  parallel {new_s:7.3f}s  x{old_s / new_s:.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    counts = [int(a) for a in sys.argv[1:]] or [50, 200, 500]
+    run(counts)
@@ -0,0 +1,110 @@
+"""Benchmark per-request payload with system instructions and context caching
+
+Sends the same conversation about a large generated PDF through
+ChatPipeline against the fake model and its context-cache stub, and reports
+what each request carried: prompt text, system instruction and cached
+content, in characters. Compares the formatting instructions inlined in
+every prompt (the old layout), a system instruction, and a system
+instruction plus a cached document. Then walks a cache through its
+lifecycle on a fake clock: create, reuse, TTL extension, expiry and loss
+on the server. Run from the repository root:
+    python benchmarks/bench_prompt_cache.py [turns] [pdf pages]
+"""
+import os
+import statistics
+import sys
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MEMORY_EMBEDDER", "hashing")
+os.environ.setdefault("USAGE_LOG_PATH", os.devnull)
+
+from benchmarks.fixtures import make_pdf
+from context_builder import extractive_summary
+from context_cache import ContextCache
+from core import SYSTEM_INSTRUCTION, ChatPipeline, ChatSettings, load_document
+from fake_model import FakeCacheBackend, FakeModel
+
+SETTINGS = ChatSettings(use_cache=False, max_tokens=1024, context_tokens=32000, doc_budget=32000)
+
+
+def converse(pipeline, pdf, turns):
+    session = pipeline.new_session()
+    session.summary.summarize_fn = extractive_summary  # count only the chat requests
+    session.documents.add(load_document(BytesIO(pdf), "bench.pdf"))
+    for i in range(turns):
+        usage = {}
+        response = pipeline.generate(session, f"Question {i}: what does page {i + 1} say about margin?",
+                                     SETTINGS, usage=usage)
+        pipeline.record_turn(session, f"Question {i}", response, usage)
+    return session
+
+
+def run_scenario(name, pdf, turns, system_instruction=None, context_cache=None):
+    model = FakeModel(system_instruction=system_instruction)
+    pipeline = ChatPipeline(model, system_instruction=system_instruction, context_cache=context_cache)
+    converse(pipeline, pdf, turns)
+    requests = list(model.requests)
+    uploaded = context_cache.backend.uploaded_chars if context_cache else 0
+    per_request = [r["prompt_chars"] + r["system_chars"] for r in requests]
+    result = {
+        "scenario": name, "requests": len(requests),
+        "sent_per_request_chars": round(statistics.mean(per_request)),
+        "prompt_chars": round(statistics.mean(r["prompt_chars"] for r in requests)),
+        "system_chars": round(statistics.mean(r["system_chars"] for r in requests)),
+        "cached_chars_referenced": round(statistics.mean(r["cached_chars"] for r in requests)),
+        "total_sent_chars": sum(per_request) + uploaded,
+        "cache_uploads": len(context_cache.backend.caches) if context_cache else 0,
+    }
+    print(f"{name:<26} per request {result['sent_per_request_chars']:>7,} chars "
+          f"(prompt {result['prompt_chars']:>7,}, system {result['system_chars']:>4,})  "
+          f"total incl. uploads {result['total_sent_chars']:>9,}  uploads {result['cache_uploads']}")
+    return result
+
+
+def lifecycle(pdf):
+    """Create, reuse, extend, expire and lose a cache on a fake clock"""
+    now = [0.0]
+    clock = lambda: now[0]
+    backend = FakeCacheBackend(clock=clock)
+    cache = ContextCache(backend, "fake", SYSTEM_INSTRUCTION, ttl=600, min_tokens=1000, clock=clock)
+    pipeline = ChatPipeline(FakeModel(system_instruction=SYSTEM_INSTRUCTION),
+                            system_instruction=SYSTEM_INSTRUCTION, context_cache=cache)
+    session = pipeline.new_session()
+    session.documents.add(load_document(BytesIO(pdf), "bench.pdf"))
+    steps = []
+
+    def ask(label, at):
+        now[0] = at
+        answer = pipeline.generate(session, f"{label} at {at:.0f}s", SETTINGS)
+        steps.append({"step": label, "t": at, **cache.stats(), "request_failed": answer.startswith("❌")})
+
+    ask("first question", 0)        # uploads the document
+    ask("reuse", 100)               # same handle
+    ask("extend", 400)              # under half the TTL left: extended to t=1000
+    ask("after old expiry", 700)    # still alive thanks to the extension
+    ask("expired", 2000)            # expired locally: uploaded again
+    backend.caches[-1].deleted = True  # lost on the server
+    ask("lost on server", 2100)     # fails with a 404, cache is dropped
+    ask("recovered", 2200)          # uploaded again
+    for s in steps:
+        print(f"  t={s['t']:>5.0f}s  {s['step']:<17} created {s['created']}  reused {s['reused']}  "
+              f"extended {s['extended']}  {'request failed' if s['request_failed'] else ''}")
+    return steps
+
+
+def run(turns=10, pages=80):
+    pdf = make_pdf(pages)
+    print(f"document: {pages} pages, {load_document(BytesIO(pdf)).chars:,} chars")
+    results = [
+        run_scenario("instructions in prompt", pdf, turns),
+        run_scenario("system instruction", pdf, turns, system_instruction=SYSTEM_INSTRUCTION),
+        run_scenario("system + cached document", pdf, turns, system_instruction=SYSTEM_INSTRUCTION,
+                     context_cache=ContextCache(FakeCacheBackend(), "fake", SYSTEM_INSTRUCTION, min_tokens=1000)),
+    ]
+    print("cache lifecycle:")
+    return {"scenarios": results, "lifecycle": lifecycle(pdf)}
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:3]])
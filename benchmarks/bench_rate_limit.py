@@ -0,0 +1,89 @@
+"""Benchmark the shared rate limiter against a quota-enforcing fake model
+
+Concurrent sessions send questions through ChatPipeline while the fake
+server accepts at most SERVER_RPM requests per minute (over a one-second
+window) and rejects the rest with 429. Compares no limiter, retries only,
+and the token-bucket limiter. Run from the repository root:
+    python benchmarks/bench_rate_limit.py [sessions] [requests per session]
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MEMORY_EMBEDDER", "hashing")
+
+from fake_model import FakeModel
+from core import ChatPipeline, ChatSettings
+from rate_limit import QuotaExceeded, RateLimiter
+
+SERVER_RPM = 1200  # 20 requests per second
+LATENCY = 0.05
+
+
+def run_scenario(name, limiter, sessions, per_session):
+    model = FakeModel(latency=LATENCY, chunk_interval=0.005, rpm=SERVER_RPM, window=1.0)
+    pipeline = ChatPipeline(model, limiter=limiter)
+    settings = ChatSettings(use_cache=False, max_tokens=512)
+    latencies, failures, finished = [], [], []
+    lock = threading.Lock()
+
+    def client(n):
+        session = pipeline.new_session()
+        for i in range(per_session):
+            start = time.perf_counter()
+            usage = {}
+            try:
+                if i % 2:
+                    response = "".join(pipeline.stream(session, f"question {i}", settings, usage=usage))
+                else:
+                    response = pipeline.generate(session, f"question {i}", settings, usage=usage)
+            except QuotaExceeded:
+                with lock:
+                    failures.append(n)
+                continue
+            pipeline.record_turn(session, f"question {i}", response, usage)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        assert not any("Quota" in m["bot"] for m in session.messages), "quota error stored as an answer"
+        with lock:
+            finished.append(time.perf_counter() - began)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(sessions)]
+    began = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - began
+
+    ok = len(latencies)
+    quantiles = statistics.quantiles(latencies, n=20) if ok > 1 else [0] * 19
+    result = {
+        "scenario": name, "requests": sessions * per_session, "ok": ok, "failed": len(failures),
+        "server_429s": model.quota_errors, "throughput_rps": round(ok / elapsed, 1),
+        "p50_s": round(quantiles[9], 3), "p95_s": round(quantiles[18], 3),
+        "session_finish_spread_s": round(max(finished) - min(finished), 3),
+    }
+    if limiter is not None:
+        result.update(limiter.stats())
+    print(f"{name:<12} ok {ok:>4}/{result['requests']:<4} failed {len(failures):>4}  "
+          f"server 429s {model.quota_errors:>5}  {result['throughput_rps']:>6} req/s  "
+          f"p50 {result['p50_s']:.3f}s  p95 {result['p95_s']:.3f}s  "
+          f"finish spread {result['session_finish_spread_s']:.2f}s")
+    return result
+
+
+def run(sessions=16, per_session=10):
+    backoff = {"base_delay": 0.05, "max_delay": 1.0, "max_retries": 6}
+    return [
+        run_scenario("no limiter", None, sessions, per_session),
+        run_scenario("retry only", RateLimiter(**backoff), sessions, per_session),
+        run_scenario("limiter", RateLimiter(rpm=SERVER_RPM, burst=2, **backoff), sessions, per_session),
+    ]
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,49 @@
+"""Benchmark rerun wall time against conversation length
+
+Compares the windowed renderer (last RENDER_WINDOW turns in full) with
+rendering every turn. Run from the repository root:
+    python benchmarks/bench_rerun.py [message counts ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-placeholder")
+os.environ.setdefault("CONVERSATION_DB", "off")
+
+from streamlit.testing.v1 import AppTest
+
+from core import ChatSession
+from benchmarks.fixtures import make_history
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def rerun_seconds(messages, render_window=None, reruns=3):
+    at = AppTest.from_file(APP, default_timeout=300)
+    at.session_state.chat = ChatSession(messages=messages)
+    if render_window is not None:
+        at.session_state.render_window = render_window
+    at.run()  # first run fills the per-message caches
+    start = time.perf_counter()
+    for _ in range(reruns):
+        at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return (time.perf_counter() - start) / reruns
+
+
+def run(counts):
+    results = []
+    for count in counts:
+        messages = make_history(count, table_every=3)
+        windowed = rerun_seconds(messages)
+        full = rerun_seconds(messages, render_window=count)
+        results.append({"messages": count, "windowed_s": round(windowed, 4), "full_s": round(full, 4)})
+        print(f"{count:>4} messages  windowed {windowed * 1000:8.1f} ms  full render {full * 1000:8.1f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    run([int(a) for a in sys.argv[1:]] or [20, 50, 100, 200])
@@ -0,0 +1,64 @@
+"""Benchmark rerun time against the number of table messages in history
+
+Each rerun used to build one openpyxl workbook per table message; Excel
+files are now built on download only. Run from the repository root:
+    python benchmarks/bench_rerun_excel.py [message counts ...]
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-placeholder")
+os.environ.setdefault("CONVERSATION_DB", "off")
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+from core import ChatSession
+from benchmarks.fixtures import make_history
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def eager_workbooks(messages):
+    """What the old history loop additionally did on every rerun"""
+    for msg in messages:
+        lines = [line.strip() for line in msg["bot"].split("\n") if "|" in line and "---" not in line]
+        headers = [h.strip() for h in lines[0].split("|")[1:-1]]
+        rows = [[c.strip() for c in line.split("|")[1:-1]] for line in lines[1:]]
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine="openpyxl") as writer:
+            pd.DataFrame(rows, columns=headers).to_excel(writer, sheet_name="Data", index=False)
+
+
+def rerun_seconds(messages, reruns=3):
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.session_state.chat = ChatSession(messages=messages)
+    at.run()  # first run warms caches
+    start = time.perf_counter()
+    for _ in range(reruns):
+        at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return (time.perf_counter() - start) / reruns
+
+
+def run(counts):
+    results = []
+    for count in counts:
+        messages = make_history(count)
+        rerun = rerun_seconds(messages)
+        start = time.perf_counter()
+        eager_workbooks(messages)
+        eager = time.perf_counter() - start
+        results.append({"messages": count, "rerun_s": round(rerun, 4),
+                        "eager_workbooks_s": round(eager, 4)})
+        print(f"{count:>4} table messages  rerun {rerun * 1000:8.1f} ms  "
+              f"(old path would add {eager * 1000:8.1f} ms of workbook builds)")
+    return results
+
+
+if __name__ == "__main__":
+    run([int(a) for a in sys.argv[1:]] or [10, 25, 50, 100])
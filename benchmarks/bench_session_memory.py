@@ -0,0 +1,94 @@
+"""Benchmark per-session memory accounting and idle reclaim
+
+Builds a number of sessions, each with a history and an attached PDF, and
+compares the ledger's estimate (session_memory.py) with the Python heap
+they actually retain (tracemalloc). Then lets every session go idle,
+reclaims them, and reports the heap before and after, the cost of
+track() per request, and how long an idle session takes to re-index its
+documents when it is next used. Run from the repository root:
+    python benchmarks/bench_session_memory.py [sessions] [turns] [pages]
+"""
+import gc
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import make_history, make_pdf
+from core import ChatPipeline, ChatSession, load_document
+from retrieval import select_chunks
+from session_memory import SessionMemory
+
+QUESTION = "capex guidance and margin outlook by region"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def heap():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def run(sessions=10, turns=100, pages=40):
+    pipeline = ChatPipeline(model=object())
+    data = [make_pdf(pages, seed=i) for i in range(sessions)]
+    load_document(BytesIO(make_pdf(4))).close()  # imports and first-use caches are not part of it
+    clock = Clock()
+    ledger = SessionMemory(idle_seconds=60, clock=clock)
+
+    tracemalloc.start()
+    start_bytes = heap()
+    live = []
+    for i in range(sessions):
+        session = ChatSession(messages=make_history(turns))
+        session.documents.add(load_document(BytesIO(data[i]), f"report-{i}.pdf"))
+        select_chunks(session.documents.index, QUESTION, 8000)  # warm the page cache like a real turn
+        live.append(session)
+    held_bytes = heap() - start_bytes
+
+    track_us = []
+    for session in live:
+        begin = time.perf_counter()
+        ledger.track(session, shrink=pipeline.shrink_session)
+        track_us.append((time.perf_counter() - begin) * 1e6)
+    estimated = ledger.stats()
+
+    clock.now += 61
+    ledger.reclaim_idle()
+    reclaimed_bytes = heap() - start_bytes
+    after = ledger.stats()
+    tracemalloc.stop()
+
+    reindex_ms = []
+    for session in live:
+        begin = time.perf_counter()
+        session.documents.ensure_index()
+        select_chunks(session.documents.index, QUESTION, 8000)
+        reindex_ms.append((time.perf_counter() - begin) * 1000)
+    for session in live:
+        session.documents.clear()
+
+    print(f"{sessions} sessions x {turns} turns + {pages}-page PDF: heap {held_bytes / 1e6:6.2f} MB  "
+          f"estimated {estimated['total_bytes'] / 1e6:6.2f} MB  track {statistics.mean(track_us):6.1f} us")
+    print(f"after idle reclaim: heap {reclaimed_bytes / 1e6:6.2f} MB  estimated {after['total_bytes'] / 1e6:6.2f} MB  "
+          f"re-index on return {statistics.mean(reindex_ms):6.1f} ms/session")
+    return {
+        "sessions": sessions, "turns": turns, "pages": pages,
+        "heap_bytes": held_bytes, "estimated_bytes": estimated["total_bytes"],
+        "reclaimed_heap_bytes": reclaimed_bytes, "reclaimed_estimated_bytes": after["total_bytes"],
+        "track_us": round(statistics.mean(track_us), 1), "reindex_ms": round(statistics.mean(reindex_ms), 2),
+    }
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:4]])
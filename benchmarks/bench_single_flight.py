@@ -0,0 +1,76 @@
+"""Benchmark single-flight sharing of identical concurrent requests
+
+A burst of sessions with the same attached PDF ask the same question at
+the same moment, streaming, behind a rate limiter, once with each request
+making its own model call and once with single-flight. Reports upstream
+calls, the coalescing ratio and time to last chunk per session. Run from
+the repository root:
+    python benchmarks/bench_single_flight.py [sessions] [rpm]
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("USAGE_LOG_PATH", os.devnull)
+
+from benchmarks.fixtures import make_pdf
+from core import ChatPipeline, ChatSettings, load_document
+from fake_model import FakeModel
+from rate_limit import RateLimiter
+from single_flight import SingleFlight
+
+QUESTION = "Summarize the key points from this document in bullet points"
+
+
+def burst(sessions, rpm, single_flight):
+    model = FakeModel(latency=0.2, chunk_chars=16, chunk_interval=0.005)
+    pipeline = ChatPipeline(model, limiter=RateLimiter(rpm=rpm, burst=4),
+                            single_flight=SingleFlight() if single_flight else None)
+    pdf = make_pdf(10)
+    chats = []
+    for _ in range(sessions):
+        chat = pipeline.new_session()
+        chat.documents.add(load_document(BytesIO(pdf), "shared.pdf"))
+        chats.append(chat)
+    seconds = [None] * sessions
+    go = threading.Event()
+
+    def ask(i):
+        go.wait()
+        start = time.perf_counter()
+        text = "".join(pipeline.stream(chats[i], QUESTION, ChatSettings()))
+        seconds[i] = time.perf_counter() - start if text == model.reply else None
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    go.set()
+    for thread in threads:
+        thread.join()
+    for chat in chats:
+        chat.documents.clear()
+    answered = [s for s in seconds if s is not None]
+    flights = pipeline.single_flight.stats() if single_flight else {"coalescing_ratio": 0.0}
+    return {"single_flight": single_flight, "sessions": sessions, "answered": len(answered),
+            "upstream_calls": model.calls, "coalescing_ratio": flights["coalescing_ratio"],
+            "p50_ms": round(statistics.median(answered) * 1000, 1),
+            "max_ms": round(max(answered) * 1000, 1)}
+
+
+def run(sessions=12, rpm=120):
+    results = []
+    for single_flight in (False, True):
+        result = burst(sessions, rpm, single_flight)
+        results.append(result)
+        print(f"single-flight {'on ' if single_flight else 'off'}: {result['upstream_calls']:>3} upstream calls "
+              f"for {sessions} sessions (coalesced {result['coalescing_ratio']:.0%})  "
+              f"p50 {result['p50_ms']:7.1f} ms  max {result['max_ms']:7.1f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:3]])
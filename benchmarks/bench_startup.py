@@ -0,0 +1,99 @@
+"""Benchmark cold start and rerun cost of the app
+
+Each measurement runs in a fresh interpreter so import costs are real:
+  - the eager imports the app used to make at the top of the script
+  - building the Gemini client, which used to happen on every rerun
+  - first render and reruns of app.py now, and which heavy modules they load
+Run from the repository root:
+    python benchmarks/bench_startup.py [reruns]
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("google.generativeai", "pandas", "openpyxl", "PyPDF2", "PIL")
+
+EAGER_IMPORTS = """
+import json, sys, time
+start = time.perf_counter()
+import google.generativeai, pandas, PyPDF2, PIL.Image
+print(json.dumps({"seconds": time.perf_counter() - start}))
+"""
+
+CLIENT_PER_RERUN = """
+import json, time, warnings
+warnings.simplefilter("ignore")
+from dotenv import load_dotenv
+import google.generativeai as genai
+runs = 20
+start = time.perf_counter()
+for _ in range(runs):
+    load_dotenv()
+    genai.configure(api_key="benchmark-placeholder")
+    genai.GenerativeModel("gemini-2.0-flash-exp")
+print(json.dumps({"seconds": (time.perf_counter() - start) / runs}))
+"""
+
+APP_RUNS = """
+import json, os, sys, time, warnings
+warnings.simplefilter("ignore")
+sys.path.insert(0, {root!r})
+from streamlit.testing.v1 import AppTest
+
+heavy = {heavy!r}
+at = AppTest.from_file(os.path.join({root!r}, "app.py"), default_timeout=120)
+start = time.perf_counter()
+at.run()
+first = time.perf_counter() - start
+loaded_first = [m for m in heavy if m in sys.modules]
+start = time.perf_counter()
+for _ in range({reruns}):
+    at.run()
+rerun = (time.perf_counter() - start) / {reruns}
+
+import google.generativeai as genai
+from fake_model import FakeModel
+genai.GenerativeModel = lambda *args, **kwargs: FakeModel()
+start = time.perf_counter()
+at.chat_input[0].set_value("hello").run()
+first_question = time.perf_counter() - start
+if at.exception:
+    raise RuntimeError(at.exception[0].value)
+print(json.dumps({{"first_run_s": first, "rerun_s": rerun, "first_question_s": first_question,
+                  "loaded_at_start": loaded_first}}))
+"""
+
+
+def run_python(code):
+    env = dict(os.environ, GOOGLE_API_KEY="benchmark-placeholder", CONVERSATION_DB="off", GEMINI_BACKEND="gemini",
+               USAGE_LOG_PATH=os.devnull)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT, env=env,
+                         check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run(reruns=5):
+    eager = run_python(EAGER_IMPORTS)["seconds"]
+    client = run_python(CLIENT_PER_RERUN)["seconds"]
+    app = run_python(APP_RUNS.format(root=ROOT, heavy=HEAVY, reruns=reruns))
+    result = {
+        "old_eager_imports_s": round(eager, 3),
+        "old_client_per_rerun_ms": round(client * 1000, 3),
+        "first_run_s": round(app["first_run_s"], 3),
+        "rerun_ms": round(app["rerun_s"] * 1000, 1),
+        "first_question_s": round(app["first_question_s"], 3),
+        "heavy_modules_at_start": app["loaded_at_start"],
+    }
+    print(f"old eager imports (genai, pandas, PyPDF2, PIL)  {eager * 1000:8.1f} ms at cold start")
+    print(f"old client construction per rerun             {client * 1000:8.3f} ms")
+    print(f"app first run                                  {app['first_run_s'] * 1000:8.1f} ms")
+    print(f"app rerun                                      {app['rerun_s'] * 1000:8.1f} ms")
+    print(f"first question (builds the Gemini client)      {app['first_question_s'] * 1000:8.1f} ms")
+    print(f"heavy modules loaded by the first run: {', '.join(app['loaded_at_start']) or 'none'}")
+    return result
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,84 @@
+"""Benchmark a multi-document workspace
+
+Extracts a batch of generated PDFs one at a time and all together (their
+page ranges sharing the process pool), then times adding each document to
+the shared index against rebuilding the index from scratch, removing a
+document, and picking excerpts for a question across the corpus. Run from
+the repository root:
+    python benchmarks/bench_workspace.py [documents] [pages per document]
+"""
+import copy
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import make_pdf
+from core import load_document, load_documents
+from retrieval import BM25Index, select_chunks
+from workspace import Workspace
+
+QUESTIONS = ["What is the margin outlook?", "capex guidance by region", "customer churn and retention",
+             "pricing headwind on volume", "cash flow forecast for next quarter"]
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run(count=12, pages=30):
+    pdfs = [make_pdf(pages, seed=i) for i in range(count)]
+    names = [f"report-{i}.pdf" for i in range(count)]
+    load_document(BytesIO(make_pdf(64)))  # warm the worker pool
+
+    _, one_by_one_s = timed(lambda: [load_document(BytesIO(data), name) for data, name in zip(pdfs, names)])
+    documents, together_s = timed(load_documents, [BytesIO(data) for data in pdfs], names)
+    print(f"extract {count} x {pages} pages: one by one {one_by_one_s:6.3f}s  together {together_s:6.3f}s")
+
+    # Chunks drop their text once added; keep copies for the rebuild
+    originals = [[copy.copy(chunk) for chunk in document.chunks] for document in documents]
+    workspace = Workspace()
+    add_ms, rebuild_ms = [], []
+    for i, document in enumerate(documents):
+        _, seconds = timed(workspace.add, document, key=i)
+        add_ms.append(seconds * 1000)
+
+        def rebuild():
+            index = BM25Index()
+            for j in range(i + 1):
+                index.add(originals[j], group=j)
+        _, seconds = timed(rebuild)
+        rebuild_ms.append(seconds * 1000)
+    print(f"add to shared index {statistics.mean(add_ms):7.2f} ms/doc  "
+          f"rebuild all at the last add {rebuild_ms[-1]:7.2f} ms")
+
+    query_ms = []
+    attributed = set()
+    for question in QUESTIONS:
+        chunks, seconds = timed(select_chunks, workspace.index, question, 8000)
+        query_ms.append(seconds * 1000)
+        attributed.update(c.document for c in chunks)
+
+    remove_ms = []
+    for key in range(0, count, 2):
+        _, seconds = timed(workspace.remove, key)
+        remove_ms.append(seconds * 1000)
+    print(f"query {statistics.mean(query_ms):6.2f} ms (excerpts from {len(attributed)} documents)  "
+          f"remove {statistics.mean(remove_ms):6.2f} ms/doc  "
+          f"{len(workspace)} documents, {len(workspace.index)} chunks left")
+    return {
+        "documents": count, "pages": pages,
+        "extract_one_by_one_s": round(one_by_one_s, 3), "extract_together_s": round(together_s, 3),
+        "add_ms": round(statistics.mean(add_ms), 2), "rebuild_ms": round(rebuild_ms[-1], 2),
+        "query_ms": round(statistics.mean(query_ms), 2), "remove_ms": round(statistics.mean(remove_ms), 2),
+        "documents_cited": len(attributed),
+    }
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:3]])
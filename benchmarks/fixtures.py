@@ -0,0 +1,86 @@
+"""Synthetic inputs for the benchmarks"""
+import random
+
+WORDS = ("revenue margin growth quarter forecast ebitda cash flow segment region "
+         "customer retention churn pipeline backlog capex opex guidance outlook "
+         "inventory supply demand pricing volume mix currency headwind tailwind").split()
+
+
+def make_paragraph(rng, words=60):
+    """Random business-flavoured sentence soup"""
+    return " ".join(rng.choice(WORDS) for _ in range(words)) + "."
+
+
+def make_pdf(pages, lines_per_page=40, seed=0):
+    """Build a text-only PDF with the given number of pages, as bytes
+
+    Written by hand so the benchmarks need nothing beyond PyPDF2.
+    """
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for number in range(1, pages + 1):
+        lines = [f"Page {number}"] + [make_paragraph(rng, 12) for _ in range(lines_per_page)]
+        ops = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"({escaped}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def make_table_response(rows=20, cols=4, seed=0, tables=1):
+    """A Gemini-style answer with markdown tables"""
+    rng = random.Random(seed)
+    parts = ["Here is the breakdown you asked for:\n"]
+    for t in range(tables):
+        header = "| " + " | ".join(f"Column {c + 1}" for c in range(cols)) + " |"
+        divider = "|" + "|".join("------" for _ in range(cols)) + "|"
+        body = [
+            "| " + " | ".join(f"{rng.choice(WORDS)} {rng.randint(1, 9999)}" for _ in range(cols)) + " |"
+            for _ in range(rows)
+        ]
+        parts.append("\n".join([header, divider] + body))
+        parts.append(f"\nTable {t + 1} totals are shown above.\n")
+    return "\n".join(parts)
+
+
+def make_history(turns, table_every=1, rows=20, cols=4):
+    """session_state.messages with `turns` entries, every nth holding a table"""
+    messages = []
+    for i in range(turns):
+        bot = make_table_response(rows, cols, seed=i) if table_every and i % table_every == 0 \
+            else make_paragraph(random.Random(i), 80)
+        messages.append({
+            "user": f"Question {i}: {make_paragraph(random.Random(-i), 12)}",
+            "bot": bot,
+            "has_image": False,
+            "has_pdf": False,
+            "timestamp": "2026-01-01T10:00:00+05:30",
+        })
+    return messages
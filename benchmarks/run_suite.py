@@ -0,0 +1,145 @@
+"""Run the offline benchmark suite and write the results to JSON
+
+Everything runs without an API key or network: chat turns go to the fake
+Gemini backend (fake_model.py), PDFs and tables are generated. Results are
+written with the git commit and platform so runs can be compared, and
+--compare flags timings and payload sizes that got worse than a previous
+run by more than --threshold (exit status 1). Run from the repository root:
+    python benchmarks/run_suite.py [--quick] [--only chat,rerun] [--output FILE]
+                                   [--compare OLD.json] [--threshold 0.25] [--min-delta-ms 5]
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("GEMINI_BACKEND", "fake")
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-placeholder")
+os.environ.setdefault("CONVERSATION_DB", "off")
+os.environ.setdefault("USAGE_LOG_PATH", os.devnull)
+
+# name: (module, arguments for run() in quick mode, in full mode)
+BENCHMARKS = {
+    "chat": ("bench_chat", ([0, 20],), ([0, 20, 100],)),
+    "rerun": ("bench_rerun", ([20, 100],), ([20, 50, 100, 200],)),
+    "rerun_excel": ("bench_rerun_excel", ([10, 50],), ([10, 25, 50, 100],)),
+    "pdf_extract": ("bench_pdf_extract", ([50, 200],), ([50, 200, 500],)),
+    "workspace": ("bench_workspace", (6, 20), (12, 30)),
+    "document_memory": ("bench_document_memory", ([50, 200],), ([50, 200, 500],)),
+    "session_memory": ("bench_session_memory", (6, 50, 20), (10, 100, 40)),
+    "batch": ("bench_batch", (40, [1, 8]), (120, [1, 4, 16])),
+    "excel": ("bench_excel", ([1000, 5000],), ([1000, 10000, 50000],)),
+    "export": ("bench_export", ([50, 1000],), ([50, 200, 1000],)),
+    "prompt_cache": ("bench_prompt_cache", (5, 40), (10, 80)),
+    "single_flight": ("bench_single_flight", (8, 120), (16, 120)),
+    "rate_limit": ("bench_rate_limit", (8, 5), (16, 10)),
+    "startup": ("bench_startup", (3,), (5,)),
+    "payload": ("bench_payload", (20,), (20,)),  # last: it wraps Streamlit's message queue
+}
+LOWER_IS_BETTER = ("_s", "_ms", "_bytes")
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(names, quick=False):
+    results = {}
+    for name in names:
+        module, quick_args, full_args = BENCHMARKS[name]
+        print(f"\n== {name}")
+        bench = importlib.import_module(f"benchmarks.{module}")
+        start = time.perf_counter()
+        data = bench.run(*(quick_args if quick else full_args))
+        results[name] = {"elapsed_s": round(time.perf_counter() - start, 2), "data": data}
+    return results
+
+
+def flatten(value, prefix=""):
+    """(path, number) pairs; list rows are labelled by their first field"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        for item in value:
+            key, label = next(iter(item.items()))
+            yield from flatten(item, f"{prefix}[{key}={label}]")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(old, new, threshold, min_delta_ms=5.0):
+    """Metrics that got worse by more than threshold (a fraction)
+
+    Timings that moved by less than min_delta_ms are ignored as noise.
+    """
+    before = dict(flatten(old["results"]))
+    regressions = []
+    for path, value in flatten(new["results"]):
+        if not path.endswith(LOWER_IS_BETTER) or path.endswith("elapsed_s") or not before.get(path):
+            continue
+        delta_ms = (value - before[path]) * (1000 if path.endswith("_s") else 1)
+        if not path.endswith("_bytes") and delta_ms < min_delta_ms:
+            continue
+        change = value / before[path] - 1
+        if change > threshold:
+            regressions.append((path, before[path], value, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a fast check")
+    parser.add_argument("--only", help="comma-separated subset of: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--output", help="JSON file (default benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="ignore timing changes below this")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    commit = git_commit()
+    report = {
+        "created": datetime.now().astimezone().isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "quick": args.quick,
+        "results": run_suite(names, quick=args.quick),
+    }
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold, args.min_delta_ms)
+        for path, old, new, change in regressions:
+            print(f"REGRESSION {path}: {old} -> {new} (+{change:.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
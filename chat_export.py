@@ -0,0 +1,132 @@
+"""Incremental chat exports (Markdown, JSON, JSONL)"""
+import itertools
+import json
+import textwrap
+
+
+def markdown_fragment(number, msg):
+    """One message in the Markdown export"""
+    fragment = f"## Message {number}\n\n**👤 User:**\n{msg['user']}\n\n"
+    fragment += f"**✨ Assistant:**\n{msg['bot']}\n\n"
+    if msg.get('has_image'):
+        fragment += "*[Image was attached]*\n\n"
+    if msg.get('has_pdf'):
+        fragment += "*[PDF document was attached]*\n\n"
+    return fragment + "---\n\n"
+
+
+def json_fragment(msg):
+    """One message in the JSON export's messages list"""
+    return textwrap.indent(json.dumps(msg, indent=2), "    ")
+
+
+def jsonl_line(session_id, index, msg):
+    """One message in the JSONL export"""
+    return json.dumps({"session_id": session_id, "index": index, **msg}, ensure_ascii=False) + "\n"
+
+
+class ChatExporter:
+    """Serialized export fragments for the loaded page, appended as messages arrive
+
+    Each loaded message is serialized once per format when it is first seen
+    by sync(); building a download only joins the stored fragments and a
+    small header. Messages before the loaded page stay in the store: the
+    iter_* methods take older(start, stop), which yields stored messages
+    [start, stop), and serialize them as the export is written. Output
+    matches the previous json.dumps(indent=2) and Markdown layouts byte for
+    byte.
+    """
+
+    def __init__(self, session_id=""):
+        self.session_id = session_id
+        self.first = 0  # message number of the first stored fragment
+        self._markdown = []
+        self._json = []
+        self._jsonl = []
+
+    def __len__(self):
+        """Messages in the export, including those before the loaded page"""
+        return self.first + len(self._json)
+
+    @property
+    def nbytes(self):
+        """Approximate size of the stored fragments"""
+        return sum(len(f) for part in (self._markdown, self._json, self._jsonl) for f in part)
+
+    def sync(self, messages, first=0):
+        """Serialize loaded messages not yet seen
+
+        messages are the loaded ones, messages[0] being message number
+        first. Fragments of messages that left memory are dropped, an older
+        page that was loaded is serialized in front, and the exporter
+        restarts if the history got shorter (e.g. after a clear).
+        """
+        end = first + len(messages)
+        if end < len(self) or first >= len(self) and first != self.first:
+            self._reset(first)
+        if first > self.first:
+            drop = first - self.first
+            del self._markdown[:drop], self._json[:drop], self._jsonl[:drop]
+            self.first = first
+        if first < self.first:
+            older = [self._fragments(first + i, msg) for i, msg in enumerate(messages[:self.first - first])]
+            for part, fragments in zip((self._markdown, self._json, self._jsonl), zip(*older)):
+                part[:0] = fragments
+            self.first = first
+        for msg in messages[len(self) - first:]:
+            markdown, fragment, line = self._fragments(len(self), msg)
+            self._markdown.append(markdown)
+            self._json.append(fragment)
+            self._jsonl.append(line)
+
+    def _reset(self, first):
+        self.first = first
+        self._markdown, self._json, self._jsonl = [], [], []
+
+    def _fragments(self, index, msg):
+        return markdown_fragment(index + 1, msg), json_fragment(msg), jsonl_line(self.session_id, index, msg)
+
+    def _older(self, older):
+        """Stored messages before the loaded page, as (index, msg)"""
+        if not self.first:
+            return
+        if older is None:
+            raise ValueError("older messages are needed to export a partly loaded history")
+        yield from enumerate(older(0, self.first))
+
+    def iter_markdown(self, export_time, older=None):
+        yield "# Gemini AI Chat Session\n\n"
+        yield f"**Date:** {export_time.strftime('%Y-%m-%d %H:%M:%S')} IST\n"
+        yield f"**Messages:** {len(self)}\n\n---\n\n"
+        for i, msg in self._older(older):
+            yield markdown_fragment(i + 1, msg)
+        yield from self._markdown
+
+    def iter_json(self, session_start, export_time, older=None):
+        yield "{\n"
+        yield f'  "session_start": {json.dumps(session_start.isoformat())},\n'
+        yield f'  "export_time": {json.dumps(export_time.isoformat())},\n'
+        yield f'  "message_count": {len(self)},\n'
+        if not len(self):
+            yield '  "messages": []\n}'
+            return
+        yield '  "messages": [\n'
+        fragments = itertools.chain((json_fragment(msg) for _, msg in self._older(older)), self._json)
+        for i, fragment in enumerate(fragments):
+            yield fragment
+            yield ",\n" if i < len(self) - 1 else "\n"
+        yield "  ]\n}"
+
+    def iter_jsonl(self, older=None):
+        for i, msg in self._older(older):
+            yield jsonl_line(self.session_id, i, msg)
+        yield from self._jsonl
+
+    def markdown(self, export_time, older=None):
+        return "".join(self.iter_markdown(export_time, older)).encode("utf-8")
+
+    def json(self, session_start, export_time, older=None):
+        return "".join(self.iter_json(session_start, export_time, older)).encode("utf-8")
+
+    def jsonl(self, older=None):
+        return "".join(self.iter_jsonl(older)).encode("utf-8")
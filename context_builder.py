@@ -0,0 +1,278 @@
+"""Token-budgeted prompt assembly with a rolling conversation summary"""
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from retrieval import select_chunks, format_excerpts
+
+FORMATTING_INSTRUCTIONS = """
+IMPORTANT FORMATTING INSTRUCTIONS:
+When providing responses with numerical data, tables, calculations, or Excel-related content:
+1. ALWAYS use proper markdown tables with | separators and alignment
+2. Format all calculations clearly showing: Formula → Calculation → Result
+3. For Excel formulas, present them in code blocks or clearly formatted
+4. Make tables directly copyable to Excel with proper column alignment
+5. Use clear headers and organize data in rows and columns
+6. Show step-by-step calculations for math problems
+7. Present financial/numerical data in professional table format
+8. Include units and proper number formatting
+
+Example table format:
+| Item | Formula | Calculation | Result |
+|------|---------|-------------|--------|
+| Sales Growth 5% | Base × 1.05 | 628 × 1.05 | 659.40 |
+"""
+
+# gemini-2.0-flash input window; the configured budget is normally far below it
+MODEL_CONTEXT_TOKENS = 1_048_576
+CHARS_PER_TOKEN = 4
+
+# Shares of the flexible budget (after instructions and question)
+SUMMARY_SHARE = 0.15
+RECALL_SHARE = 0.10
+DOCUMENT_SHARE = 0.50
+
+# Shared by every session. One session never has more than one fold in
+# flight (see RollingSummary._future), so its turns still fold in order
+# while other sessions' summaries run alongside it.
+SUMMARY_WORKERS = 4
+_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="summary")
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English)"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def clip_to_tokens(text, tokens):
+    """Trim text to roughly `tokens` tokens, marking the cut"""
+    max_chars = max(0, tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return text
+    return text[:max(0, max_chars - 3)] + "..."
+
+
+def format_turn(msg, max_bot_chars=200):
+    """One history turn as prompt text"""
+    bot = msg["bot"]
+    if len(bot) > max_bot_chars:
+        return f"\nUser: {msg['user']}\nAssistant: {bot[:max_bot_chars]}...\n"
+    return f"\nUser: {msg['user']}\nAssistant: {bot}\n"
+
+
+@dataclass
+class BuiltContext:
+    """The assembled prompt and what each section cost"""
+    prompt: str
+    sections: dict = field(default_factory=dict)  # section -> estimated tokens
+    recent_turns: int = 0
+    document_chars: int = 0
+
+    @property
+    def total_tokens(self):
+        return sum(self.sections.values())
+
+
+def input_budget(context_tokens, max_output_tokens):
+    """Tokens available for the prompt once the answer is reserved"""
+    return max(512, min(context_tokens, MODEL_CONTEXT_TOKENS - max_output_tokens))
+
+
+def build_context(question, history, budget_tokens, summary=None, memory=None,
+                  documents=None, doc_cap_chars=8000,
+                  instructions=FORMATTING_INSTRUCTIONS, max_recent_turns=10, instructions_in_prompt=True):
+    """Assemble a prompt whose estimated size stays within budget_tokens
+
+    Instructions and the question are always included; with
+    instructions_in_prompt=False the instructions are left out of the text
+    (the model carries them as its system instruction) but still count
+    against the budget, since every request is billed for them. The rest of the
+    budget is handed out in order: rolling summary, recalled older turns,
+    document excerpts (capped at doc_cap_chars), then as many recent turns as
+    fit, newest first. Unused shares flow on to the recent turns.
+
+    documents is a workspace.Workspace: sent whole when it fits the
+    document share, otherwise as the best-matching chunks across all of it.
+    """
+    sections = {
+        "instructions": estimate_tokens(instructions),
+        "question": estimate_tokens(question),
+    }
+    remaining = max(0, budget_tokens - sections["instructions"] - sections["question"])
+    flexible = remaining
+    if summary is not None:
+        summary.poll()
+    covered = summary.covered if summary is not None else 0
+
+    summary_text = ""
+    if summary is not None and summary.text:
+        summary_text = clip_to_tokens(summary.text, int(flexible * SUMMARY_SHARE))
+    sections["summary"] = estimate_tokens(summary_text)
+    remaining -= sections["summary"]
+
+    # Reserve the document share first so turns cannot starve it
+    doc_text = ""
+    if documents is not None and documents.total_chars:
+        doc_tokens = min(doc_cap_chars // CHARS_PER_TOKEN, int(flexible * DOCUMENT_SHARE))
+        doc_chars = doc_tokens * CHARS_PER_TOKEN
+        full = documents.full_text() if documents.total_chars <= doc_chars else ""
+        if full and len(full) <= doc_chars:
+            doc_text = f"\n\n{full}"
+        else:
+            several = len(documents) > 1
+            excerpts = format_excerpts(select_chunks(documents.index, question, doc_chars), with_documents=several)
+            note = (f"Excerpts from {len(documents)} documents ({documents.total_chars} characters). "
+                    f"Cite sources as [file name, Page N]." if several else
+                    f"Excerpts from a {documents.total_chars}-character document. Cite pages as [Page N].")
+            doc_text = (f"\n\n=== Document Excerpts (most relevant to the question) ===\n{excerpts}"
+                        f"\n\n[Note: {note}]")
+    sections["document"] = estimate_tokens(doc_text)
+    remaining -= sections["document"]
+
+    # Recent turns, newest first, never reaching back into summarised turns
+    recall_reserve = int(flexible * RECALL_SHARE) if memory is not None else 0
+    turn_budget = max(0, remaining - recall_reserve)
+    recent = []
+    used = 0
+    for msg in reversed(history[max(covered, len(history) - max_recent_turns):]):
+        text = format_turn(msg)
+        cost = estimate_tokens(text)
+        if used + cost > turn_budget:
+            break
+        recent.append(text)
+        used += cost
+    recent.reverse()
+    first_recent = len(history) - len(recent)
+    sections["history"] = used
+    remaining -= used
+
+    recall_text = ""
+    if memory is not None and first_recent > 0:
+        recall_budget = min(remaining, recall_reserve)
+        parts = []
+        for idx in sorted(memory.search(question, k=3, before=first_recent)):
+            text = format_turn(history[idx], max_bot_chars=500)
+            if estimate_tokens("".join(parts) + text) > recall_budget:
+                break
+            parts.append(text)
+        if parts:
+            recall_text = "=== Relevant Earlier Conversation ===\n" + "".join(parts) + "\n"
+    sections["recall"] = estimate_tokens(recall_text)
+
+    context = ""
+    if summary_text:
+        context += f"=== Conversation Summary ===\n{summary_text}\n\n"
+    context += recall_text
+    if recent:
+        context += "=== Previous Conversation ===\n" + "".join(recent)
+    context += doc_text
+
+    head = f"{instructions}\n\n" if instructions_in_prompt else ""
+    if context:
+        prompt = f"{head}{context}\n\n=== Current Question ===\nUser: {question}\nAssistant:"
+    else:
+        prompt = f"{head}User: {question}\nAssistant:"
+    return BuiltContext(prompt, sections, len(recent), len(doc_text))
+
+
+def extractive_summary(previous, turns, max_chars=2000):
+    """Offline fallback: one line per turn, oldest lines dropped past max_chars"""
+    lines = previous.splitlines() if previous else []
+    for msg in turns:
+        answer = msg["bot"].strip().split("\n", 1)[0]
+        lines.append(f"- User asked: {msg['user'][:150]} → {answer[:200]}")
+    while lines and sum(len(line) + 1 for line in lines) > max_chars:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class RollingSummary:
+    """Running summary of turns that have left the recent window
+
+    Turns [0, covered) are folded into `text`. New turns are folded in
+    batches on a background thread by summarize_fn(previous_summary, turns),
+    which returns the new summary, or (summary, usage record) when it made a
+    model call; the result is picked up on a later call, so no request waits
+    for it. Usage records wait in take_usage() for the caller to account.
+    """
+
+    def __init__(self, summarize_fn=None, batch_turns=2):
+        self.summarize_fn = summarize_fn or extractive_summary
+        self.batch_turns = batch_turns
+        self.text = ""
+        self.covered = 0
+        self._future = None
+        self._generation = 0
+        self._usage = []
+        self._lock = threading.Lock()
+
+    def poll(self):
+        """Adopt a finished background summary, if any"""
+        with self._lock:
+            future = self._future
+            if future is None or not future.done():
+                return
+            self._future = None
+            generation, target, text, _ = future.result()
+            if generation == self._generation:
+                self.text = text
+                self.covered = target
+
+    def update(self, history, keep_recent=5):
+        """Schedule folding of turns that fell out of the last keep_recent"""
+        self.poll()
+        with self._lock:
+            if self._future is not None:
+                return
+            target = len(history) - keep_recent
+            if target - self.covered < self.batch_turns:
+                return
+            turns = list(history[self.covered:target])
+            future = self._future = _executor.submit(self._fold, self._generation, target, self.text, turns)
+        future.add_done_callback(self._collect_usage)
+
+    def _collect_usage(self, future):
+        """Keep a finished call's usage, even if a clear or shift discarded its summary"""
+        usage = future.result()[3]
+        if usage is not None:
+            with self._lock:
+                self._usage.append(usage)
+
+    def wait(self, timeout=None):
+        """Block until the pending summary lands (for scripts and benchmarks)"""
+        future = self._future
+        if future is not None:
+            future.result(timeout)
+        self.poll()
+
+    def take_usage(self):
+        """Usage records of finished summary calls since the last take"""
+        with self._lock:
+            usage, self._usage = self._usage, []
+        return usage
+
+    def shift(self, n):
+        """Account for n older turns inserted in front of the history (negative: dropped)"""
+        with self._lock:
+            self.covered += n
+            if self._future is not None:
+                self._generation += 1
+                self._future = None
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._future = None
+            self.text = ""
+            self.covered = 0
+
+    def _fold(self, generation, target, previous, turns):
+        usage = None
+        try:
+            text = self.summarize_fn(previous, turns)
+            if isinstance(text, tuple):
+                text, usage = text
+        except Exception:
+            text = extractive_summary(previous, turns)
+        return generation, target, text, usage
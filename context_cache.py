@@ -0,0 +1,174 @@
+"""Server-side context caches for large documents
+
+A document big enough to be worth caching is uploaded once, together with
+the system instruction, as a Gemini cached-content resource. Turns about
+that document then go to a model bound to the cache and carry only the
+conversation and the question. Handles are shared by every session in the
+process, their TTL is extended while they are in use, and a document whose
+cache could not be created is sent inline (as before) for a while before
+caching is tried again.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+
+from context_builder import CHARS_PER_TOKEN, estimate_tokens
+
+# Gemini rejects smaller cached contents
+MIN_CACHE_TOKENS = 32768
+DEFAULT_TTL_SECONDS = 3600
+# Extend a handle's TTL once less than this much of it is left
+REFRESH_MARGIN = 0.5
+# After a failed create, send the document inline this long before retrying
+RETRY_AFTER_SECONDS = 900
+
+
+def cached_document_text(text):
+    """The document as it is stored in the cache (same framing as inline)"""
+    return f"=== Document Content ===\n{text}"
+
+
+class GeminiCacheBackend:
+    """google.generativeai cached contents (imported on first use)"""
+
+    def create(self, model_name, system_instruction, text, ttl_seconds):
+        from google.generativeai import caching
+
+        return caching.CachedContent.create(model=f"models/{model_name}", system_instruction=system_instruction,
+                                            contents=[text], ttl=timedelta(seconds=ttl_seconds))
+
+    def model(self, handle, base_model):
+        import google.generativeai as genai
+
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+    def extend(self, handle, ttl_seconds):
+        handle.update(ttl=timedelta(seconds=ttl_seconds))
+
+    def delete(self, handle):
+        handle.delete()
+
+
+@dataclass
+class _Entry:
+    handle: object
+    model: object
+    expires_at: float
+    tokens: int
+
+
+class ContextCache:
+    """Cached-content handles for large documents, keyed by content
+
+    backend implements create(model_name, system_instruction, text, ttl),
+    model(handle, base_model), extend(handle, ttl) and delete(handle);
+    see GeminiCacheBackend and fake_model.FakeCacheBackend.
+    """
+
+    def __init__(self, backend, model_name, system_instruction=None, ttl=DEFAULT_TTL_SECONDS,
+                 min_tokens=MIN_CACHE_TOKENS, max_entries=16, retry_after=RETRY_AFTER_SECONDS, clock=time.time):
+        self.backend = backend
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.max_entries = max_entries
+        self.retry_after = retry_after
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._failed = {}  # digest -> time after which creating is tried again
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+        self._counts = {"created": 0, "reused": 0, "extended": 0, "failed": 0, "evicted": 0}
+
+    def eligible(self, chars):
+        return chars > 0 and chars / CHARS_PER_TOKEN >= self.min_tokens
+
+    def model_for(self, key, chars, load_text, base_model=None):
+        """A model bound to a cache holding a document, or None to send it inline
+
+        key identifies the content (e.g. its digest) and chars is its
+        length; load_text() is only called when the cache is created.
+        """
+        if not self.eligible(chars):
+            return None
+        entry = self._fresh(key)
+        if entry is not None:
+            return entry.model
+        with self._create_lock:  # one upload per document, however many sessions ask
+            entry = self._fresh(key)
+            if entry is not None:
+                return entry.model
+            with self._lock:
+                if self._failed.get(key, 0) > self.clock():
+                    return None
+            try:
+                stored = cached_document_text(load_text())
+                handle = self.backend.create(self.model_name, self.system_instruction, stored, self.ttl)
+                model = self.backend.model(handle, base_model)
+            except Exception:
+                with self._lock:
+                    self._counts["failed"] += 1
+                    self._failed[key] = self.clock() + self.retry_after
+                return None
+            with self._lock:
+                self._counts["created"] += 1
+                self._failed.pop(key, None)
+                self._entries[key] = _Entry(handle, model, self.clock() + self.ttl, estimate_tokens(stored))
+                evicted = []
+                while len(self._entries) > self.max_entries:
+                    evicted.append(self._entries.popitem(last=False)[1])
+                    self._counts["evicted"] += 1
+        for old in evicted:
+            self._delete(old)
+        return model
+
+    def _fresh(self, key):
+        """The live entry for key, its TTL extended if it is running low"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            now = self.clock()
+            if entry.expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self._counts["reused"] += 1
+            refresh = entry.expires_at - now < self.ttl * REFRESH_MARGIN
+        if refresh:
+            try:
+                self.backend.extend(entry.handle, self.ttl)
+            except Exception:
+                return entry  # still valid for now; it is recreated once it expires
+            with self._lock:
+                entry.expires_at = self.clock() + self.ttl
+                self._counts["extended"] += 1
+        return entry
+
+    def invalidate(self, key):
+        """Forget the cache for key (e.g. the server no longer has it)"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._delete(entry)
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._delete(entry)
+
+    def _delete(self, entry):
+        try:
+            self.backend.delete(entry.handle)
+        except Exception:
+            pass  # it expires on its own
+
+    def stats(self):
+        with self._lock:
+            return {**self._counts, "entries": len(self._entries),
+                    "cached_tokens": sum(e.tokens for e in self._entries.values())}
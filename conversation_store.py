@@ -0,0 +1,235 @@
+"""SQLite-backed conversation persistence with batched writes"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from token_usage import add_to_totals
+
+logger = logging.getLogger("geminiflow.store")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    title TEXT,
+    token_totals TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (session_id, idx)
+) WITHOUT ROWID;
+"""
+
+INSERT_MESSAGE = "INSERT OR REPLACE INTO messages (session_id, idx, payload) VALUES (?, ?, ?)"
+UPSERT_SESSION = (
+    "INSERT INTO sessions (id, created_at, updated_at, message_count, title, token_totals) "
+    "VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at, "
+    "message_count = MAX(sessions.message_count, excluded.message_count), "
+    "token_totals = excluded.token_totals"
+)
+
+
+def message_usage(msg):
+    """Usage records billed with a stored message: its own call and any summary calls"""
+    return ([msg["tokens"]] if msg.get("tokens") else []) + msg.get("summary_tokens", [])
+
+
+class ConversationStore:
+    """Conversation history in SQLite (WAL), written in the background
+
+    append() only queues the row; a writer thread commits queued rows in
+    one transaction every `flush_interval` seconds (or `batch_size` rows)
+    with the same parameterised statements, so sqlite reuses the prepared
+    statements. Reads use one connection per thread, which WAL lets run
+    alongside the writer. Each session row keeps running token totals,
+    updated in the same transaction as its messages, so resuming a session
+    does not have to read its whole history.
+    """
+
+    def __init__(self, path, batch_size=64, flush_interval=0.05):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._pending_cond = threading.Condition()
+
+        db = self._connect()
+        db.executescript(SCHEMA)
+        columns = {row[1] for row in db.execute("PRAGMA table_info(sessions)")}
+        if "token_totals" not in columns:
+            # Databases from before running totals; filled in on a session's next write
+            db.execute("ALTER TABLE sessions ADD COLUMN token_totals TEXT")
+        db.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-store", daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def append(self, session_id, idx, msg):
+        """Queue one message for writing; returns immediately"""
+        with self._pending_cond:
+            self._pending += 1
+        self._queue.put((session_id, idx, json.dumps(msg, ensure_ascii=False),
+                         msg.get("user", "")[:80], time.time(), message_usage(msg)))
+
+    def flush(self, timeout=5.0):
+        """Wait until every queued message is committed"""
+        with self._pending_cond:
+            self._pending_cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(db, batch)
+            except sqlite3.Error:
+                time.sleep(0.1)
+                try:
+                    self._write(db, batch)
+                except sqlite3.Error:
+                    logger.exception("Dropped %d messages after a failed write", len(batch))
+            finally:
+                with self._pending_cond:
+                    self._pending -= len(batch)
+                    self._pending_cond.notify_all()
+
+    def _write(self, db, batch):
+        sessions = {}
+        for session_id, idx, _, title, at, _ in batch:
+            created = sessions.get(session_id)
+            count = max(idx + 1, created[2] if created else 0)
+            sessions[session_id] = (at, created[1] if created else title, count)
+        with db:
+            # Totals are read and written back in one transaction, which another process can't interleave
+            db.execute("BEGIN IMMEDIATE")
+            totals = {sid: self._totals(db, sid) for sid in sessions}
+            for session_id, _, _, _, _, records in batch:
+                for record in records:
+                    add_to_totals(totals[session_id], record)
+            db.executemany(INSERT_MESSAGE, [(sid, idx, payload) for sid, idx, payload, _, _, _ in batch])
+            db.executemany(UPSERT_SESSION, [(sid, at, at, count, title, json.dumps(totals[sid]))
+                                            for sid, (at, title, count) in sessions.items()])
+
+    def _totals(self, db, session_id):
+        """Running token totals of a session; rebuilt from its messages if never recorded"""
+        row = db.execute("SELECT token_totals FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row and row[0]:
+            return json.loads(row[0])
+        totals = {}
+        for (payload,) in db.execute("SELECT payload FROM messages WHERE session_id = ? ORDER BY idx",
+                                     (session_id,)):
+            for record in message_usage(json.loads(payload)):
+                add_to_totals(totals, record)
+        return totals
+
+    def token_totals(self, session_id):
+        """Token totals over every stored message of a session"""
+        self.flush()
+        return self._totals(self._connect(), session_id)
+
+    def create_session(self, session_id):
+        """Register an empty session so every process can find it"""
+        now = time.time()
+        db = self._connect()
+        with db:
+            db.execute("INSERT OR IGNORE INTO sessions (id, created_at, updated_at) VALUES (?, ?, ?)",
+                       (session_id, now, now))
+
+    def message_count(self, session_id):
+        self.flush()
+        row = self._connect().execute(
+            "SELECT COALESCE(MAX(idx) + 1, 0) FROM messages WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0]
+
+    def load_page(self, session_id, before=None, limit=50):
+        """Up to `limit` messages ending just before index `before`
+
+        Returns (messages, first_index). With before=None the most recent
+        page is returned.
+        """
+        self.flush()
+        if before is None:
+            before = self.message_count(session_id)
+        rows = self._connect().execute(
+            "SELECT idx, payload FROM messages WHERE session_id = ? AND idx < ? "
+            "ORDER BY idx DESC LIMIT ?", (session_id, before, limit)
+        ).fetchall()
+        rows.reverse()
+        first = rows[0][0] if rows else before
+        return [json.loads(payload) for _, payload in rows], first
+
+    def iter_messages(self, session_id, batch=500, start=0, stop=None):
+        """Stored messages of a session from index start up to stop, oldest first"""
+        self.flush()
+        while True:
+            limit = batch if stop is None else min(batch, stop - start)
+            if limit <= 0:
+                return
+            rows = self._connect().execute(
+                "SELECT idx, payload FROM messages WHERE session_id = ? AND idx >= ? "
+                "ORDER BY idx LIMIT ?", (session_id, start, limit)
+            ).fetchall()
+            if not rows:
+                return
+            for _, payload in rows:
+                yield json.loads(payload)
+            start = rows[-1][0] + 1
+
+    def list_sessions(self, limit=20):
+        """Most recently updated sessions as dicts"""
+        self.flush()
+        rows = self._connect().execute(
+            "SELECT id, created_at, updated_at, message_count, title FROM sessions "
+            "ORDER BY updated_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        keys = ("id", "created_at", "updated_at", "message_count", "title")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def has_session(self, session_id):
+        self.flush()
+        return self._connect().execute(
+            "SELECT 1 FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone() is not None
+
+    def delete_session(self, session_id):
+        """Forget a session and all its messages"""
+        self.flush()
+        db = self._connect()
+        with db:
+            db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
@@ -0,0 +1,809 @@
+"""UI-free chat pipeline shared by the Streamlit app and the HTTP API
+
+Nothing here touches Streamlit: settings are passed in explicitly, and
+progress, warnings and errors are returned or raised for the caller to
+present.
+"""
+import contextlib
+import itertools
+import os
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, fields, replace
+from datetime import datetime, timezone, timedelta
+
+from context_builder import (FORMATTING_INSTRUCTIONS, RollingSummary, build_context, estimate_tokens, input_budget,
+                             extractive_summary)
+from context_cache import ContextCache, GeminiCacheBackend
+from conversation_store import ConversationStore
+from memory import ConversationMemory, get_embedder
+from pdf_extract import PdfHandle, extract_many
+from rate_limit import QuotaExceeded, RateLimiter, is_quota_error
+from response_cache import ResponseCache, make_cache_key, digest_image
+from retrieval import chunk_text
+from session_memory import SessionMemory
+from single_flight import SingleFlight
+from tables import iter_tables
+from token_usage import estimate_image_tokens, request_budget, usage_record, add_to_totals, log_usage
+from tracing import span
+from workspace import Workspace
+
+MODEL_NAME = "gemini-2.0-flash-exp"
+MAX_IMAGE_SIZE = 4096
+# Messages per page of history kept in memory; older pages load on demand
+HISTORY_PAGE_SIZE = 50
+# Background summaries only use spare rate-limit capacity: with fewer than this
+# many requests left in the bucket they summarize extractively instead of queueing
+SUMMARY_HEADROOM_REQUESTS = 2
+SUMMARY_MAX_OUTPUT_TOKENS = 400
+# Rough heap cost of one stored message beyond its text (dict, timestamps, token counts)
+MESSAGE_OVERHEAD_BYTES = 1500
+# Turns a session over its memory cap keeps in memory; older ones reload from the store
+SPILL_KEEP_MESSAGES = 20
+# Sent once as the model's system instruction rather than in every prompt
+SYSTEM_INSTRUCTION = FORMATTING_INSTRUCTIONS.strip()
+WORD_RE = re.compile(r"\S+")
+
+# Indian Standard Time (IST) timezone
+IST = timezone(timedelta(hours=5, minutes=30))
+
+
+def get_ist_time():
+    """Get current time in Indian Standard Time"""
+    return datetime.now(IST)
+
+
+# Accepted (min, max) per numeric setting, matching the app's sliders (None = no upper limit)
+SETTINGS_RANGES = {"temperature": (0.0, 1.0), "max_tokens": (256, 8192), "context_tokens": (2000, 32000),
+                   "doc_budget": (2000, 32000), "session_token_budget": (0, None)}
+
+
+@dataclass
+class ChatSettings:
+    """Per-request model and context settings"""
+    temperature: float = 0.7
+    max_tokens: int = 2048
+    context_tokens: int = 8000
+    doc_budget: int = 8000
+    session_token_budget: int = 0
+    use_cache: bool = True
+
+    def generation_config(self):
+        return {"temperature": self.temperature, "max_output_tokens": self.max_tokens}
+
+    @classmethod
+    def from_dict(cls, data, base=None):
+        """Settings from a JSON object of overrides on base (default: the defaults)
+
+        Raises ValueError for unknown names, wrong types and values outside
+        SETTINGS_RANGES.
+        """
+        base = base or cls()
+        if data is None:
+            return base
+        if not isinstance(data, dict):
+            raise ValueError('"settings" must be an object')
+        kinds = {f.name: f.type for f in fields(cls)}
+        unknown = set(data) - set(kinds)
+        if unknown:
+            raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+        values = {}
+        for name, value in data.items():
+            kind = kinds[name]
+            if isinstance(value, bool) != (kind is bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"Invalid value for {name}: {value!r}")
+            low, high = SETTINGS_RANGES.get(name, (None, None))
+            if (low is not None and value < low) or (high is not None and value > high):
+                bounds = f"between {low} and {high}" if high is not None else f"at least {low}"
+                raise ValueError(f"{name} must be {bounds}")
+            values[name] = kind(value)
+        return replace(base, **values)
+
+
+@dataclass
+class Document:
+    """An attached PDF: its chunks for retrieval and a handle to its pages
+
+    The text is not held in memory: once the document is indexed its
+    chunks read their text back from the memory-mapped file (see
+    pdf_extract.PdfHandle), a few pages at a time.
+    """
+    name: str
+    pages: int
+    chars: int
+    word_count: int
+    chunks: list = field(default_factory=list)
+    errors: list = field(default_factory=list)  # (page, message) for unreadable pages
+    digest: str = None
+    handle: object = None
+
+    def release_text(self):
+        """Drop the chunks' text; they read it from the handle from now on"""
+        for chunk in self.chunks:
+            chunk.text, chunk.source = None, self.handle
+
+    def read_text(self):
+        """The whole text, rebuilt from the pages (as extracted when indexed)"""
+        return self.handle.text_range(0, self.chars)
+
+    def close(self):
+        self.handle.close()
+
+
+def _document(name, result, handle):
+    if not result.text:
+        handle.close()
+        return None
+    handle.layout(result)
+    words = sum(1 for _ in WORD_RE.finditer(result.text))  # a count, without a list of every word
+    return Document(name, result.pages, len(result.text), words,
+                    chunk_text(result.text, result.page_offsets, document=name), result.errors,
+                    handle.digest, handle)
+
+
+def open_pdf(pdf_file):
+    """PdfHandle for an upload (spilled to a temp file) or a path (mapped in place)"""
+    if isinstance(pdf_file, (str, os.PathLike)):
+        return PdfHandle(os.fspath(pdf_file))
+    return PdfHandle.spill(pdf_file)
+
+
+def load_document(pdf_file, name="document.pdf", progress=None):
+    """Extract and chunk a PDF; returns None if it holds no text
+
+    progress(done, total) is called as pages are extracted.
+    """
+    document = load_documents([pdf_file], [name], progress)[0]
+    if isinstance(document, Exception):
+        raise document
+    return document
+
+
+def load_documents(pdf_files, names, progress=None):
+    """Extract and chunk several PDFs concurrently
+
+    Returns one entry per file: a Document, None if it holds no text, or
+    the exception that stopped it. progress(done, total) counts pages
+    across all files. The full text exists only while a document is
+    chunked; afterwards the Document reads pages from its file.
+    """
+    named = {"document": names[0]} if len(names) == 1 else {}
+    with span("pdf.extract", documents=len(pdf_files), **named) as timing:
+        handles = []
+        for pdf_file in pdf_files:
+            try:
+                handles.append(open_pdf(pdf_file))
+            except Exception as e:
+                handles.append(e)
+        opened = [h for h in handles if not isinstance(h, Exception)]
+        extracted = iter(extract_many(opened, progress=progress))
+        results = [h if isinstance(h, Exception) else next(extracted) for h in handles]
+        documents = []
+        for name, handle, result in zip(names, handles, results):
+            if isinstance(result, Exception):
+                if not isinstance(handle, Exception):
+                    handle.close()
+                documents.append(result)
+            else:
+                documents.append(_document(name, result, handle))
+        ok = [r for r in results if not isinstance(r, Exception)]
+        timing.set(pages=sum(r.pages for r in ok), chars=sum(len(r.text) for r in ok),
+                   page_errors=sum(len(r.errors) for r in ok), failed=len(results) - len(ok))
+        return documents
+
+
+def process_image(image_file, max_size=MAX_IMAGE_SIZE):
+    """Open an uploaded image, shrinking it to fit max_size
+
+    Returns (image, original_size); original_size is None when the image
+    was not resized.
+    """
+    with span("image.process") as timing:
+        from PIL import Image
+
+        img = Image.open(image_file)
+        timing.set(width=img.width, height=img.height)
+        if img.width > max_size or img.height > max_size:
+            original = (img.width, img.height)
+            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            timing.set(resized_to=f"{img.width}x{img.height}")
+            return img, original
+        return img, None
+
+
+def extract_tables(text):
+    """Every markdown table with at least one data row, in order"""
+    return [table for table in iter_tables(text) if table.rows]
+
+
+def extract_table_from_text(text):
+    """Extract the first markdown table and convert to DataFrame"""
+    tables = extract_tables(text)
+    if not tables:
+        return None
+    return tables[0].to_dataframe()
+
+
+def create_excel_from_response(response_text, path=None):
+    """Excel bytes with one sheet per table, or None if there are no tables
+
+    With a path, the workbook is written straight to that file and the
+    path is returned instead of the bytes.
+    """
+    with span("excel.build") as timing:
+        from excel_export import save_workbook, workbook_bytes
+
+        tables = extract_tables(response_text)
+        timing.set(tables=len(tables), rows=sum(len(t.rows) for t in tables))
+        if not tables:
+            return None
+        if path is not None:
+            save_workbook(tables, path)
+            timing.set(bytes=os.path.getsize(path))
+            return path
+        data = workbook_bytes(tables)
+        timing.set(bytes=len(data))
+        return data
+
+
+def format_gemini_error(e):
+    """Map a Gemini exception to a user-facing message"""
+    error = str(e)
+    if is_quota_error(e):
+        retry_after = getattr(e, "retry_after", None)
+        wait = (f"Please try again in about {max(1, round(retry_after))}s." if retry_after
+                else "Please wait and try again.")
+        return f"⚠️ **API Quota Exceeded**\n\n{wait}"
+    elif "safety" in error.lower():
+        return "⚠️ **Content Filtered**\n\nTry rephrasing your question."
+    elif "invalid_argument" in error.lower():
+        return "⚠️ **Invalid Request**\n\nCheck file size/format."
+    else:
+        return f"❌ **Error:** {error}"
+
+
+def iter_timed(chunks, timings):
+    """Pass chunks through, recording ttft_ms and latency_ms in timings"""
+    start = time.perf_counter()
+    timings["ttft_ms"] = None
+    for chunk in chunks:
+        if timings["ttft_ms"] is None:
+            timings["ttft_ms"] = (time.perf_counter() - start) * 1000
+        yield chunk
+    timings["latency_ms"] = (time.perf_counter() - start) * 1000
+    if timings["ttft_ms"] is None:
+        timings["ttft_ms"] = timings["latency_ms"]
+
+
+def uses_fake_backend():
+    """Whether GEMINI_BACKEND=fake selects the offline stand-in model"""
+    return os.getenv("GEMINI_BACKEND", "gemini").lower() == "fake"
+
+
+def create_model(api_key, model_name=MODEL_NAME, system_instruction=SYSTEM_INSTRUCTION):
+    """Gemini client, or fake_model.FakeModel when GEMINI_BACKEND=fake
+
+    google.generativeai is imported here rather than at the top, so it is
+    only loaded once a model is needed.
+    """
+    if uses_fake_backend():
+        from fake_model import FakeModel
+        return FakeModel.from_env(system_instruction=system_instruction)
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+
+def open_conversation_store():
+    """Conversation store from CONVERSATION_DB (off/none disables it)"""
+    path = os.getenv("CONVERSATION_DB", os.path.join(".data", "conversations.sqlite3"))
+    if path.lower() in ("", "off", "none"):
+        return None
+    return ConversationStore(path)
+
+
+def open_rate_limiter():
+    """Limiter from GEMINI_RPM / GEMINI_TPM (0 disables a limit)
+
+    Defaults match the free tier; raise them for paid keys. Limits apply per
+    process, so split them across API workers.
+    """
+    return RateLimiter(rpm=int(os.getenv("GEMINI_RPM", "10")),
+                       tpm=int(os.getenv("GEMINI_TPM", "1000000")),
+                       max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "4")))
+
+
+def open_response_cache():
+    """Response cache, kept on disk when RESPONSE_CACHE_DB is set"""
+    return ResponseCache(db_path=os.getenv("RESPONSE_CACHE_DB"))
+
+
+def open_context_cache():
+    """Server-side cache for large documents (CONTEXT_CACHE=off disables it)
+
+    CONTEXT_CACHE_MIN_TOKENS sets the smallest document worth caching and
+    CONTEXT_CACHE_TTL the handle lifetime in seconds.
+    """
+    if os.getenv("CONTEXT_CACHE", "on").lower() in ("off", "0", "false", "no"):
+        return None
+    if uses_fake_backend():
+        from fake_model import FakeCacheBackend
+        backend = FakeCacheBackend()
+    else:
+        backend = GeminiCacheBackend()
+    return ContextCache(backend, MODEL_NAME, SYSTEM_INSTRUCTION,
+                        ttl=int(os.getenv("CONTEXT_CACHE_TTL", "3600")),
+                        min_tokens=int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "32768")))
+
+
+def open_single_flight():
+    """Shared table of in-flight model calls (SINGLE_FLIGHT=off disables it)"""
+    if os.getenv("SINGLE_FLIGHT", "on").lower() in ("off", "0", "false", "no"):
+        return None
+    return SingleFlight()
+
+
+def open_session_memory():
+    """Session memory ledger from SESSION_MEMORY_CAP_MB, SESSION_MEMORY_TOTAL_MB
+    and SESSION_IDLE_MINUTES (0 disables a cap)"""
+    return SessionMemory(session_cap=int(os.getenv("SESSION_MEMORY_CAP_MB", "128")) * 1024 * 1024,
+                         total_cap=int(os.getenv("SESSION_MEMORY_TOTAL_MB", "2048")) * 1024 * 1024,
+                         idle_seconds=int(os.getenv("SESSION_IDLE_MINUTES", "30")) * 60)
+
+
+class ChatSession:
+    """One conversation and the per-conversation state the pipeline keeps
+
+    messages holds the loaded page of history; history_offset is the
+    absolute index of messages[0] when older messages are still in the
+    store.
+    """
+
+    def __init__(self, session_id=None, messages=None, history_offset=0, summarize_fn=None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.messages = messages if messages is not None else []
+        self.history_offset = history_offset
+        self.memory = ConversationMemory(get_embedder())
+        self.memory.sync(self.messages)
+        self.summary = RollingSummary(summarize_fn)
+        self.documents = Workspace()
+        self.token_totals = {}
+        self.started_at = get_ist_time()
+        self.lock = threading.Lock()  # one turn at a time
+
+    @property
+    def message_count(self):
+        return self.history_offset + len(self.messages)
+
+    def prepend(self, older, first):
+        """Insert an older page of messages loaded from the store"""
+        self.messages = older + self.messages
+        self.history_offset = first
+        self.memory.clear()
+        self.memory.sync(self.messages)
+        self.summary.shift(len(older))
+
+    def clear(self):
+        """Drop the conversation but keep the attached documents"""
+        self.messages = []
+        self.history_offset = 0
+        self.memory.clear()
+        self.summary.clear()
+
+    def memory_usage(self):
+        """Approximate heap bytes held by this session, by part"""
+        return {
+            "messages": sum(len(m["user"]) + len(m["bot"]) + MESSAGE_OVERHEAD_BYTES for m in self.messages),
+            "recall": self.memory.nbytes,
+            "summary": len(self.summary.text),
+            "documents": self.documents.memory_bytes(),
+        }
+
+    def spill_history(self, keep=SPILL_KEEP_MESSAGES):
+        """Drop older turns that the summary already covers from memory
+
+        They stay in the conversation store and load again on request (see
+        ChatPipeline.load_older). Returns how many messages were dropped.
+        """
+        drop = min(len(self.messages) - keep, self.summary.covered)
+        if drop <= 0:
+            return 0
+        self.messages = self.messages[drop:]
+        self.history_offset += drop
+        self.memory.drop_first(drop)
+        self.summary.shift(-drop)
+        return drop
+
+
+class ChatPipeline:
+    """Answers questions for sessions against one model
+
+    Shared by every session in a process. `model` only needs
+    generate_content(contents, generation_config=..., stream=...); pass
+    model_factory instead to build it on first use. With a
+    limiter, every model call waits its turn in the limiter's queue and
+    quota errors are retried there; once retries run out generate() and
+    stream() raise QuotaExceeded instead of returning an answer, so callers
+    never record the error as a turn.
+
+    system_instruction is the instruction the model was created with (see
+    create_model); when set, prompts leave the formatting instructions out.
+    With a context_cache, a session's large document is cached server-side
+    and its turns go to a model bound to that cache (only while it is the
+    session's one document). With a single_flight, identical requests made
+    at the same time by different sessions share one model call.
+    """
+
+    def __init__(self, model=None, response_cache=None, store=None, model_name=MODEL_NAME, limiter=None,
+                 model_factory=None, system_instruction=None, context_cache=None, single_flight=None):
+        if model is None and model_factory is None:
+            raise ValueError("ChatPipeline needs a model or a model_factory")
+        self._model = model
+        self._model_factory = model_factory
+        self._model_lock = threading.Lock()
+        self.response_cache = response_cache
+        self.store = store
+        self.model_name = model_name
+        self.limiter = limiter
+        self.system_instruction = system_instruction
+        self.context_cache = context_cache
+        self.single_flight = single_flight
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._model_factory()
+        return self._model
+
+    def _call(self, fn, tokens=0, on_wait=None, timeout=None):
+        """fn() through the limiter; returns (result, permit or None)"""
+        if self.limiter is not None:
+            return self.limiter.call(fn, tokens, on_wait, timeout)
+        try:
+            return fn(), None
+        except Exception as e:
+            if is_quota_error(e):
+                raise QuotaExceeded(str(e)) from e
+            raise
+
+    @staticmethod
+    def _settle(permit, usage, prompt_tokens, text):
+        """Replace a permit's token reservation with what the call used"""
+        if permit is None:
+            return
+        metadata = usage.get("usage_metadata")
+        actual = getattr(metadata, "total_token_count", None) if metadata is not None else None
+        permit.settle(actual or prompt_tokens + estimate_tokens(text))
+
+    def new_session(self, session_id=None):
+        """A fresh session, or the latest page of a stored one
+
+        A stored session keeps the token totals recorded with it, so
+        reloading it does not reset its token budget.
+        """
+        if session_id and self.store is not None and self.store.has_session(session_id):
+            messages, first = self.store.load_page(session_id, limit=HISTORY_PAGE_SIZE)
+            session = ChatSession(session_id, messages, first, summarize_fn=self.summarize_turns)
+            session.token_totals = self.store.token_totals(session_id)
+            return session
+        return ChatSession(session_id, summarize_fn=self.summarize_turns)
+
+    def load_older(self, session, limit=HISTORY_PAGE_SIZE):
+        """Prepend the page before session.history_offset; returns its size"""
+        if self.store is None or session.history_offset == 0:
+            return 0
+        older, first = self.store.load_page(session.session_id, before=session.history_offset, limit=limit)
+        session.prepend(older, first)
+        return len(older)
+
+    def shrink_session(self, session, idle=False):
+        """Free what a session can rebuild; returns the approximate bytes freed
+
+        Caches are always dropped and, with a store, turns already in the
+        summary leave memory. An idle session also has its document index
+        freed, to be rebuilt from the files when it is next used. A session
+        in the middle of a turn is skipped.
+        """
+        if not session.lock.acquire(blocking=False):
+            return 0
+        try:
+            before = sum(session.memory_usage().values())
+            session.documents.drop_caches()
+            if self.store is not None:
+                session.spill_history()
+            if idle:
+                session.documents.hibernate()
+            return before - sum(session.memory_usage().values())
+        finally:
+            session.lock.release()
+
+    def clear_session(self, session):
+        if self.store is not None:
+            self.store.delete_session(session.session_id)
+        session.clear()
+
+    def summarize_turns(self, previous_summary, turns):
+        """Fold older turns into the running conversation summary
+
+        Runs on a background thread and never queues behind user requests:
+        without spare rate-limit capacity, or if the model call fails, it
+        falls back to an extractive summary. Returns (summary, usage record)
+        after a model call.
+        """
+        transcript = "".join(f"\nUser: {m['user']}\nAssistant: {m['bot'][:1500]}\n" for m in turns)
+        prompt = ("Update the running summary of a conversation with the new turns below. "
+                  "Keep names, numbers, decisions and open questions. Reply with the summary only, "
+                  "at most 200 words.\n\n"
+                  f"=== Current Summary ===\n{previous_summary or '(empty)'}\n\n"
+                  f"=== New Turns ===\n{transcript}")
+        config = {"temperature": 0.2, "max_output_tokens": SUMMARY_MAX_OUTPUT_TOKENS}
+        prompt_tokens = estimate_tokens(prompt)
+        permit = None
+        if self.limiter is not None:
+            permit = self.limiter.try_acquire(prompt_tokens + SUMMARY_MAX_OUTPUT_TOKENS,
+                                              headroom=SUMMARY_HEADROOM_REQUESTS)
+            if permit is None:
+                return extractive_summary(previous_summary, turns)
+        try:
+            response = self.model.generate_content(prompt, generation_config=config)
+            text = response.text.strip()
+        except Exception as e:
+            if permit is not None:
+                permit.settle(0)
+                if is_quota_error(e):
+                    self.limiter.backoff(0)
+            return extractive_summary(previous_summary, turns)
+        usage_metadata = getattr(response, "usage_metadata", None)
+        record = usage_record({"summary": prompt_tokens}, output_text=text, usage_metadata=usage_metadata)
+        if permit is not None:
+            permit.settle(record["total_tokens"])
+        return text, record
+
+    def _document_model(self, session):
+        """Model bound to a cached copy of the session's document, or None"""
+        document = session.documents.only
+        if self.context_cache is None or document is None:
+            return None
+        return self.context_cache.model_for(document.digest, document.chars, document.read_text,
+                                            base_model=self.model)
+
+    def _drop_document_cache(self, session, document_model, error):
+        """Forget a document's cache once the server no longer has it"""
+        gone = getattr(error, "code", None) == 404 or "cachedcontent" in str(error).lower().replace(" ", "")
+        document = session.documents.only
+        if gone and document_model is not None and document is not None:
+            self.context_cache.invalidate(document.digest)
+
+    def build_prompt(self, session, question, settings, usage=None, document_cached=False):
+        """Build the full prompt sent to Gemini
+
+        Sections are sized by context_builder against settings.context_tokens
+        after reserving max_tokens for the answer. Near the session token
+        budget the context shrinks instead of the request failing.
+        Per-section token estimates are written to `usage` when given.
+        document_cached leaves the session's documents out: the model it is
+        sent to already holds them in a context cache.
+        """
+        with span("prompt.build", session=session.session_id, history=len(session.messages)) as timing:
+            if session.documents.hibernated and not document_cached:
+                lost = session.documents.ensure_index()
+                timing.set(reindexed=True, lost_documents=len(lost))
+            budget = input_budget(settings.context_tokens, settings.max_tokens)
+            budget, degraded = request_budget(budget, settings.max_tokens, settings.session_token_budget,
+                                              session.token_totals.get("total_tokens", 0))
+            built = build_context(question, session.messages, budget, summary=session.summary,
+                                  memory=session.memory,
+                                  documents=None if document_cached else session.documents,
+                                  doc_cap_chars=settings.doc_budget,
+                                  instructions_in_prompt=not self.system_instruction)
+            timing.set(prompt_tokens=sum(built.sections.values()), degraded=degraded)
+        if usage is not None:
+            usage["sections"] = built.sections
+            usage["degraded"] = degraded
+        return built.prompt
+
+    def _cache_key(self, prompt, settings, image, session):
+        if not settings.use_cache or self.response_cache is None:
+            return None
+        config = settings.generation_config()
+        return make_cache_key(prompt, config["temperature"], config["max_output_tokens"],
+                              image_digest=digest_image(image),
+                              pdf_digest=session.documents.digest)
+
+    def _flight_key(self, kind, prompt, settings, image, session, document_model):
+        """Key shared by identical requests for single-flight, or None to go alone
+
+        Like the response cache key, with whitespace runs in the prompt
+        collapsed. Requests that opt out of the response cache also opt out
+        of sharing an answer.
+        """
+        if not settings.use_cache or self.single_flight is None:
+            return None
+        config = settings.generation_config()
+        key = make_cache_key(" ".join(prompt.split()), config["temperature"], config["max_output_tokens"],
+                             image_digest=digest_image(image), pdf_digest=session.documents.digest)
+        return (kind, self.model_name, document_model is not None, key)
+
+    def generate(self, session, question, settings, image=None, usage=None, on_wait=None):
+        """Generate a complete response
+
+        Errors other than quota come back as the user-facing text from
+        format_gemini_error(), with the raw error in usage["error"]. Pass a
+        dict as `usage` to receive section token estimates and the API's
+        usage_metadata (usage["coalesced"] is set when the answer came from
+        an identical request already in flight). on_wait(position,
+        eta_seconds) reports progress while queued behind the rate limit.
+        """
+        usage = {} if usage is None else usage
+        document_model = None
+        try:
+            document_model = self._document_model(session)
+            model = document_model or self.model
+            prompt = self.build_prompt(session, question, settings, usage, document_cached=document_model is not None)
+            cache_key = self._cache_key(prompt, settings, image, session)
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    usage["cached"] = True
+                    return cached
+            contents = [prompt, image] if image else prompt
+            prompt_tokens = sum(usage["sections"].values()) + estimate_image_tokens(image)
+
+            def call():
+                response, permit = self._call(
+                    lambda: model.generate_content(contents, generation_config=settings.generation_config()),
+                    prompt_tokens + settings.max_tokens, on_wait)
+                self._settle(permit, {"usage_metadata": getattr(response, "usage_metadata", None)},
+                             prompt_tokens, response.text)
+                if cache_key:
+                    self.response_cache.put(cache_key, response.text)
+                return response
+
+            with span("model.generate", session=session.session_id, prompt_tokens=prompt_tokens,
+                      document_cached=document_model is not None) as timing:
+                flight_key = self._flight_key("generate", prompt, settings, image, session, document_model)
+                if flight_key:
+                    flight = {}
+                    response = self.single_flight.call(flight_key, call, flight)
+                    usage["coalesced"] = not flight["leader"]
+                    timing.set(coalesced=usage["coalesced"])
+                else:
+                    response = call()
+            usage["usage_metadata"] = getattr(response, "usage_metadata", None)
+            return response.text
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            if is_quota_error(e):
+                raise QuotaExceeded(str(e)) from e
+            self._drop_document_cache(session, document_model, e)
+            usage["error"] = str(e)
+            return format_gemini_error(e)
+
+    def stream(self, session, question, settings, image=None, usage=None, on_wait=None):
+        """Yield response chunks as they arrive
+
+        A failure after some text has already streamed is appended below the
+        partial answer. Quota errors are retried until the first chunk
+        arrives; after that, or once retries run out, QuotaExceeded is
+        raised. `usage` and on_wait work as in generate().
+        """
+        usage = {} if usage is None else usage
+        streamed = False
+        document_model = None
+        try:
+            document_model = self._document_model(session)
+            model = document_model or self.model
+            prompt = self.build_prompt(session, question, settings, usage, document_cached=document_model is not None)
+            cache_key = self._cache_key(prompt, settings, image, session)
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    usage["cached"] = True
+                    yield cached
+                    return
+            contents = [prompt, image] if image else prompt
+            prompt_tokens = sum(usage["sections"].values()) + estimate_image_tokens(image)
+
+            def open_stream():
+                # Quota errors often surface on the first chunk, so it is
+                # fetched inside the retried call
+                response = model.generate_content(contents, generation_config=settings.generation_config(),
+                                                  stream=True)
+                chunks = iter(response)
+                return response, chunks, next(chunks, None)
+
+            def start():
+                """Open the stream; returns (text chunks, response)"""
+                # Not made current: it ends when the upstream stream does, not the consumer
+                timing = span("model.stream", activate=False, session=session.session_id,
+                              prompt_tokens=prompt_tokens, document_cached=document_model is not None)
+                try:
+                    (response, chunks, first), permit = self._call(open_stream, prompt_tokens + settings.max_tokens,
+                                                                   on_wait)
+                except BaseException as e:
+                    timing.end(error=None if isinstance(e, GeneratorExit) else e)
+                    raise
+                timing.set(first_chunk_ms=round((time.perf_counter() - timing.started) * 1000, 1))
+
+                def texts():
+                    parts = []
+                    try:
+                        for chunk in itertools.chain([first] if first is not None else [], chunks):
+                            text = chunk.text
+                            if text:
+                                parts.append(text)
+                                yield text
+                        timing.set(chunks=len(parts))
+                    except BaseException as e:
+                        timing.end(error=None if isinstance(e, GeneratorExit) else e)
+                        raise
+                    timing.end()
+                    self._settle(permit, {"usage_metadata": getattr(response, "usage_metadata", None)},
+                                 prompt_tokens, "".join(parts))
+                    if cache_key and parts:
+                        self.response_cache.put(cache_key, "".join(parts))
+
+                return texts(), response
+
+            flight_key = self._flight_key("stream", prompt, settings, image, session, document_model)
+            flight = {}
+            if flight_key:
+                chunks = self.single_flight.stream(flight_key, start, flight)
+            else:
+                chunks, flight["value"] = start()
+            with contextlib.closing(chunks):
+                for text in chunks:
+                    streamed = True
+                    yield text
+            response = flight["value"]
+            usage["coalesced"] = not flight.get("leader", True)
+            usage["usage_metadata"] = getattr(response, "usage_metadata", None)
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            if is_quota_error(e):
+                raise QuotaExceeded(str(e)) from e
+            self._drop_document_cache(session, document_model, e)
+            error = format_gemini_error(e)
+            yield f"\n\n{error}" if streamed else error
+
+    def record_turn(self, session, question, response, usage, image=None, has_image=None,
+                    ttft_ms=None, latency_ms=None):
+        """Account for a finished turn and append it to the session
+
+        Updates token totals, memory, the rolling summary and the store, and
+        writes the usage log line. Background summary calls finished since
+        the last turn are accounted here too, stored with the message as
+        summary_tokens. Returns the stored message.
+        """
+        tokens = usage_record(usage.get("sections", {}), image=image, output_text=response,
+                              usage_metadata=usage.get("usage_metadata"), cached=usage.get("cached", False),
+                              coalesced=usage.get("coalesced", False))
+        add_to_totals(session.token_totals, tokens)
+        log_usage(tokens, session_id=session.session_id, model=self.model_name,
+                  degraded=usage.get("degraded", False), ttft_ms=ttft_ms, latency_ms=latency_ms)
+        summary_tokens = session.summary.take_usage()
+        for record in summary_tokens:
+            add_to_totals(session.token_totals, record)
+            log_usage(record, session_id=session.session_id, model=self.model_name, kind="summary")
+        msg = {
+            "user": question, "bot": response,
+            "has_image": image is not None if has_image is None else has_image,
+            "has_pdf": len(session.documents) > 0,
+            "timestamp": get_ist_time().isoformat(),
+            "ttft_ms": ttft_ms, "latency_ms": latency_ms, "tokens": tokens,
+            "degraded": usage.get("degraded", False)
+        }
+        if summary_tokens:
+            msg["summary_tokens"] = summary_tokens
+        session.messages.append(msg)
+        session.memory.sync(session.messages)  # also retries turns a failed embed left out
+        if self.store is not None:
+            self.store.append(session.session_id, session.message_count - 1, msg)
+        session.summary.update(session.messages)
+        return msg
@@ -0,0 +1,245 @@
+"""Offline stand-in for genai.GenerativeModel
+
+Answers every request with a fixed reply after a configurable delay,
+streams it in fixed-size chunks at a fixed cadence, and can inject the
+same kinds of failure the API produces: 429 quota errors (from its own
+requests-per-window quota or at random) and server errors, optionally
+part-way through a stream. Every request's size is recorded, split into
+the prompt, the system instruction and any cached content it referenced,
+and FakeCacheBackend stands in for server-side context caches. Deterministic
+for a given seed, so the app, the API and the benchmarks can run without
+network access or an API key. Selected with GEMINI_BACKEND=fake (see
+core.create_model).
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+
+DEFAULT_REPLY = ("Here is the breakdown you asked for.\n\n"
+                 "| Item | Formula | Result |\n|------|---------|--------|\n"
+                 "| Revenue | 628 × 1.05 | 659.40 |\n| Margin | 659.40 × 0.2 | 131.88 |\n")
+
+
+class FakeQuotaError(Exception):
+    """Looks like google.api_core.exceptions.ResourceExhausted"""
+    code = 429
+
+    def __init__(self):
+        super().__init__("429 Resource has been exhausted (e.g. check quota).")
+
+
+class FakeServerError(Exception):
+    """Looks like google.api_core.exceptions.InternalServerError"""
+    code = 500
+
+    def __init__(self):
+        super().__init__("500 An internal error has occurred. Please retry or report in "
+                         "https://developers.generativeai.google/guide/troubleshooting")
+
+
+class FakeCacheNotFound(Exception):
+    """Looks like the 404 for an expired or deleted cached content"""
+    code = 404
+
+    def __init__(self, name):
+        super().__init__(f"404 CachedContent not found (or permission denied): {name}")
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens, cached_tokens=0):
+        self.prompt_token_count = prompt_tokens + cached_tokens
+        self.candidates_token_count = output_tokens
+        self.cached_content_token_count = cached_tokens
+        self.total_token_count = self.prompt_token_count + output_tokens
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeStream:
+    """Iterable of chunks; usage_metadata is set once iteration finishes
+
+    `error` is raised after `error_after` chunks have been yielded.
+    """
+
+    def __init__(self, model, parts, usage, error=None, error_after=0):
+        self._model = model
+        self._parts = parts
+        self._usage = usage
+        self._error = error
+        self._error_after = error_after
+        self.usage_metadata = None
+
+    def __iter__(self):
+        for i, part in enumerate(self._parts):
+            if self._error is not None and i == self._error_after:
+                raise self._error
+            if i:
+                time.sleep(self._model.chunk_interval)
+            yield FakeChunk(part)
+        if self._error is not None:
+            raise self._error
+        self.usage_metadata = self._usage
+
+
+class FakeModel:
+    """Deterministic fake Gemini model
+
+    latency: seconds before a response (or the first chunk)
+    chunk_chars / chunk_interval: stream cadence
+    rpm / window: server-side quota, at most rpm * window / 60 requests per
+        sliding window of `window` seconds (0 = unlimited)
+    quota_error_rate: extra fraction of requests rejected at random
+    error_rate: fraction of requests failing with a server error
+    error_after: chunks a failing stream yields before the error (quota
+        errors always come on the first chunk, as with the API)
+    system_instruction: sent with every request, as the real client does
+
+    `requests` holds {"prompt_chars", "system_chars", "cached_chars"} for
+    the most recent calls.
+    """
+
+    def __init__(self, reply=DEFAULT_REPLY, latency=0.0, chunk_chars=24, chunk_interval=0.0,
+                 rpm=0, window=60.0, quota_error_rate=0.0, error_rate=0.0, error_after=0, seed=0,
+                 system_instruction=None):
+        self.reply = reply
+        self.system_instruction = system_instruction
+        self.latency = latency
+        self.chunk_chars = chunk_chars
+        self.chunk_interval = chunk_interval
+        self.rpm = rpm
+        self.window = window
+        self.quota_error_rate = quota_error_rate
+        self.error_rate = error_rate
+        self.error_after = error_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.calls = 0
+        self.quota_errors = 0
+        self.server_errors = 0
+        self.requests = deque(maxlen=10000)
+
+    @classmethod
+    def from_env(cls, system_instruction=None):
+        """Configured from FAKE_GEMINI_* variables, e.g. FAKE_GEMINI_LATENCY=0.8"""
+        def number(name, default, kind=float):
+            return kind(os.getenv(f"FAKE_GEMINI_{name}", default))
+
+        reply = DEFAULT_REPLY
+        if os.getenv("FAKE_GEMINI_REPLY_FILE"):
+            with open(os.getenv("FAKE_GEMINI_REPLY_FILE"), encoding="utf-8") as f:
+                reply = f.read()
+        return cls(reply=reply, latency=number("LATENCY", "0.3"),
+                   chunk_chars=number("CHUNK_CHARS", "24", int),
+                   chunk_interval=number("CHUNK_INTERVAL", "0.02"),
+                   rpm=number("RPM", "0", int), quota_error_rate=number("QUOTA_ERROR_RATE", "0"),
+                   error_rate=number("ERROR_RATE", "0"), error_after=number("ERROR_AFTER", "0", int),
+                   seed=number("SEED", "0", int), system_instruction=system_instruction)
+
+    def _admit(self, prompt, cached_content=None):
+        """The error this call fails with, or None if the server accepts it"""
+        with self._lock:
+            self.calls += 1
+            system = None if cached_content else self.system_instruction  # a cache carries its own
+            self.requests.append({"prompt_chars": len(prompt), "system_chars": len(system or ""),
+                                  "cached_chars": cached_content.chars if cached_content else 0})
+            if cached_content is not None and not cached_content.alive():
+                return FakeCacheNotFound(cached_content.name)
+            now = time.monotonic()
+            while self._recent and self._recent[0] <= now - self.window:
+                self._recent.popleft()
+            over_quota = self.rpm and len(self._recent) >= self.rpm * self.window / 60
+            if over_quota or self._rng.random() < self.quota_error_rate:
+                self.quota_errors += 1
+                return FakeQuotaError()
+            self._recent.append(now)
+            if self._rng.random() < self.error_rate:
+                self.server_errors += 1
+                return FakeServerError()
+            return None
+
+    def generate_content(self, contents, generation_config=None, stream=False, cached_content=None, **kwargs):
+        prompt = contents[0] if isinstance(contents, list) else contents
+        error = self._admit(prompt, cached_content)
+        system = None if cached_content else self.system_instruction
+        usage = FakeUsage((len(prompt) + len(system or "")) // 4, len(self.reply) // 4,
+                          cached_tokens=cached_content.chars // 4 if cached_content else 0)
+        if not stream:
+            if isinstance(error, (FakeQuotaError, FakeCacheNotFound)):
+                raise error
+            time.sleep(self.latency)
+            if error is not None:
+                raise error
+            return FakeResponse(self.reply, usage)
+        time.sleep(self.latency)
+        parts = [self.reply[i:i + self.chunk_chars] for i in range(0, len(self.reply), self.chunk_chars)]
+        if isinstance(error, FakeCacheNotFound):
+            raise error
+        error_after = 0 if isinstance(error, FakeQuotaError) else self.error_after
+        return FakeStream(self, parts, usage, error=error, error_after=error_after)
+
+
+class FakeCachedContent:
+    def __init__(self, name, system_instruction, chars, expires_at, clock):
+        self.name = name
+        self.system_instruction = system_instruction
+        self.chars = chars
+        self.expires_at = expires_at
+        self.deleted = False
+        self._clock = clock
+
+    def alive(self):
+        return not self.deleted and self._clock() < self.expires_at
+
+
+class FakeCachedModel:
+    """A FakeModel bound to a cached content, like GenerativeModel.from_cached_content"""
+
+    def __init__(self, model, cached_content):
+        self.model = model
+        self.cached_content = cached_content
+
+    def generate_content(self, contents, **kwargs):
+        return self.model.generate_content(contents, cached_content=self.cached_content, **kwargs)
+
+
+class FakeCacheBackend:
+    """Stand-in for Gemini cached contents (see context_cache.ContextCache)
+
+    Records what was uploaded; handles expire on `clock` and an expired or
+    deleted one makes requests fail with a 404, as on the server.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.caches = []
+        self.uploaded_chars = 0
+
+    def create(self, model_name, system_instruction, text, ttl_seconds):
+        handle = FakeCachedContent(f"cachedContents/fake-{len(self.caches)}", system_instruction,
+                                   len(text) + len(system_instruction or ""), self.clock() + ttl_seconds, self.clock)
+        self.caches.append(handle)
+        self.uploaded_chars += handle.chars
+        return handle
+
+    def model(self, handle, base_model):
+        return FakeCachedModel(base_model, handle)
+
+    def extend(self, handle, ttl_seconds):
+        if not handle.alive():
+            raise FakeCacheNotFound(handle.name)
+        handle.expires_at = self.clock() + ttl_seconds
+
+    def delete(self, handle):
+        handle.deleted = True
@@ -0,0 +1,166 @@
+"""Long-term conversation memory backed by a NumPy embedding matrix"""
+import os
+import re
+import zlib
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """Offline embedder: signed feature hashing of words and word bigrams
+
+    Deterministic across processes (crc32, not Python's salted hash), so
+    vectors can be stored and compared later.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def embed(self, texts, task_type="retrieval_document"):
+        """(len(texts), dim) float32 matrix of L2-normalised vectors
+
+        task_type is accepted for compatibility with GeminiEmbedder; hashed
+        vectors are the same for documents and queries.
+        """
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = TOKEN_RE.findall(text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+class GeminiEmbedder:
+    """Embedder backed by the Gemini embedding API
+
+    Configures the client with api_key (default GOOGLE_API_KEY) on first
+    use, so it works before the chat model has been built.
+    """
+
+    def __init__(self, model="models/text-embedding-004", api_key=None):
+        self.model = model
+        self.api_key = api_key
+        self.dim = None
+        self._genai = None
+
+    def _client(self):
+        if self._genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key or os.getenv("GOOGLE_API_KEY"))
+            self._genai = genai
+        return self._genai
+
+    def embed(self, texts, task_type="retrieval_document"):
+        """Vectors for stored turns, or with task_type="retrieval_query" for a search"""
+        result = self._client().embed_content(model=self.model, content=list(texts), task_type=task_type)
+        vectors = np.asarray(result["embedding"], dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        self.dim = vectors.shape[1]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+def get_embedder(name=None):
+    """Embedder selected by name or the MEMORY_EMBEDDER env var"""
+    name = (name or os.getenv("MEMORY_EMBEDDER") or "hashing").lower()
+    if name == "gemini":
+        return GeminiEmbedder()
+    return HashingEmbedder()
+
+
+def turn_text(msg, max_bot_chars=1000):
+    """Text embedded for one conversation turn"""
+    return f"{msg['user']}\n{msg['bot'][:max_bot_chars]}"
+
+
+class ConversationMemory:
+    """Embeddings of every turn, searchable by similarity to a question
+
+    Row i of the matrix is turn i of st.session_state.messages. The matrix
+    grows by doubling, so appending a turn is amortised O(dim). If the
+    embedder fails, the turns are left out and picked up by the next sync;
+    recall is skipped meanwhile rather than failing the request.
+    """
+
+    def __init__(self, embedder=None):
+        self.embedder = embedder or HashingEmbedder()
+        self._matrix = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, msg):
+        """Embed and store the next turn"""
+        return self.extend([msg])
+
+    def extend(self, msgs):
+        """Embed the next turns in one embedder call; False if it failed"""
+        if not msgs:
+            return True
+        try:
+            vectors = self.embedder.embed([turn_text(msg) for msg in msgs])
+        except Exception:
+            return False
+        needed = self._count + len(vectors)
+        if self._matrix is None:
+            self._matrix = np.zeros((max(16, needed), vectors.shape[1]), dtype=np.float32)
+        elif needed > len(self._matrix):
+            size = len(self._matrix)
+            while size < needed:
+                size *= 2
+            grown = np.zeros((size, self._matrix.shape[1]), dtype=np.float32)
+            grown[:self._count] = self._matrix[:self._count]
+            self._matrix = grown
+        self._matrix[self._count:needed] = vectors
+        self._count = needed
+        return True
+
+    def sync(self, history):
+        """Catch up with a messages list (rebuilds if it was cleared or replaced)"""
+        if self._count > len(history):
+            self.clear()
+        return self.extend(history[self._count:])
+
+    def clear(self):
+        self._matrix = None
+        self._count = 0
+
+    def drop_first(self, n):
+        """Forget the oldest n turns (they left the in-memory history)"""
+        if n >= self._count:
+            self.clear()
+        elif n > 0:
+            self._matrix = self._matrix[n:self._count].copy()
+            self._count -= n
+
+    @property
+    def nbytes(self):
+        return self._matrix.nbytes if self._matrix is not None else 0
+
+    def search(self, query, k=3, before=None, min_score=0.15):
+        """Indices of the k turns most similar to query, best first
+
+        Only turns with index < before are considered, so the recent window
+        that is already in the prompt can be excluded.
+        """
+        limit = self._count if before is None else min(before, self._count)
+        if limit <= 0:
+            return []
+        try:
+            query_vector = self.embedder.embed([query], task_type="retrieval_query")[0]
+        except Exception:
+            return []
+        scores = self._matrix[:limit] @ query_vector
+        k = min(k, limit)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [int(i) for i in top if scores[i] >= min_score]
@@ -0,0 +1,371 @@
+"""Parallel PDF text extraction, and lazy page access to spilled uploads"""
+import atexit
+import hashlib
+import mmap
+import multiprocessing
+import os
+import tempfile
+import threading
+import weakref
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+
+
+# Below this many pages the pool start-up costs more than it saves
+MIN_PAGES_FOR_POOL = 24
+# Pages handed to a worker per task; small enough to keep progress moving
+PAGES_PER_TASK = 16
+# Page texts a PdfHandle keeps in memory
+PAGE_CACHE_PAGES = 16
+# PyPDF2 caches every object it parses; a handle starts a fresh reader this often
+READER_PAGES = 64
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+@dataclass
+class PdfExtraction:
+    """Extracted text plus where each page starts in it"""
+    text: str
+    pages: int
+    page_offsets: list = field(default_factory=list)
+    errors: list = field(default_factory=list)  # (page_number, message)
+    page_lengths: list = field(default_factory=list)
+    leading: int = 0  # whitespace stripped from the front of the joined text
+
+    def page_for_offset(self, offset):
+        """1-based page number containing a character offset"""
+        if not self.page_offsets:
+            return 1
+        return max(1, bisect_right(self.page_offsets, offset))
+
+
+def _worker_count():
+    return max(1, min(8, (os.cpu_count() or 2) - 1))
+
+
+def _get_pool():
+    """Process pool shared by every extraction in this process"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: forking a threaded server process is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=_worker_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def _reset_pool():
+    """Drop a pool whose workers died so the next call starts fresh"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _extract_range(source, start, end):
+    """Extract pages [start, end) from a PDF path or file object
+
+    Returns a list of (index, text, error) tuples. Runs inside pool workers.
+    """
+    import PyPDF2
+
+    if isinstance(source, (str, os.PathLike)):
+        # Mapped rather than passed as a path, which PyPDF2 reads into memory whole
+        with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            reader = PyPDF2.PdfReader(mapped)
+            return [(i, *_read_page(reader, i)) for i in range(start, end)]
+    reader = PyPDF2.PdfReader(source)
+    return [(i, *_read_page(reader, i)) for i in range(start, end)]
+
+
+def _read_page(reader, i):
+    """Text and error message for one page"""
+    try:
+        return reader.pages[i].extract_text() or "", None
+    except Exception as e:
+        return "", str(e)
+
+
+def _assemble(page_texts, errors):
+    """Join per-page text once and record page start offsets"""
+    offsets = []
+    position = 0
+    for text in page_texts:
+        offsets.append(position)
+        position += len(text) + 1
+    joined = "\n".join(page_texts)
+    stripped = joined.lstrip()
+    leading = len(joined) - len(stripped)
+    offsets = [max(0, o - leading) for o in offsets]
+    return PdfExtraction(stripped.rstrip(), len(page_texts), offsets, sorted(errors),
+                         [len(text) for text in page_texts], leading)
+
+
+def extract_pdf(pdf_file, progress=None, parallel=True):
+    """Extract text from a PDF path or file-like object
+
+    Large documents are split into page ranges and extracted on a process
+    pool. `progress(done, total)` is called on the calling thread as pages
+    finish. Unreadable pages become empty strings and are listed in `errors`.
+    """
+    result = extract_many([pdf_file], progress=progress, parallel=parallel)[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def extract_many(pdf_files, progress=None, parallel=True):
+    """Extract several PDFs at once, their page ranges sharing the pool
+
+    Returns one entry per file, in order: a PdfExtraction, or the exception
+    that stopped that file (the others are unaffected). progress(done,
+    total) counts pages across all files.
+    """
+    import PyPDF2  # imported on first use: text-only chats never need it
+
+    results = [None] * len(pdf_files)
+    jobs = []  # (position, source, reader, page count)
+    for position, pdf_file in enumerate(pdf_files):
+        try:
+            if isinstance(pdf_file, PdfHandle):
+                reader = PyPDF2.PdfReader(pdf_file.open_stream())
+            else:
+                if hasattr(pdf_file, "seek"):
+                    pdf_file.seek(0)
+                reader = PyPDF2.PdfReader(pdf_file)
+            jobs.append((position, pdf_file, reader, len(reader.pages)))
+        except Exception as e:
+            results[position] = e
+    total = sum(job[3] for job in jobs)
+
+    if parallel and total >= MIN_PAGES_FOR_POOL and _worker_count() > 1:
+        try:
+            _extract_parallel(jobs, total, results, progress)
+            return results
+        except BrokenProcessPool:
+            _reset_pool()
+
+    done = 0
+    for position, _, reader, pages in jobs:
+        page_texts = [""] * pages
+        errors = []
+        for i in range(pages):
+            text, error = _read_page(reader, i)
+            page_texts[i] = text
+            if error:
+                errors.append((i + 1, error))
+            done += 1
+            if progress:
+                progress(done, total)
+        results[position] = _assemble(page_texts, errors)
+    return results
+
+
+def _extract_parallel(jobs, total, results, progress):
+    """Fill results from the process pool, one page range per task"""
+    # Workers open the documents themselves, so spill uploads to temp files
+    # instead of pickling whole byte strings into every task
+    paths = []
+    try:
+        pool = _get_pool()
+        futures = {}
+        page_texts = {}
+        errors = {}
+        for position, pdf_file, _, pages in jobs:
+            path, cleanup = _as_path(pdf_file)
+            if cleanup:
+                paths.append(path)
+            page_texts[position] = [""] * pages
+            errors[position] = []
+            for start in range(0, pages, PAGES_PER_TASK):
+                end = min(start + PAGES_PER_TASK, pages)
+                futures[pool.submit(_extract_range, path, start, end)] = (position, end - start)
+        done = 0
+        for future in as_completed(futures):
+            position, count = futures[future]
+            try:
+                for i, text, error in future.result():
+                    page_texts[position][i] = text
+                    if error:
+                        errors[position].append((i + 1, error))
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                results[position] = e
+            done += count
+            if progress:
+                progress(done, total)
+        for position in page_texts:
+            if results[position] is None:
+                results[position] = _assemble(page_texts[position], errors[position])
+    finally:
+        for path in paths:
+            os.unlink(path)
+
+
+def _as_path(pdf_file):
+    """Filesystem path for a PDF, writing file objects to a temp file"""
+    if isinstance(pdf_file, PdfHandle):
+        return pdf_file.path, False
+    if isinstance(pdf_file, (str, os.PathLike)):
+        return os.fspath(pdf_file), False
+    pdf_file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        while True:
+            block = pdf_file.read(1024 * 1024)
+            if not block:
+                break
+            tmp.write(block)
+    pdf_file.seek(0)
+    return tmp.name, True
+
+
+def _release(mapped, file, path):
+    mapped.close()
+    file.close()
+    if path is not None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class PdfHandle:
+    """A PDF on disk, memory-mapped, with page text extracted on demand
+
+    Uploads are spilled to a temp file (spill()) so nothing keeps the bytes
+    in memory; the mapping is backed by the page cache. Only the last
+    PAGE_CACHE_PAGES page texts are kept. With layout() set from the
+    extraction that indexed it, text_range() serves slices of the document
+    text, as extract_pdf() joined it, without rebuilding the whole string.
+    The temp file is removed by close(), or when the handle is collected.
+    """
+
+    def __init__(self, path, owned=False, digest=None, cache_pages=PAGE_CACHE_PAGES):
+        self.path = path
+        self.digest = digest
+        self.cache_pages = cache_pages
+        self.size = os.path.getsize(path)
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._finalizer = weakref.finalize(self, _release, self._map, self._file, path if owned else None)
+        self._lock = threading.Lock()
+        self._reader = None
+        self._reader_pages = 0
+        self._pages = OrderedDict()  # page index -> text
+        self._starts = []  # offset of each page in the joined text, before stripping
+        self._leading = 0
+        self.hits = self.misses = 0
+        if digest is None:
+            self.digest = hashlib.sha256(self._map).hexdigest()
+
+    @classmethod
+    def spill(cls, source, cache_pages=PAGE_CACHE_PAGES):
+        """Copy an upload (file object or bytes) to a temp file and map it"""
+        digest = hashlib.sha256()
+        fd, path = tempfile.mkstemp(suffix=".pdf", prefix="geminiflow-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                if isinstance(source, (bytes, bytearray, memoryview)):
+                    digest.update(source)
+                    out.write(source)
+                else:
+                    if hasattr(source, "seek"):
+                        source.seek(0)
+                    while True:
+                        block = source.read(1024 * 1024)
+                        if not block:
+                            break
+                        digest.update(block)
+                        out.write(block)
+            if not os.path.getsize(path):
+                raise ValueError("The PDF is empty")
+            return cls(path, owned=True, digest=digest.hexdigest(), cache_pages=cache_pages)
+        except BaseException:
+            os.unlink(path)
+            raise
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def close(self):
+        """Unmap the file and delete it if it was spilled"""
+        with self._lock:
+            self._reader = None
+            self._pages.clear()
+        self._finalizer()
+
+    def move(self, path):
+        """Rename the mapped file (the mapping stays valid); for files it does not own"""
+        os.replace(self.path, path)
+        self.path = path
+
+    def drop_cache(self):
+        """Forget cached page text and the reader's parsed objects"""
+        with self._lock:
+            self._pages.clear()
+            self._reader = None
+
+    def open_stream(self):
+        """A separate read-only mapping of the file, for a reader of its own"""
+        return mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def layout(self, extraction):
+        """Remember where each page sits in extraction.text"""
+        position = 0
+        self._starts = []
+        for length in extraction.page_lengths:
+            self._starts.append(position)
+            position += length + 1
+        self._leading = extraction.leading
+
+    def page_text(self, index):
+        """Text of one page (0-based), from the cache or extracted now"""
+        with self._lock:
+            text = self._pages.get(index)
+            if text is not None:
+                self._pages.move_to_end(index)
+                self.hits += 1
+                return text
+            self.misses += 1
+            if self._reader is None or self._reader_pages >= READER_PAGES:
+                import PyPDF2
+
+                self._reader = PyPDF2.PdfReader(self._map)
+                self._reader_pages = 0
+            self._reader_pages += 1
+            text = _read_page(self._reader, index)[0]
+            self._pages[index] = text
+            while len(self._pages) > self.cache_pages:
+                self._pages.popitem(last=False)
+            return text
+
+    def text_range(self, start, end):
+        """extraction.text[start:end], read from the pages it spans"""
+        start += self._leading
+        end += self._leading
+        first = max(0, bisect_right(self._starts, start) - 1)
+        last = max(first, bisect_right(self._starts, max(start, end - 1)) - 1)
+        joined = "\n".join(self.page_text(i) for i in range(first, last + 1))
+        base = self._starts[first]
+        return joined[start - base:end - base]
+
+    def iter_pages(self):
+        for index in range(len(self._starts)):
+            yield self.page_text(index)
+
+    def stats(self):
+        with self._lock:
+            return {"bytes_on_disk": self.size, "cached_pages": len(self._pages),
+                    "cached_chars": sum(len(t) for t in self._pages.values()),
+                    "page_hits": self.hits, "page_misses": self.misses}
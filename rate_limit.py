@@ -0,0 +1,240 @@
+"""Process-wide rate limiting for model calls
+
+Requests and tokens per minute are metered by two token buckets. Callers
+wait in one FIFO queue, so a burst from one session cannot starve the
+others, and a quota error from the API pauses the whole queue for a
+jittered, exponentially growing delay instead of every session retrying
+on its own.
+"""
+import random
+import threading
+import time
+from collections import deque
+
+
+class QuotaExceeded(Exception):
+    """Gave up on a request because of quota: retries or queue wait exhausted"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_quota_error(e):
+    """Whether an exception from the model client is a 429 / quota error"""
+    if isinstance(e, QuotaExceeded):
+        return True
+    if getattr(e, "code", None) == 429 or type(e).__name__ == "ResourceExhausted":
+        return True
+    text = str(e).lower()
+    return "resource_exhausted" in text or "resource has been exhausted" in text or "quota" in text
+
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 per second up to capacity
+
+    The level may go negative when a request turns out to cost more than
+    it reserved; later requests then wait for the debt to refill.
+    """
+
+    def __init__(self, per_minute, capacity=None, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.level = float(self.capacity)
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` can be taken (0 if available now)"""
+        self._refill()
+        amount = min(amount, self.capacity)  # oversized requests go through on a full bucket
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+    def give(self, amount):
+        """Return (or, if negative, additionally charge) tokens"""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Permit:
+    """A granted request; settle() corrects the token reservation"""
+
+    def __init__(self, limiter, tokens):
+        self._limiter = limiter
+        self.tokens = tokens
+
+    def settle(self, actual_tokens):
+        if actual_tokens is not None and self.tokens:
+            self._limiter._refund(self.tokens - actual_tokens)
+            self.tokens = 0
+
+
+class RateLimiter:
+    """Shared limiter with a fair queue and bounded, jittered retries
+
+    rpm / tpm of 0 disable that bucket; burst caps how many requests may
+    go out back to back (default: a full minute's worth). call() runs fn once a permit is
+    granted and retries quota errors up to max_retries times; the delay
+    after the nth failure is drawn from [d/2, d] with d = base_delay * 2**n
+    (capped at max_delay) and applies to the whole queue. A retried request
+    keeps its place at the front.
+    """
+
+    def __init__(self, rpm=0, tpm=0, burst=None, max_retries=4, base_delay=1.0, max_delay=32.0,
+                 max_wait=120.0, clock=time.monotonic):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self._clock = clock
+        self._requests = TokenBucket(rpm, burst, clock=clock) if rpm else None
+        self._tokens = TokenBucket(tpm, clock=clock) if tpm else None
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._paused_until = 0.0
+        self.granted = 0
+        self.retries = 0
+        self.quota_errors = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+
+    def _delay(self, tokens):
+        """Seconds the head of the queue must still wait (lock held)"""
+        delay = self._paused_until - self._clock()
+        if self._requests is not None:
+            delay = max(delay, self._requests.wait_time(1))
+        if self._tokens is not None and tokens:
+            delay = max(delay, self._tokens.wait_time(tokens))
+        return max(0.0, delay)
+
+    def _eta(self, position, head_delay):
+        spacing = 60.0 / self.rpm if self.rpm else 0.0
+        return head_delay + (position - 1) * spacing
+
+    def acquire(self, tokens=0, on_wait=None, timeout=None, front=False):
+        """Wait for a turn and capacity; returns a Permit
+
+        on_wait(position, eta_seconds) is called from this thread whenever
+        the request is not granted immediately (at most about once a second
+        while nothing changes). Raises QuotaExceeded after `timeout` seconds
+        (default max_wait).
+        """
+        timeout = self.max_wait if timeout is None else timeout
+        start = self._clock()
+        ticket = object()
+        reported = None
+        with self._cond:
+            if front:
+                self._queue.appendleft(ticket)
+            else:
+                self._queue.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    position = self._queue.index(ticket) + 1
+                    head_delay = self._delay(tokens if position == 1 else 0)
+                    if position == 1 and head_delay <= 0:
+                        self._queue.popleft()
+                        if self._requests is not None:
+                            self._requests.take(1)
+                        if self._tokens is not None and tokens:
+                            self._tokens.take(tokens)
+                        self.granted += 1
+                        self.wait_seconds += self._clock() - start
+                        self._cond.notify_all()
+                        return Permit(self, tokens)
+                    eta = self._eta(position, head_delay)
+                    waited = self._clock() - start
+                    if waited + (eta if position == 1 else 0) > timeout:
+                        self.rejected += 1
+                        raise QuotaExceeded("Too many requests are waiting for API capacity",
+                                            retry_after=eta)
+                if on_wait is not None and reported != (position, round(eta)):
+                    reported = (position, round(eta))
+                    on_wait(position, eta)
+                with self._cond:
+                    if self._queue[0] is ticket:
+                        self._cond.wait(min(max(head_delay, 0.01), 1.0))
+                    else:
+                        self._cond.wait(1.0)
+        finally:
+            with self._cond:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+
+    def try_acquire(self, tokens=0, headroom=0):
+        """A Permit if capacity is free right now, else None (never waits)
+
+        For background work that should only use spare capacity: nothing
+        may be queued, and at least `headroom` requests must be left in the
+        bucket afterwards for the callers that do wait.
+        """
+        with self._cond:
+            if self._queue or self._delay(tokens) > 0:
+                return None
+            if self._requests is not None and self._requests.wait_time(1 + headroom) > 0:
+                return None
+            if self._requests is not None:
+                self._requests.take(1)
+            if self._tokens is not None and tokens:
+                self._tokens.take(tokens)
+            self.granted += 1
+            return Permit(self, tokens)
+
+    def call(self, fn, tokens=0, on_wait=None, timeout=None):
+        """Run fn() under the limiter, retrying quota errors
+
+        Returns (result, permit). Raises QuotaExceeded once retries run out;
+        other exceptions propagate unchanged.
+        """
+        attempt = 0
+        while True:
+            permit = self.acquire(tokens, on_wait, timeout, front=attempt > 0)
+            try:
+                return fn(), permit
+            except Exception as e:
+                permit.settle(0)
+                if not is_quota_error(e):
+                    raise
+                delay = self.backoff(attempt)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise QuotaExceeded(f"API quota still exceeded after {self.max_retries} retries",
+                                        retry_after=delay) from e
+                self.retries += 1
+
+    def backoff(self, attempt):
+        """Pause the queue after a quota error; returns the delay"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = random.uniform(ceiling / 2, ceiling)
+        with self._cond:
+            self.quota_errors += 1
+            self._paused_until = max(self._paused_until, self._clock() + delay)
+            self._cond.notify_all()
+        return delay
+
+    def _refund(self, amount):
+        if self._tokens is not None and amount:
+            with self._cond:
+                self._tokens.give(amount)
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"rpm": self.rpm, "tpm": self.tpm, "queued": len(self._queue),
+                    "granted": self.granted, "retries": self.retries, "quota_errors": self.quota_errors,
+                    "rejected": self.rejected, "wait_seconds": round(self.wait_seconds, 3)}
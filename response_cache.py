@@ -0,0 +1,165 @@
+"""Content-addressed cache for Gemini responses"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def digest_bytes(data):
+    """SHA-256 hex digest of bytes (None stays None)"""
+    if data is None:
+        return None
+    return hashlib.sha256(data).hexdigest()
+
+
+def digest_text(text):
+    """SHA-256 hex digest of a string (None stays None)"""
+    if text is None:
+        return None
+    return digest_bytes(text.encode("utf-8"))
+
+
+def digest_image(image):
+    """Digest of a PIL image's pixels, mode and size"""
+    if image is None:
+        return None
+    h = hashlib.sha256(f"{image.mode}:{image.width}x{image.height}:".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def make_cache_key(prompt, temperature, max_tokens, image_digest=None, pdf_digest=None):
+    """Stable key covering everything that changes the model output"""
+    payload = json.dumps({
+        "prompt": prompt,
+        "temperature": round(float(temperature), 4),
+        "max_tokens": int(max_tokens),
+        "image": image_digest,
+        "pdf": pdf_digest,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Bounded LRU with TTL, backed by an optional SQLite tier
+
+    The memory tier holds at most `max_entries` responses totalling at most
+    `max_bytes`. When `db_path` is set, entries are also written to SQLite so
+    they survive restarts; the disk tier is trimmed to `max_disk_entries`.
+    Safe to share between Streamlit sessions.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024, ttl_seconds=6 * 3600,
+                 db_path=None, max_disk_entries=10000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()  # key -> (text, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        if db_path:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def get(self, key):
+        """Return the cached response or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                text, expires_at, _ = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return text
+                self._remove(key)
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+                if row:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+            self.misses += 1
+            return None
+
+    def put(self, key, text):
+        """Cache a response in every tier"""
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._store(key, text, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?)", (key, text, expires_at, now)
+                )
+                self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+                self._db.execute(
+                    "DELETE FROM responses WHERE key NOT IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT ?)",
+                    (self.max_disk_entries,)
+                )
+                self._db.commit()
+
+    def clear(self):
+        """Drop every cached response"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _store(self, key, text, expires_at):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (text, expires_at, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
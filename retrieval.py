@@ -0,0 +1,308 @@
+"""Chunking and BM25 retrieval over uploaded documents"""
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Rough per-object costs for memory_bytes(): a vocabulary entry with its two
+# posting arrays, and a Chunk
+TERM_OVERHEAD_BYTES = 300
+CHUNK_OVERHEAD_BYTES = 250
+
+# Very common words carry no ranking signal and only slow queries down
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this
+to was were will with what which who how why when where do does did can could
+should would i you we they he she them our your their me my please about
+""".split())
+
+
+@dataclass
+class Chunk:
+    """A slice of a document with its location
+
+    text[start:end] of the document it came from. Chunks of a document
+    read lazily drop their text once indexed and read() it back from
+    source, anything with text_range(start, end).
+    """
+    text: str
+    start: int
+    page: int
+    document: str = None  # name of the file it came from
+    end: int = None
+    source: object = None
+
+    def __post_init__(self):
+        if self.end is None and self.text is not None:
+            self.end = self.start + len(self.text)
+
+    @property
+    def length(self):
+        return self.end - self.start
+
+    def read(self):
+        return self.text if self.text is not None else self.source.text_range(self.start, self.end)
+
+
+def tokenize(text):
+    """Lowercased word tokens without stopwords"""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def chunk_text(text, page_offsets=None, chunk_chars=1200, overlap=150, document=None):
+    """Split text into overlapping chunks that end on whitespace
+
+    page_offsets[i] is where page i+1 starts; each chunk is tagged with the
+    page its first character falls on, and with the document name.
+    """
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_chars, length)
+        if end < length:
+            # Prefer a paragraph break, then any whitespace, in the last third
+            floor = start + chunk_chars * 2 // 3
+            cut = text.rfind("\n\n", floor, end)
+            if cut == -1:
+                cut = text.rfind(" ", floor, end)
+            if cut != -1:
+                end = cut
+        raw = text[start:end]
+        piece = raw.strip()
+        if piece:
+            page = bisect_right(page_offsets, start) if page_offsets else 1
+            offset = start + len(raw) - len(raw.lstrip())
+            chunks.append(Chunk(piece, offset, max(1, page), document))
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+class BM25Index:
+    """Incremental Okapi BM25 index over chunks
+
+    Postings are kept per term in compact int arrays while documents are
+    added and frozen into NumPy arrays on first query, so adding chunks is
+    O(tokens) and a query only touches the postings of its own terms. The
+    index never needs chunk text again once a chunk is added.
+
+    Chunks are added in groups (one per document). Removing a group
+    tombstones its chunks and lowers the document frequencies of the terms
+    whose postings fall in its id range, without re-reading any text; the
+    postings are compacted once tombstones outnumber live chunks.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks = []  # chunk id -> Chunk, or None once removed
+        self._vocab = {}
+        self._postings = []  # term id -> (chunk ids, term freqs), ascending ids
+        self._df = []  # term id -> live chunks containing it
+        self._frozen = {}  # term id -> (chunk id array, tf array)
+        self._lengths = array("i")
+        self._groups = {}  # group -> [(first id, end id)]
+        self._group_rank = {}  # group -> order it was added in
+        self._chunk_rank = array("i")  # chunk id -> its group's rank
+        self._live = 0
+        self._live_length = 0
+        self._arrays = None  # (lengths, live mask) as NumPy arrays
+        self._entries = 0  # postings across all terms
+        self._frozen_bytes = 0
+
+    def __len__(self):
+        return self._live
+
+    def add(self, chunks, group=None):
+        """Index more chunks without touching existing ones"""
+        rank = self._group_rank.setdefault(group, len(self._group_rank))
+        first = len(self.chunks)
+        for chunk in chunks:
+            chunk_id = len(self.chunks)
+            self.chunks.append(chunk)
+            self._chunk_rank.append(rank)
+            counts = {}
+            tokens = tokenize(chunk.read())
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                term_id = self._vocab.get(token)
+                if term_id is None:
+                    term_id = self._vocab[token] = len(self._postings)
+                    self._postings.append((array("i"), array("i")))
+                    self._df.append(0)
+                docs, tfs = self._postings[term_id]
+                docs.append(chunk_id)
+                tfs.append(tf)
+                self._df[term_id] += 1
+                self._entries += 1
+                self._unfreeze(term_id)
+            self._lengths.append(len(tokens))
+            self._live += 1
+            self._live_length += len(tokens)
+        if len(self.chunks) > first:
+            self._groups.setdefault(group, []).append((first, len(self.chunks)))
+        self._arrays = None
+
+    def remove(self, group):
+        """Drop a group's chunks; returns how many were removed"""
+        ranges = self._groups.pop(group, [])
+        self._group_rank.pop(group, None)
+        removed = 0
+        for first, end in ranges:
+            for term_id, (docs, _) in enumerate(self._postings):
+                hits = bisect_left(docs, end) - bisect_left(docs, first)
+                if hits:
+                    self._df[term_id] -= hits
+            for chunk_id in range(first, end):
+                self.chunks[chunk_id] = None
+                self._live_length -= self._lengths[chunk_id]
+            removed += end - first
+        self._live -= removed
+        if removed:
+            self._arrays = None
+            if len(self.chunks) - self._live > max(self._live, 64):
+                self._compact()
+        return removed
+
+    def _compact(self):
+        """Rebuild postings without removed chunks (no re-tokenizing)"""
+        new_ids = {}
+        chunks, lengths, ranks = [], array("i"), array("i")
+        for chunk_id, chunk in enumerate(self.chunks):
+            if chunk is not None:
+                new_ids[chunk_id] = len(chunks)
+                chunks.append(chunk)
+                lengths.append(self._lengths[chunk_id])
+                ranks.append(self._chunk_rank[chunk_id])
+        vocab, postings, df = {}, [], []
+        self._entries = 0
+        for token, term_id in self._vocab.items():
+            if not self._df[term_id]:
+                continue
+            docs, tfs = self._postings[term_id]
+            kept_docs, kept_tfs = array("i"), array("i")
+            for d, tf in zip(docs, tfs):
+                if d in new_ids:
+                    kept_docs.append(new_ids[d])
+                    kept_tfs.append(tf)
+            vocab[token] = len(postings)
+            postings.append((kept_docs, kept_tfs))
+            df.append(len(kept_docs))
+            self._entries += len(kept_docs)
+        self.chunks, self._lengths, self._chunk_rank = chunks, lengths, ranks
+        self._vocab, self._postings, self._df = vocab, postings, df
+        self._groups = {group: [(new_ids[first], new_ids[end - 1] + 1) for first, end in ranges]
+                        for group, ranges in self._groups.items()}
+        self.drop_caches()
+
+    def drop_caches(self):
+        """Forget the frozen postings and arrays; queries rebuild what they need"""
+        self._frozen = {}
+        self._frozen_bytes = 0
+        self._arrays = None
+
+    def memory_bytes(self):
+        """Approximate heap held by the index (not counting chunk text)"""
+        return (self._entries * 2 * 4 + len(self._postings) * TERM_OVERHEAD_BYTES
+                + len(self.chunks) * (CHUNK_OVERHEAD_BYTES + 12) + self._frozen_bytes)
+
+    def rank(self, chunk_id):
+        """Order of the chunk's group, for sorting results by document"""
+        return self._chunk_rank[chunk_id]
+
+    def live_ids(self):
+        return [i for i, chunk in enumerate(self.chunks) if chunk is not None]
+
+    def search(self, query, k=5):
+        """Top-k (chunk id, score) pairs for a query, best first"""
+        n = self._live
+        if not n:
+            return []
+        if self._arrays is None:
+            live = np.fromiter((c is not None for c in self.chunks), dtype=bool, count=len(self.chunks))
+            self._arrays = (np.asarray(self._lengths, dtype=np.float32), live)
+        lengths, live = self._arrays
+        avg_length = max(self._live_length / n, 1.0)
+        norm = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self._vocab.get(token)
+            if term_id is None or not self._df[term_id]:
+                continue
+            docs, tfs = self._frozen_postings(term_id)
+            df = self._df[term_id]
+            idf = np.log1p((n - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+        scores[~live] = 0
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def _frozen_postings(self, term_id):
+        frozen = self._frozen.get(term_id)
+        if frozen is None:
+            docs, tfs = self._postings[term_id]
+            # Copies: a view would stop the arrays from growing
+            frozen = (np.array(docs, dtype=np.int64), np.array(tfs, dtype=np.float32))
+            self._frozen[term_id] = frozen
+            self._frozen_bytes += frozen[0].nbytes + frozen[1].nbytes
+        return frozen
+
+    def _unfreeze(self, term_id):
+        frozen = self._frozen.pop(term_id, None)
+        if frozen is not None:
+            self._frozen_bytes -= frozen[0].nbytes + frozen[1].nbytes
+
+
+def build_index(text, page_offsets=None, chunk_chars=1200, document=None):
+    """Chunk a document and index it"""
+    index = BM25Index()
+    index.add(chunk_text(text, page_offsets, chunk_chars=chunk_chars, document=document))
+    return index
+
+
+def select_chunks(index, question, budget_chars=8000):
+    """Most relevant chunks for a question that fit in budget_chars
+
+    Falls back to the start of the corpus when nothing matches. Returned
+    chunks are in document order (documents in the order they were added).
+    """
+    if not len(index):
+        return []
+    k = max(1, budget_chars // 400)
+    ranked = [i for i, _ in index.search(question, k=k)] or index.live_ids()
+    selected = []
+    used = 0
+    for i in ranked:
+        chunk = index.chunks[i]
+        if used + chunk.length > budget_chars:
+            if selected:
+                continue
+            chunk = Chunk(chunk.read()[:budget_chars], chunk.start, chunk.page, chunk.document)
+        elif chunk.text is None:
+            chunk = Chunk(chunk.read(), chunk.start, chunk.page, chunk.document)
+        selected.append((index.rank(i), chunk.start, chunk))
+        used += chunk.length
+        if used >= budget_chars:
+            break
+    return [chunk for _, _, chunk in sorted(selected, key=lambda item: item[:2])]
+
+
+def format_excerpts(chunks, with_documents=False):
+    """Render chunks as page-cited excerpts for the prompt
+
+    with_documents cites the file as well: [report.pdf, Page 3].
+    """
+    if with_documents:
+        return "\n\n".join(f"[{c.document}, Page {c.page}]\n{c.text}" for c in chunks)
+    return "\n\n".join(f"[Page {c.page}]\n{c.text}" for c in chunks)
@@ -0,0 +1,207 @@
+"""Approximate per-session memory accounting, caps and idle reclaim
+
+Every live session reports what it holds (ChatSession.memory_usage(), plus
+whatever the caller keeps for it, such as UI caches) each time it is used.
+A session over its cap is shrunk at once; when the process total goes over
+its cap, or a session has been idle too long, other sessions are shrunk
+harder or evicted. What "shrink" and "evict" mean is up to the caller: the
+app frees caches, spills summarized turns to the store and re-indexes
+documents on return; the API also drops idle sessions from its registry.
+
+Sizes are estimates from string lengths, array sizes and index counts,
+good for finding heavy sessions rather than matching RSS.
+"""
+import os
+import tempfile
+import threading
+import time
+import weakref
+from dataclasses import dataclass, field
+
+# How often track() also sweeps for idle sessions
+SWEEP_INTERVAL_SECONDS = 60
+
+
+@dataclass
+class _Tracked:
+    ref: object  # weakref to the session
+    last_active: float
+    parts: dict = field(default_factory=dict)
+    shrink: object = None  # shrink(session, idle) -> bytes freed
+    evict: object = None  # evict(session) -> True if it let go of the session
+    idle_shrunk: bool = False
+
+
+class SessionMemory:
+    """Process-wide ledger of session memory with caps (bytes, 0 = none)
+
+    Sessions are held weakly, so the ledger never keeps one alive.
+    """
+
+    def __init__(self, session_cap=0, total_cap=0, idle_seconds=1800, clock=time.monotonic):
+        self.session_cap = session_cap
+        self.total_cap = total_cap
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+        self._sessions = {}  # session id -> _Tracked
+        self._lock = threading.Lock()
+        self._last_sweep = clock()
+        self._counts = {"shrunk": 0, "idle_shrunk": 0, "evicted": 0, "over_cap": 0, "freed_bytes": 0}
+
+    def track(self, session, extra=None, shrink=None, evict=None):
+        """Record a session as active and measure it; returns its parts
+
+        Shrinks it if it is over session_cap and then, if the total is over
+        total_cap, shrinks or evicts the least recently used other
+        sessions. extra adds caller-held parts, e.g. {"ui": bytes}.
+        """
+        now = self.clock()
+        parts = self._measure(session, extra)
+        with self._lock:
+            tracked = self._sessions.get(session.session_id)
+            if tracked is None or tracked.ref() is not session:
+                tracked = self._sessions[session.session_id] = _Tracked(weakref.ref(session), now)
+            tracked.last_active = now
+            tracked.parts = parts
+            tracked.shrink, tracked.evict = shrink, evict
+            tracked.idle_shrunk = False
+        if self.session_cap and sum(parts.values()) > self.session_cap and shrink is not None:
+            self._shrink(tracked, session, idle=False)
+            parts = tracked.parts = self._measure(session, extra)
+            if sum(parts.values()) > self.session_cap:
+                with self._lock:
+                    self._counts["over_cap"] += 1
+        if self.total_cap and self.total_bytes() > self.total_cap:
+            self._reclaim(exclude=session.session_id)
+        if now - self._last_sweep >= SWEEP_INTERVAL_SECONDS:
+            self.reclaim_idle()
+        return parts
+
+    def over_cap(self, session_id):
+        """Whether a tracked session is still over session_cap"""
+        with self._lock:
+            tracked = self._sessions.get(session_id)
+            return bool(tracked and self.session_cap and sum(tracked.parts.values()) > self.session_cap)
+
+    def forget(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(sum(t.parts.values()) for t in self._sessions.values() if t.ref() is not None)
+
+    def reclaim_idle(self):
+        """Shrink (or evict) sessions idle for idle_seconds; returns how many"""
+        now = self.clock()
+        self._last_sweep = now
+        with self._lock:
+            idle = [t for t in self._sessions.values()
+                    if not t.idle_shrunk and now - t.last_active >= self.idle_seconds]
+        return sum(self._release(t) for t in idle)
+
+    def _reclaim(self, exclude):
+        """Release least recently used sessions until the total fits"""
+        with self._lock:
+            candidates = sorted((t for sid, t in self._sessions.items() if sid != exclude and not t.idle_shrunk),
+                                key=lambda t: t.last_active)
+        for tracked in candidates:
+            if self.total_bytes() <= self.total_cap:
+                break
+            self._release(tracked)
+
+    def _release(self, tracked):
+        session = tracked.ref()
+        if session is None:
+            self.forget_dead()
+            return 0
+        if tracked.evict is not None and tracked.evict(session):
+            with self._lock:
+                self._sessions.pop(session.session_id, None)
+                self._counts["evicted"] += 1
+                self._counts["freed_bytes"] += sum(tracked.parts.values())
+            return 1
+        if tracked.shrink is None:
+            return 0
+        self._shrink(tracked, session, idle=True)
+        tracked.parts = self._measure(session, None, keep=tracked.parts)
+        tracked.idle_shrunk = True
+        return 1
+
+    def _shrink(self, tracked, session, idle):
+        freed = tracked.shrink(session, idle)
+        with self._lock:
+            self._counts["idle_shrunk" if idle else "shrunk"] += 1
+            self._counts["freed_bytes"] += max(0, freed)
+
+    @staticmethod
+    def _measure(session, extra, keep=None):
+        parts = dict(session.memory_usage())
+        if extra:
+            parts.update(extra)
+        elif keep:
+            parts.update({k: v for k, v in keep.items() if k not in parts})
+        return parts
+
+    def forget_dead(self):
+        """Drop entries whose session has been garbage collected"""
+        with self._lock:
+            for sid in [sid for sid, t in self._sessions.items() if t.ref() is None]:
+                del self._sessions[sid]
+
+    def stats(self, top=5):
+        """Totals for metrics: bytes by part, the heaviest sessions, counters"""
+        self.forget_dead()
+        with self._lock:
+            tracked = [(sid, t) for sid, t in self._sessions.items()]
+            counts = dict(self._counts)
+        by_part = {}
+        for _, t in tracked:
+            for part, size in t.parts.items():
+                by_part[part] = by_part.get(part, 0) + size
+        sizes = sorted(((sum(t.parts.values()), sid) for sid, t in tracked), reverse=True)
+        now = self.clock()
+        return {
+            "sessions": len(tracked),
+            "idle_sessions": sum(1 for _, t in tracked if now - t.last_active >= self.idle_seconds),
+            "total_bytes": sum(by_part.values()),
+            "by_part": by_part,
+            "largest": [{"session_id": sid, "bytes": size} for size, sid in sizes[:top]],
+            "session_cap_bytes": self.session_cap,
+            "total_cap_bytes": self.total_cap,
+            **counts,
+        }
+
+
+class SpilledUpload:
+    """An uploaded file moved to a temp file so the upload can be let go
+
+    The file is deleted by close(), or once the object is collected.
+    """
+
+    def __init__(self, upload):
+        self.name = getattr(upload, "name", "upload")
+        suffix = os.path.splitext(self.name)[1]
+        fd, self.path = tempfile.mkstemp(suffix=suffix, prefix="geminiflow-")
+        with os.fdopen(fd, "wb") as out:
+            upload.seek(0)
+            while True:
+                block = upload.read(1024 * 1024)
+                if not block:
+                    break
+                out.write(block)
+        self.size = os.path.getsize(self.path)
+        self._finalizer = weakref.finalize(self, _remove, self.path)
+
+    def open(self):
+        return open(self.path, "rb")
+
+    def close(self):
+        self._finalizer()
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
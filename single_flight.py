@@ -0,0 +1,215 @@
+"""Single-flight: identical model requests in flight at once share one call
+
+When several sessions send the same request at the same moment (the same
+shared PDF and the same quick prompt), the first one through becomes the
+leader and makes the upstream call; the others wait for its result
+instead of queueing behind the rate limiter for their own. Streamed
+responses are read by a pump thread into a shared buffer that every
+waiter replays from the start, so a waiter that joins late misses
+nothing, and one that stops reading (a closed tab, a disconnected API
+client) leaves the others streaming. The upstream stream is only
+abandoned once every waiter has gone. A leader stopped before its call
+was made hands the call over to one of the waiters.
+
+A flight is forgotten as soon as it completes; repeats after that are the
+response cache's job. Keys are built by the caller (see
+ChatPipeline._flight_key).
+"""
+import threading
+
+
+class _Abandoned(Exception):
+    """The leader left before making the call; a waiter should take over"""
+
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.value = None
+        self.error = None
+        self.done = False
+        self.abandoned = False  # leader gone before the call started
+        self.cancelled = False  # every waiter gone before the stream ended
+        self.waiters = 1
+
+
+class SingleFlight:
+    """Process-wide table of in-flight requests, keyed by the caller (thread-safe)"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.upstream = 0
+        self.cancelled = 0
+        self.abandoned = 0
+        self.max_waiters = 0
+
+    def _join(self, key, count):
+        """(flight, is_leader) for key, starting a new flight if none can be joined"""
+        with self._lock:
+            if count:
+                self.requests += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                with flight.cond:
+                    if not (flight.done or flight.abandoned or flight.cancelled):
+                        flight.waiters += 1
+                        self.max_waiters = max(self.max_waiters, flight.waiters)
+                        return flight, False
+            flight = self._flights[key] = _Flight()
+            self.upstream += 1
+            return flight, True
+
+    def _forget(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _finish(self, key, flight, value=None, error=None):
+        with flight.cond:
+            flight.value, flight.error, flight.done = value, error, True
+            flight.cond.notify_all()
+        self._forget(key, flight)
+
+    def _abandon(self, key, flight):
+        with flight.cond:
+            flight.abandoned = True
+            flight.cond.notify_all()
+        self._forget(key, flight)
+        with self._lock:
+            # Withdrawn before the call was made: neither a request nor a call
+            self.abandoned += 1
+            self.requests -= 1
+            self.upstream -= 1
+
+    def _leave(self, key, flight):
+        with flight.cond:
+            flight.waiters -= 1
+            cancel = flight.waiters == 0 and not flight.done and not flight.abandoned
+            if cancel:
+                flight.cancelled = True
+        if cancel:
+            self._forget(key, flight)
+            with self._lock:
+                self.cancelled += 1
+
+    def call(self, key, fn, out=None):
+        """fn()'s result, shared by every caller of key while it runs
+
+        Exceptions from fn() are raised to every caller. out["leader"]
+        tells whether this caller made the call.
+        """
+        counted = False
+        while True:
+            flight, leader = self._join(key, count=not counted)
+            counted = True
+            if out is not None:
+                out["leader"] = leader
+            if leader:
+                try:
+                    value = fn()
+                except Exception as e:
+                    self._finish(key, flight, error=e)
+                    raise
+                except BaseException:
+                    self._abandon(key, flight)
+                    raise
+                self._finish(key, flight, value=value)
+                return value
+            try:
+                with flight.cond:
+                    while not (flight.done or flight.abandoned):
+                        flight.cond.wait()
+                    if flight.abandoned:
+                        continue
+                    if flight.error is not None:
+                        raise flight.error
+                    return flight.value
+            finally:
+                self._leave(key, flight)
+
+    def stream(self, key, start, out=None):
+        """Yield the chunks of one upstream stream shared by every caller of key
+
+        start() runs in the leader's thread (so rate-limit waits and retries
+        report to it) and returns (chunks, value): an open iterator of
+        chunks and a value every caller receives in out["value"] once the
+        stream has ended, along with out["leader"]. An error part-way
+        through is raised to every caller after the chunks before it.
+        """
+        counted = False
+        while True:
+            flight, leader = self._join(key, count=not counted)
+            counted = True
+            if out is not None:
+                out["leader"] = leader
+            if leader:
+                try:
+                    source, value = start()
+                except Exception as e:
+                    self._finish(key, flight, error=e)
+                    raise
+                except BaseException:
+                    self._abandon(key, flight)
+                    raise
+                flight.value = value
+                threading.Thread(target=self._pump, args=(key, flight, source), daemon=True,
+                                 name="single-flight").start()
+            try:
+                yield from self._follow(key, flight)
+            except _Abandoned:
+                continue
+            if out is not None:
+                out["value"] = flight.value
+            return
+
+    def _follow(self, key, flight):
+        """Replay a flight's chunks, then wait for more until it ends"""
+        seen = 0
+        try:
+            while True:
+                with flight.cond:
+                    while seen == len(flight.chunks) and not (flight.done or flight.abandoned):
+                        flight.cond.wait()
+                    if flight.abandoned:
+                        raise _Abandoned()
+                    chunks = flight.chunks[seen:]
+                    seen = len(flight.chunks)
+                    done, error = flight.done, flight.error
+                yield from chunks
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._leave(key, flight)
+
+    def _pump(self, key, flight, source):
+        """Read the upstream stream into the flight until it ends or nobody is left"""
+        error = None
+        try:
+            for chunk in source:
+                with flight.cond:
+                    if flight.cancelled:
+                        break
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except Exception as e:
+            error = e
+        finally:
+            if flight.cancelled and hasattr(source, "close"):
+                source.close()
+            self._finish(key, flight, value=flight.value, error=error)
+
+    def stats(self):
+        """Requests seen, upstream calls made and the share that were coalesced"""
+        with self._lock:
+            requests, upstream = self.requests, self.upstream
+            return {
+                "requests": requests, "upstream": upstream, "coalesced": max(0, requests - upstream),
+                "coalescing_ratio": round(max(0, requests - upstream) / requests, 3) if requests else 0.0,
+                "in_flight": len(self._flights), "cancelled": self.cancelled, "abandoned": self.abandoned,
+                "max_waiters": self.max_waiters,
+            }
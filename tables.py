@@ -0,0 +1,160 @@
+"""Single-pass markdown table parser"""
+import re
+from dataclasses import dataclass, field
+
+ALIGNMENT_CELL_RE = re.compile(r"^:?-+:?$")
+UNESCAPED_PIPE_RE = re.compile(r"(?<!\\)\|")
+
+
+@dataclass
+class Table:
+    """One markdown table and where it sits in the source text"""
+    headers: list
+    rows: list = field(default_factory=list)
+    alignments: list = field(default_factory=list)  # "left" / "center" / "right" / None
+    start: int = 0
+    end: int = 0
+
+    @property
+    def width(self):
+        return len(self.headers)
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame(self.rows, columns=self.headers)
+
+
+def split_row(line):
+    """Cells of a table row, honouring escaped pipes (\\|)"""
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    return [cell.strip().replace("\\|", "|") for cell in UNESCAPED_PIPE_RE.split(line)]
+
+
+def parse_alignment_row(line):
+    """Column alignments if line is a |---|:--:| divider, else None"""
+    if "-" not in line:
+        return None
+    cells = split_row(line)
+    alignments = []
+    for cell in cells:
+        cell = cell.replace(" ", "")
+        if not ALIGNMENT_CELL_RE.match(cell):
+            return None
+        if cell.startswith(":") and cell.endswith(":"):
+            alignments.append("center")
+        elif cell.endswith(":"):
+            alignments.append("right")
+        elif cell.startswith(":"):
+            alignments.append("left")
+        else:
+            alignments.append(None)
+    return alignments
+
+
+class TableParser:
+    """Incremental parser: feed() text as it arrives, get finished tables
+
+    A table is a row containing pipes followed by an alignment row, then
+    every following line that contains a pipe. Tables inside fenced code
+    blocks are skipped. Ragged rows are padded; extra cells get generated
+    headers rather than being dropped. Each line is looked at once, so the
+    cost is linear in the text length.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._offset = 0  # absolute offset of the start of _buffer
+        self._in_fence = False
+        self._pending = None  # (cells, start) of a possible header row
+        self._table = None
+
+    def feed(self, text):
+        """Consume more text; returns the tables it completed"""
+        self._buffer += text
+        finished = []
+        pos = 0
+        while True:
+            newline = self._buffer.find("\n", pos)
+            if newline == -1:
+                break
+            table = self._line(self._buffer[pos:newline], self._offset + pos, self._offset + newline + 1)
+            if table is not None:
+                finished.append(table)
+            pos = newline + 1
+        self._buffer = self._buffer[pos:]
+        self._offset += pos
+        return finished
+
+    def close(self):
+        """Flush the last line; returns the tables still open"""
+        finished = []
+        if self._buffer:
+            end = self._offset + len(self._buffer)
+            table = self._line(self._buffer, self._offset, end)
+            self._offset = end
+            self._buffer = ""
+            if table is not None:
+                finished.append(table)
+        if self._table is not None:
+            finished.append(self._finish())
+        return finished
+
+    def _line(self, line, start, end):
+        stripped = line.strip()
+        finished = None
+
+        if stripped.startswith(("```", "~~~")):
+            finished = self._finish()
+            self._in_fence = not self._in_fence
+            self._pending = None
+            return finished
+        if self._in_fence:
+            return None
+
+        if self._table is not None:
+            if stripped and "|" in stripped:
+                self._add_row(split_row(stripped), end)
+                return None
+            finished = self._finish()
+
+        if self._pending is not None and "|" in stripped:
+            alignments = parse_alignment_row(stripped)
+            if alignments is not None:
+                headers, header_start = self._pending
+                self._pending = None
+                width = max(len(headers), len(alignments))
+                headers = headers + [f"Column {i + 1}" for i in range(len(headers), width)]
+                alignments = alignments + [None] * (width - len(alignments))
+                self._table = Table(headers, [], alignments[:width], header_start, end)
+                return finished
+
+        self._pending = (split_row(stripped), start) if "|" in stripped else None
+        return finished
+
+    def _add_row(self, cells, end):
+        table = self._table
+        if len(cells) > table.width:
+            for i in range(table.width, len(cells)):
+                table.headers.append(f"Column {i + 1}")
+                table.alignments.append(None)
+            for row in table.rows:
+                row.extend([""] * (len(cells) - len(row)))
+        elif len(cells) < table.width:
+            cells = cells + [""] * (table.width - len(cells))
+        table.rows.append(cells)
+        table.end = end
+
+    def _finish(self):
+        table, self._table = self._table, None
+        return table
+
+
+def iter_tables(text):
+    """Every table in text, in order"""
+    parser = TableParser()
+    yield from parser.feed(text)
+    yield from parser.close()
@@ -0,0 +1,137 @@
+"""Glassmorphism theme and the fixed HTML fragments of the page
+
+The stylesheet lives in styles/theme.css and is published once per process
+to static/theme.<hash>.css, which Streamlit serves at app/static/ when
+server.enableStaticServing is on. Each rerun then sends a short <link> tag
+instead of the whole stylesheet. The static route sends no long-lived
+Cache-Control header, so the browser revalidates the file by ETag and gets
+a 304 while it is unchanged; the content-hashed name makes any change to
+the CSS a new URL. The fragments below are built once at import.
+"""
+import glob
+import hashlib
+import os
+
+import streamlit as st
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(ROOT, "styles", "theme.css")
+STATIC_DIR = os.path.join(ROOT, "static")
+STATIC_URL = "app/static"
+
+
+def publish_stylesheet(source=SOURCE, static_dir=STATIC_DIR):
+    """Copy the stylesheet to static_dir under a content-hashed name
+
+    Returns (file name or None if it could not be written, css text).
+    Older hashed copies are removed.
+    """
+    with open(source, "rb") as f:
+        css = f.read()
+    name = f"theme.{hashlib.sha256(css).hexdigest()[:12]}.css"
+    path = os.path.join(static_dir, name)
+    try:
+        if not os.path.exists(path):
+            os.makedirs(static_dir, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(css)
+            os.replace(tmp, path)  # atomic, so another process never serves half a file
+        for stale in glob.glob(os.path.join(static_dir, "theme.*.css")):
+            if stale != path:
+                os.remove(stale)
+    except OSError:
+        name = None
+    return name, css.decode("utf-8")
+
+
+STYLESHEET_FILE, CSS = publish_stylesheet()
+INLINE_STYLE_HTML = f"<style>\n{CSS}</style>"
+LINKED_STYLE_HTML = f"<link rel='stylesheet' href='{STATIC_URL}/{STYLESHEET_FILE}'>" if STYLESHEET_FILE else None
+
+
+def stylesheet_html():
+    """The <link> to the published stylesheet, or the CSS inline
+
+    Falls back to inline when static serving is off, the file could not be
+    written, or THEME_INLINE=1.
+    """
+    inline = os.getenv("THEME_INLINE", "").lower() in ("1", "true", "yes")
+    if LINKED_STYLE_HTML and not inline and st.get_option("server.enableStaticServing"):
+        return LINKED_STYLE_HTML
+    return INLINE_STYLE_HTML
+
+
+def hint(text):
+    """Small muted line under a sidebar heading"""
+    return f"<p class='gf-hint'>{text}</p>"
+
+
+HEADER_HTML = """
+<div class='gf-header'>
+<h1>🌟 GeminiFlow</h1>
+<p class='gf-tagline'><span class='gf-dot-1'>●</span> Excel Export <span class='gf-dot-2'>●</span> Image Analysis <span class='gf-dot-3'>●</span> PDF Processing</p>
+<p class='gf-subtitle'>Experience AI-powered assistance like never before</p>
+</div>
+"""
+
+SIDEBAR_HEADER_HTML = f"""
+<div class='gf-sidebar-title'>
+<h2>🎛️ Control Hub</h2>
+{hint("Customize your experience")}
+</div>
+"""
+
+UPLOAD_HINT_HTML = hint("Drag & drop or click to browse")
+ACTIONS_HINT_HTML = hint("Manage your session")
+EXPORT_HINT_HTML = hint("Download your conversation")
+
+WELCOME_HTML = """
+<div class='gf-welcome'>
+<div class='gf-welcome-icon'>✨</div>
+<h2>Welcome to GeminiFlow</h2>
+<p class='gf-welcome-text'>Your intelligent AI companion powered by Google Gemini 2.0</p>
+</div>
+"""
+
+FEATURE_CARDS = (
+    ("excel", "📊 Excel & Data", "Tables auto-export to Excel with perfect formatting"),
+    ("math", "🔢 Math Problems", "Step-by-step solutions with clear explanations"),
+    ("image", "🖼️ Image Analysis", "Extract data, analyze charts & diagrams"),
+    ("pdf", "📄 PDF Processing", "Summarize documents & extract information"),
+)
+
+WELCOME_GUIDE = """
+### 🎯 What I Can Do For You:
+
+<div class='gf-cards'>
+{cards}
+</div>
+
+---
+
+### 💡 Pro Tips:
+
+- 🎯 **Use Quick Prompts** in the sidebar for common tasks
+- 📊 **Request "markdown table format"** for instant Excel export
+- 🎨 **Upload files first** then ask questions about them
+- ⚡ **Be specific** for the best results
+
+<div class='gf-cta'>
+<p class='gf-cta-title'>Ready to get started? 🚀</p>
+<p class='gf-cta-text'>Type your question below or try a quick prompt!</p>
+</div>
+
+---
+
+<div class='gf-credits'>
+<p class='gf-credits-title'>⚡ Powered by Google Gemini 2.0 Flash</p>
+<p class='gf-credits-text'>Built with ❤️ by <span class='gf-author'>Brijesh Singh</span></p>
+</div>
+""".format(cards="\n".join(f"<div class='gf-card gf-card-{kind}'><h4>{title}</h4><p>{text}</p></div>"
+                          for kind, title, text in FEATURE_CARDS))
+
+
+def session_meta_html(message_count, updated):
+    """Muted '• N msgs • time' suffix for a saved-session link"""
+    return f"<span class='gf-hint'>• {message_count} msgs • {updated}</span>"
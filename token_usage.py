@@ -0,0 +1,110 @@
+"""Per-request token accounting, session budgets and usage logging"""
+import json
+import logging
+import math
+import os
+import sys
+
+from context_builder import estimate_tokens
+
+# Gemini bills an image as 258 tokens per 768x768 tile (one tile if small)
+IMAGE_TILE_TOKENS = 258
+IMAGE_TILE_SIZE = 768
+SMALL_IMAGE_SIZE = 384
+
+COMPONENTS = ("instructions", "summary", "recall", "history", "document", "image", "question", "output")
+
+logger = logging.getLogger("geminiflow.usage")
+
+
+def _configure_logger():
+    """One JSON object per line on stderr, or USAGE_LOG_PATH if set"""
+    if logger.handlers:
+        return
+    path = os.getenv("USAGE_LOG_PATH")
+    handler = logging.FileHandler(path) if path else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+_configure_logger()
+
+
+def estimate_image_tokens(image):
+    """Input tokens for one PIL image"""
+    if image is None:
+        return 0
+    if image.width <= SMALL_IMAGE_SIZE and image.height <= SMALL_IMAGE_SIZE:
+        return IMAGE_TILE_TOKENS
+    tiles = math.ceil(image.width / IMAGE_TILE_SIZE) * math.ceil(image.height / IMAGE_TILE_SIZE)
+    return IMAGE_TILE_TOKENS * tiles
+
+
+def request_budget(context_tokens, max_output_tokens, session_budget=0, session_used=0):
+    """Prompt token budget for the next request, and whether it was cut
+
+    A session budget of 0 means unlimited. When the session is close to its
+    budget the prompt context shrinks (down to instructions and question)
+    instead of the request being refused.
+    """
+    budget = context_tokens
+    if session_budget:
+        remaining = session_budget - session_used - max_output_tokens
+        if remaining < budget:
+            return max(0, remaining), True
+    return budget, False
+
+
+def usage_record(sections, image=None, output_text="", usage_metadata=None, cached=False, coalesced=False):
+    """Per-component token counts for one request
+
+    Components are estimates from the context builder; prompt_tokens and
+    output_tokens come from the API's usage_metadata when it is available.
+    A coalesced request shared another session's call and is billed to it.
+    """
+    tokens = {name: int(sections.get(name, 0)) for name in COMPONENTS}
+    tokens["image"] = estimate_image_tokens(image)
+    tokens["output"] = estimate_tokens(output_text)
+    estimated_prompt = sum(v for k, v in tokens.items() if k != "output")
+    record = {
+        "components": tokens,
+        "prompt_tokens": estimated_prompt,
+        "output_tokens": tokens["output"],
+        "cached_prompt_tokens": 0,  # part of prompt_tokens read from a context cache
+        "estimated": True,
+        "cached": cached,
+        "coalesced": coalesced,
+    }
+    if usage_metadata is not None and not cached:
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", 0) or 0
+        output_tokens = getattr(usage_metadata, "candidates_token_count", 0) or 0
+        if prompt_tokens:
+            record["prompt_tokens"] = prompt_tokens
+            record["output_tokens"] = output_tokens
+            record["estimated"] = False
+        record["cached_prompt_tokens"] = getattr(usage_metadata, "cached_content_token_count", 0) or 0
+    if cached or coalesced:
+        # Served from the response cache or another session's call: nothing was billed
+        record["prompt_tokens"] = 0
+        record["output_tokens"] = 0
+    record["total_tokens"] = record["prompt_tokens"] + record["output_tokens"]
+    return record
+
+
+def add_to_totals(totals, record):
+    """Accumulate a usage record into session totals (in place)"""
+    totals["requests"] = totals.get("requests", 0) + 1
+    totals["prompt_tokens"] = totals.get("prompt_tokens", 0) + record["prompt_tokens"]
+    totals["output_tokens"] = totals.get("output_tokens", 0) + record["output_tokens"]
+    totals["total_tokens"] = totals.get("total_tokens", 0) + record["total_tokens"]
+    components = totals.setdefault("components", {})
+    for name, value in record["components"].items():
+        components[name] = components.get(name, 0) + value
+    return totals
+
+
+def log_usage(record, **fields):
+    """Emit one machine-readable JSON line per request"""
+    logger.info(json.dumps({"event": "gemini_request", **fields, **record}, default=str))
@@ -0,0 +1,218 @@
+"""Lightweight timing spans for the chat hot path
+
+    with span("pdf.extract", pages=12):
+        ...
+
+Each finished span's duration is kept in a process-wide, bounded sample
+per stage for p50/p95 reporting, and with SPAN_LOG set (a file path, or
+"stderr") the span is also written there as one JSON line. Spans opened inside another
+span on the same thread share its trace id and record it as parent.
+
+With TRACING_EXPORTER=otel each span is mirrored to an OpenTelemetry span
+through the globally configured tracer provider; if none is configured and
+OTEL_EXPORTER_OTLP_ENDPOINT is set, an OTLP exporter is installed. The
+OpenTelemetry packages are optional and only imported in that case.
+"""
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+logger = logging.getLogger("geminiflow.spans")
+
+SAMPLES_PER_STAGE = 1000
+
+_current = contextvars.ContextVar("geminiflow_span", default=None)
+
+
+def _configure_logger():
+    """One JSON object per line to SPAN_LOG (a path or "stderr"); off if unset"""
+    if logger.handlers:
+        return
+    target = os.getenv("SPAN_LOG", "")
+    logger.propagate = False
+    if target.lower() in ("", "off", "0", "false", "no"):
+        logger.addHandler(logging.NullHandler())
+        return
+    handler = logging.StreamHandler(sys.stderr) if target.lower() in ("stderr", "1", "on") \
+        else logging.FileHandler(target)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+_configure_logger()
+
+
+def _percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class StageStats:
+    """Recent span durations per stage, for p50/p95 (thread-safe)"""
+
+    def __init__(self, samples=SAMPLES_PER_STAGE):
+        self.samples = samples
+        self._durations = {}
+        self._counts = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, duration_ms, error=False):
+        with self._lock:
+            if name not in self._durations:
+                self._durations[name] = deque(maxlen=self.samples)
+            self._durations[name].append(duration_ms)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            if error:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    def summary(self):
+        """{stage: {count, errors, p50_ms, p95_ms, max_ms}} over the recent samples"""
+        with self._lock:
+            snapshot = {name: sorted(values) for name, values in self._durations.items()}
+            counts, errors = dict(self._counts), dict(self._errors)
+        return {
+            name: {
+                "count": counts[name],
+                "errors": errors.get(name, 0),
+                "p50_ms": round(_percentile(values, 0.5), 1),
+                "p95_ms": round(_percentile(values, 0.95), 1),
+                "max_ms": round(values[-1], 1),
+            }
+            for name, values in sorted(snapshot.items())
+        }
+
+    def clear(self):
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+            self._errors.clear()
+
+
+stats = StageStats()
+
+_otel_lock = threading.Lock()
+_otel_tracer = None
+_otel_checked = False
+
+
+def _get_otel_tracer():
+    """OpenTelemetry tracer when TRACING_EXPORTER=otel and the API is installed"""
+    global _otel_tracer, _otel_checked
+    if _otel_checked:
+        return _otel_tracer
+    with _otel_lock:
+        if _otel_checked:
+            return _otel_tracer
+        if os.getenv("TRACING_EXPORTER", "").lower() in ("otel", "opentelemetry", "otlp"):
+            try:
+                from opentelemetry import trace
+                _install_otlp_provider(trace)
+                _otel_tracer = trace.get_tracer("geminiflow")
+            except ImportError:
+                logger.warning(json.dumps({"event": "tracing_exporter_unavailable",
+                                           "reason": "opentelemetry is not installed"}))
+        _otel_checked = True
+    return _otel_tracer
+
+
+def _install_otlp_provider(trace):
+    """Install an OTLP exporter if nothing else configured a tracer provider"""
+    if not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return
+    from opentelemetry.sdk.trace import TracerProvider
+    if isinstance(trace.get_tracer_provider(), TracerProvider):
+        return  # already set up, e.g. by opentelemetry-instrument
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME",
+                                                                                  "geminiflow")}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+
+class Span:
+    """One timed stage; use span() rather than creating these directly
+
+    Spans that must stay open across a generator's yields (a streamed
+    model call) are started with activate=False, so they do not become the
+    parent of whatever the consumer does between chunks, and ended by hand.
+    """
+
+    def __init__(self, name, attributes, activate=True, start_time=None):
+        parent = _current.get()
+        self.name = name
+        self.attributes = dict(attributes)
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.status = "ok"
+        self.duration_ms = None
+        self._start_wall = time.time() if start_time is None else start_time
+        self.started = time.perf_counter() - (time.time() - self._start_wall)
+        self._token = _current.set(self) if activate else None
+        self._otel = None
+        tracer = _get_otel_tracer()
+        if tracer is not None:
+            from opentelemetry import trace
+            context = trace.set_span_in_context(parent._otel) if parent is not None and parent._otel else None
+            self._otel = tracer.start_span(name, context=context, start_time=int(self._start_wall * 1e9))
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:  # ended in another context; it is no longer current there anyway
+                pass
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"[:300]
+        stats.add(self.name, self.duration_ms, error=error is not None)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                "event": "span", "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id,
+                "parent_id": self.parent_id, "start": self._start_wall,
+                "duration_ms": round(self.duration_ms, 3), "status": self.status, **self.attributes,
+            }, default=str))
+        if self._otel is not None:
+            self._otel.set_attributes({k: v if isinstance(v, (bool, int, float, str)) else str(v)
+                                       for k, v in self.attributes.items()})
+            if error is not None:
+                from opentelemetry.trace import Status, StatusCode
+                self._otel.set_status(Status(StatusCode.ERROR, str(error)[:300]))
+            self._otel.end()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(error=exc if exc_type is not None and not issubclass(exc_type, GeneratorExit) else None)
+        return False
+
+
+def span(name, activate=True, **attributes):
+    """Start a span; use as a context manager or call .end() yourself"""
+    return Span(name, attributes, activate=activate)
+
+
+def record(name, duration_ms, **attributes):
+    """Log and count a stage that was timed elsewhere, ending now"""
+    finished = Span(name, attributes, activate=False, start_time=time.time() - duration_ms / 1000)
+    finished.end()
+    return finished
@@ -0,0 +1,182 @@
+"""The set of documents attached to a conversation, searched as one corpus
+
+Every document's chunks go into a single BM25 index as it is added, so a
+question is matched against all of them at once and excerpts cite the file
+and page they came from. Removing a document drops only its own chunks.
+Once indexed, a document's text lives only in its memory-mapped file; the
+limits on the number of documents and their total text
+(WORKSPACE_MAX_DOCUMENTS, WORKSPACE_MAX_CHARS) bound what the index and
+the spilled files hold per session.
+"""
+import os
+from collections import OrderedDict
+
+from pdf_extract import extract_many
+from response_cache import digest_text
+from retrieval import BM25Index, chunk_text
+
+MAX_DOCUMENTS = int(os.getenv("WORKSPACE_MAX_DOCUMENTS", "20"))
+# Extracted characters across all documents
+MAX_CHARS = int(os.getenv("WORKSPACE_MAX_CHARS", "10000000"))
+
+
+class WorkspaceFull(Exception):
+    """Adding a document would go over the workspace limits"""
+
+
+class Workspace:
+    """Documents keyed by the caller (e.g. an upload's file id), in order added"""
+
+    def __init__(self, max_documents=MAX_DOCUMENTS, max_chars=MAX_CHARS):
+        self.max_documents = max_documents
+        self.max_chars = max_chars
+        self.documents = OrderedDict()
+        self.index = BM25Index()
+        self.total_chars = 0
+        self.hibernated = False
+        self._digest = None
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __contains__(self, key):
+        return key in self.documents
+
+    def items(self):
+        return self.documents.items()
+
+    def add(self, document, key=None):
+        """Index a document; raises WorkspaceFull if it does not fit
+
+        Adding under an existing key replaces (and closes) that document.
+        Once indexed, the document's chunks drop their text.
+        """
+        key = document.name if key is None else key
+        replaced = self.documents.get(key)
+        chars = self.total_chars - (replaced.chars if replaced else 0)
+        if replaced is None and len(self.documents) >= self.max_documents:
+            raise WorkspaceFull(f"At most {self.max_documents} documents can be attached")
+        if chars + document.chars > self.max_chars:
+            raise WorkspaceFull(f"{document.name} does not fit: documents are limited to "
+                                f"{self.max_chars:,} characters of text in total")
+        if replaced is not None:
+            self.remove(key)
+        self.ensure_index()
+        self.index.add(document.chunks, group=key)
+        document.release_text()
+        self.documents[key] = document
+        self.total_chars += document.chars
+        self._digest = None
+        return key
+
+    def remove(self, key):
+        """Drop a document from the index and close its file"""
+        document = self.documents.pop(key, None)
+        if document is not None:
+            self.index.remove(key)
+            self.total_chars -= document.chars
+            self._digest = None
+            if not self.documents:
+                self.index = BM25Index()
+            document.close()
+        return document
+
+    def clear(self):
+        for document in self.documents.values():
+            document.close()
+        self.documents.clear()
+        self.index = BM25Index()
+        self.total_chars = 0
+        self.hibernated = False
+        self._digest = None
+
+    def drop_caches(self):
+        """Forget page text and query arrays; they are rebuilt on demand"""
+        self.index.drop_caches()
+        for document in self.documents.values():
+            document.handle.drop_cache()
+
+    def hibernate(self):
+        """Free the index and chunks; the documents stay on disk
+
+        ensure_index() extracts and indexes them again before the next
+        search. Returns the approximate bytes freed.
+        """
+        if self.hibernated or not self.documents:
+            return 0
+        freed = self.memory_bytes()
+        self.drop_caches()
+        self.index = BM25Index()
+        for document in self.documents.values():
+            document.chunks = []
+        self.hibernated = True
+        return freed
+
+    def ensure_index(self):
+        """Re-index hibernated documents from their files
+
+        The new index replaces the empty one only once it is complete.
+        Documents whose files can no longer be read are removed and closed;
+        returns their names.
+        """
+        if not self.hibernated:
+            return []
+        documents = list(self.documents.items())
+        results = extract_many([document.handle for _, document in documents])
+        index = BM25Index()
+        chunks = {}
+        lost = []
+        for (key, document), result in zip(documents, results):
+            if isinstance(result, Exception):
+                lost.append(key)
+                continue
+            chunks[key] = chunk_text(result.text, result.page_offsets, document=document.name)
+            index.add(chunks[key], group=key)
+        for key, document_chunks in chunks.items():
+            self.documents[key].chunks = document_chunks
+            self.documents[key].release_text()
+        self.index = index
+        self.hibernated = False
+        return [self.remove(key).name for key in lost]
+
+    def memory_bytes(self):
+        """Approximate heap held for the documents: index plus cached pages"""
+        return self.index.memory_bytes() + sum(d.handle.stats()["cached_chars"] for d in self.documents.values())
+
+    @property
+    def only(self):
+        """The single attached document, or None when there are none or several"""
+        if len(self.documents) == 1:
+            return next(iter(self.documents.values()))
+        return None
+
+    @property
+    def pages(self):
+        return sum(d.pages for d in self.documents.values())
+
+    @property
+    def word_count(self):
+        return sum(d.word_count for d in self.documents.values())
+
+    def stats(self):
+        """Documents, pages, characters, chunks and what the handles cache"""
+        handles = [d.handle.stats() for d in self.documents.values()]
+        return {"documents": len(self.documents), "pages": self.pages, "chars": self.total_chars,
+                "chunks": len(self.index), "bytes_on_disk": sum(h["bytes_on_disk"] for h in handles),
+                "cached_pages": sum(h["cached_pages"] for h in handles),
+                "cached_chars": sum(h["cached_chars"] for h in handles),
+                "index_bytes": self.index.memory_bytes(), "hibernated": self.hibernated}
+
+    @property
+    def digest(self):
+        """Content digest of every document in order; None when empty"""
+        if self._digest is None and self.documents:
+            self._digest = digest_text("\n".join(d.digest for d in self.documents.values()))
+        return self._digest
+
+    def full_text(self):
+        """Every document's text with a header per document, for small corpora"""
+        document = self.only
+        if document is not None:
+            return f"=== Document Content ===\n{document.read_text()}"
+        return "\n\n".join(f"=== Document: {d.name} ===\n{d.read_text()}" for d in self.documents.values())